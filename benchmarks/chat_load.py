@@ -0,0 +1,356 @@
+# benchmarks/chat_load.py
+"""
+Prueba de carga del chat educativo sin llamar a OpenAI.
+
+Simula N sesiones simultáneas que conversan con un asistente usando las
+mismas piezas que `pages/3_💬_chat.py`: búsqueda anticipada, memoria de la
+conversación, presupuesto de contexto, prompt del turno y respuesta por
+streaming (agente ReAct o RAG directo). Las llamadas al modelo y a los
+embeddings van a `benchmarks.fake_openai`, que se inicia automáticamente
+salvo que se indique `--base-url`.
+
+Reporta turnos por segundo, latencia total y hasta el primer token
+(p50/p95/p99), errores y memoria residente por sesión. Las trazas se
+escriben en `data/traces/chat_load.jsonl` (ver `utils.tracing`).
+
+Uso:
+
+    python -m benchmarks.chat_load --sessions 20 --turns 5
+    python -m benchmarks.chat_load --sessions 50 --mode direct --latency-ms 800 --error-rate 0.02
+    python -m benchmarks.chat_load --agent agent_20241123_025215 --output carga.json
+    python -m benchmarks.chat_load --base-url http://127.0.0.1:8780/v1
+"""
+import pysqlite3
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+import os
+import gc
+import json
+import time
+import shutil
+import argparse
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.chat_engine import (
+    AgentStream, DirectAnswerStream, SpeculativeSearch,
+    build_agent, build_chat_prompt, build_llm
+)
+from utils.context_builder import build_context, split_budget
+from utils.conversation_memory import ConversationMemory
+from utils.document_manager import DocumentManager
+from utils.openai_clients import pool_snapshots
+from utils.llm_scheduler import CONCURRENCY_ENV, TPM_ENV, build_embeddings, get_scheduler, session_scope
+from utils.retrieval import open_agent_vectorstore, search_vectorstores
+from utils.tracing import SPAN_KIND_SERVER, TRACE_FILE_ENV, set_attribute, span, traced
+from benchmarks.fake_openai import DEFAULT_PORT, FakeOpenAIConfig, create_server
+from benchmarks.vector_backends import build_synthetic_store
+
+DEFAULT_QUESTIONS_FILE = os.path.join("benchmarks", "questions.example.json")
+
+FALLBACK_QUESTIONS = [
+    "¿Qué es la democracia?",
+    "¿Cuáles son las clases sociales en el Perú?",
+    "¿Para qué se usa Python?",
+    "Explica el concepto principal del documento"
+]
+
+def current_rss_bytes() -> int:
+    """Memoria residente actual del proceso."""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Sin /proc: pico de memoria (KB en Linux, bytes en macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def load_questions(path: Optional[str]) -> List[str]:
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return [q['question'] if isinstance(q, dict) else q for q in json.load(f)]
+    return FALLBACK_QUESTIONS
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+def start_fake_server(args) -> str:
+    config = FakeOpenAIConfig(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        embedding_latency_ms=args.embedding_latency_ms,
+        error_rate=args.error_rate,
+        dim=args.dim,
+        seed=0
+    )
+    server = create_server(config, "127.0.0.1", args.port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def agent_config(args, saved_agent: Optional[Dict]) -> Dict:
+    """Configuración del asistente simulado (o la de un asistente guardado)."""
+    config = {
+        'name': "Tutor de Prueba",
+        'role': "Tutor Personal",
+        'style': "Balanceado",
+        'detail_level': "Moderado",
+        'temperature': 0.7,
+        'max_tokens': 2048,
+        'context_window': 5,
+        'context_budget': None,
+        'answer_mode': args.mode
+    }
+    if saved_agent:
+        config.update({k: v for k, v in saved_agent.items() if k in config})
+        if args.mode_given:
+            config['answer_mode'] = args.mode
+    return config
+
+class SimulatedSession:
+    """
+    Una conversación del chat educativo: mantiene su agente, su memoria y
+    sus mensajes como lo hace `st.session_state` en la página.
+    """
+
+    def __init__(self, session_id: int, config: Dict, open_stores, embeddings):
+        self.session_id = session_id
+        self.config = config
+        self.vectorstores = open_stores()
+        self.embeddings = embeddings
+        self.memory = ConversationMemory(key=f"simulada_{session_id}")
+        self.messages: List[Dict] = []
+        self.agent = None
+        self.speculative = None
+        self.history_budget, self.chunk_budget = split_budget(config.get('context_budget'))
+
+    @traced("search_documents")
+    def search_documents(self, query: str) -> str:
+        try:
+            results = self.speculative.results_for(query)
+            context, _ = build_context(results, query, self.chunk_budget)
+            return context
+        except Exception as e:
+            return f"Error al buscar: {str(e)}"
+
+    def turn(self, query: str) -> Dict:
+        # Mismo span raíz que la página, para ver la carga en la página de administración
+        with span("page.chat", kind=SPAN_KIND_SERVER, load_test=True):
+            set_attribute('chat.turn', True)
+            return self._turn(query)
+
+    def _turn(self, query: str) -> Dict:
+        start = time.perf_counter()
+        self.messages.append({"role": "user", "content": query})
+
+        self.speculative = SpeculativeSearch(
+            query,
+            self.embeddings.embed_query,
+            lambda q, embedding: search_vectorstores(
+                self.vectorstores, q, self.config['context_window'], embedding
+            )
+        )
+
+        direct_mode = self.config.get('answer_mode') == "direct"
+        if not direct_mode and self.agent is None:
+            self.agent = build_agent(self.config, self.search_documents)
+            self.agent.verbose = False
+
+        recent_history, _ = self.memory.render(self.messages[:-1], self.history_budget)
+        prompt_text = build_chat_prompt(self.config, recent_history, query, direct_mode)
+        if direct_mode:
+            stream = DirectAnswerStream(build_llm(self.config), prompt_text, query, self.search_documents)
+        else:
+            stream = AgentStream(self.agent, prompt_text)
+
+        first_token = None
+        parts = []
+        for token in stream:
+            if first_token is None:
+                first_token = time.perf_counter()
+            parts.append(token)
+        end = time.perf_counter()
+
+        self.messages.append({"role": "assistant", "content": stream.response or "".join(parts)})
+        self.memory.update(self.messages)
+        return {
+            'latency_ms': (end - start) * 1000,
+            'ttft_ms': ((first_token or end) - start) * 1000
+        }
+
+def run_load(args, config: Dict, questions: List[str], open_stores, embeddings) -> Dict:
+    measurements: List[Dict] = []
+    errors: List[str] = []
+    sessions: List[SimulatedSession] = []
+    lock = threading.Lock()
+
+    gc.collect()
+    rss_before = current_rss_bytes()
+
+    def run_session(session_id: int) -> None:
+        # Cada sesión simulada tiene su propia fila en el planificador
+        with session_scope(f"simulada_{session_id}"):
+            run_turns(session_id)
+
+    def run_turns(session_id: int) -> None:
+        session = SimulatedSession(session_id, config, open_stores, embeddings)
+        with lock:
+            sessions.append(session)
+        for turn_num in range(args.turns):
+            query = questions[(session_id + turn_num) % len(questions)]
+            try:
+                result = session.turn(query)
+                with lock:
+                    measurements.append(result)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {str(e)}")
+            if args.think_time:
+                time.sleep(args.think_time)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+        list(executor.map(run_session, range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    # Incluir los resúmenes en segundo plano en la memoria medida
+    for session in sessions:
+        session.memory.wait(timeout=30)
+    gc.collect()
+    rss_after = current_rss_bytes()
+
+    latencies = [m['latency_ms'] for m in measurements]
+    ttfts = [m['ttft_ms'] for m in measurements]
+    return {
+        'sessions': args.sessions,
+        'turns': len(measurements),
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'elapsed_s': elapsed,
+        'throughput_tps': len(measurements) / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_ms': percentile(latencies, 50),
+        'latency_p95_ms': percentile(latencies, 95),
+        'latency_p99_ms': percentile(latencies, 99),
+        'ttft_p50_ms': percentile(ttfts, 50),
+        'ttft_p95_ms': percentile(ttfts, 95),
+        'ttft_p99_ms': percentile(ttfts, 99),
+        'rss_before_mb': rss_before / 1024 ** 2,
+        'rss_after_mb': rss_after / 1024 ** 2,
+        'memory_per_session_kb': (rss_after - rss_before) / 1024 / max(1, len(sessions)),
+        'scheduler': get_scheduler().snapshot(),
+        'http_pools': pool_snapshots()
+    }
+
+def print_summary(report: Dict) -> None:
+    print(f"\n=== {report['sessions']} sesiones, modo {report['mode']} ===")
+    print(f"Turnos:            {report['turns']} ({report['errors']} con error)")
+    print(f"Duración:          {report['elapsed_s']:.1f} s")
+    print(f"Rendimiento:       {report['throughput_tps']:.2f} turnos/s")
+    print(f"Latencia p50/p95/p99:      {report['latency_p50_ms']:.0f} / {report['latency_p95_ms']:.0f} / {report['latency_p99_ms']:.0f} ms")
+    print(f"Primer token p50/p95/p99:  {report['ttft_p50_ms']:.0f} / {report['ttft_p95_ms']:.0f} / {report['ttft_p99_ms']:.0f} ms")
+    print(f"Memoria:           {report['rss_before_mb']:.0f} -> {report['rss_after_mb']:.0f} MB "
+          f"({report['memory_per_session_kb']:.0f} KB por sesión)")
+    scheduler = report['scheduler']
+    print(f"Planificador:      {scheduler['granted']} solicitudes a OpenAI, "
+          f"{scheduler['rate_limited']} con límite de tasa (429)")
+    for pool in report['http_pools']:
+        print(f"Conexiones HTTP:   {pool['connections_opened']} abiertas para {pool['requests']} solicitudes "
+              f"({pool['reuse_pct']:.0f}% reutilizadas)")
+    for sample in report['error_samples']:
+        print(f"  error: {sample}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del chat con un OpenAI simulado")
+    parser.add_argument("--sessions", type=int, default=10, help="Sesiones simultáneas")
+    parser.add_argument("--turns", type=int, default=5, help="Preguntas por sesión")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Segundos entre preguntas de una sesión")
+    parser.add_argument("--mode", choices=["agent", "direct"], default=None,
+                        help="Modo de respuesta (por defecto el del asistente o 'agent')")
+    parser.add_argument("--agent", help="ID de un asistente de saved_agents.json (usa sus documentos)")
+    parser.add_argument("--synthetic", type=int, default=2000,
+                        help="Fragmentos del vectorstore sintético si no se indica --agent")
+    parser.add_argument("--shared-stores", action="store_true",
+                        help="Todas las sesiones comparten los vectorstores abiertos")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS_FILE, help="Archivo JSON de preguntas")
+    parser.add_argument("--base-url", help="Usar un servidor ya iniciado en lugar del simulado interno")
+    parser.add_argument("--port", type=int, default=0,
+                        help=f"Puerto del servidor simulado (0 = libre; el independiente usa {DEFAULT_PORT})")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Espera hasta el primer token")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Velocidad de generación")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Largo de las respuestas")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="Latencia de /embeddings")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de solicitudes que fallan")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimensión de los embeddings simulados")
+    parser.add_argument("--tpm", type=int, help="Tokens por minuto del planificador de OpenAI")
+    parser.add_argument("--concurrency", type=int, help="Solicitudes simultáneas a OpenAI del planificador")
+    parser.add_argument("--output", help="Guardar el resumen en un archivo JSON")
+    args = parser.parse_args()
+    args.mode_given = args.mode is not None
+    args.mode = args.mode or "agent"
+
+    # Las trazas de la prueba no se mezclan con las de uso real
+    os.environ.setdefault(TRACE_FILE_ENV, os.path.join("data", "traces", "chat_load.jsonl"))
+
+    base_url = args.base_url or start_fake_server(args)
+    # Los clientes de OpenAI leen estas variables al crearse
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_BASE"] = base_url
+    if not args.base_url:
+        os.environ["OPENAI_API_KEY"] = "fake"
+
+    if args.tpm:
+        os.environ[TPM_ENV] = str(args.tpm)
+    if args.concurrency:
+        os.environ[CONCURRENCY_ENV] = str(args.concurrency)
+
+    # Sin contar tokens con tiktoken: no requiere descargar el codificador
+    embeddings = build_embeddings(check_embedding_ctx_length=False)
+
+    saved_agent = None
+    synthetic_dir = None
+    if args.agent:
+        with open(os.path.join("data", "saved_agents.json"), 'r') as f:
+            saved_agent = json.load(f)[args.agent]
+        doc_manager = DocumentManager()
+        docs = [doc_manager.get_document(d['hash']) for d in saved_agent['docs']]
+        docs = [d for d in docs if d and os.path.exists(d.get('vectorstore_path', ''))]
+    else:
+        synthetic_dir = build_synthetic_store(args.synthetic, args.dim)
+        docs = [{'hash': "sintetico", 'title': "Documento sintético", 'vectorstore_path': synthetic_dir}]
+
+    if not docs:
+        print("No hay vectorstores disponibles para el asistente")
+        return
+
+    config = agent_config(args, saved_agent)
+
+    def open_stores():
+        return [open_agent_vectorstore(doc, config['context_window'], embeddings) for doc in docs]
+
+    if args.shared_stores:
+        shared = open_stores()
+        open_stores = lambda: shared
+
+    try:
+        report = {
+            'mode': config['answer_mode'],
+            'base_url': base_url,
+            'documents': [doc['title'] for doc in docs],
+            **run_load(args, config, load_questions(args.questions), open_stores, embeddings)
+        }
+    finally:
+        if synthetic_dir:
+            shutil.rmtree(synthetic_dir, ignore_errors=True)
+
+    print_summary(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nResumen guardado en {args.output}")
+
+if __name__ == "__main__":
+    main()
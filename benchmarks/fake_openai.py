@@ -0,0 +1,299 @@
+# benchmarks/fake_openai.py
+"""
+Servidor local que imita los endpoints de OpenAI que usa la aplicación:
+`/v1/chat/completions` (con y sin streaming) y `/v1/embeddings`.
+
+Sirve para pruebas de carga sin costo ni límites de tasa. La latencia
+hasta el primer token, la velocidad de generación y la tasa de errores son
+configurables. Las respuestas siguen el formato ReAct cuando el prompt es
+del agente: primero pide `search_documents` y, con la observación, da la
+respuesta final. Los embeddings son vectores deterministas por texto.
+
+Uso:
+
+    python -m benchmarks.fake_openai --port 8780 --latency-ms 400 --tokens-per-second 40
+    OPENAI_BASE_URL=http://127.0.0.1:8780/v1 OPENAI_API_KEY=fake streamlit run app.py
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_PORT = 8780
+
+ANSWER_TEXT = (
+    "Según los documentos, el tema se explica a partir de sus conceptos "
+    "principales, sus causas y sus consecuencias [Documento]. "
+)
+
+class FakeOpenAIConfig:
+    """Comportamiento del servidor simulado."""
+
+    def __init__(self, latency_ms: float = 300, tokens_per_second: float = 50,
+                 answer_tokens: int = 120, embedding_latency_ms: float = 50,
+                 error_rate: float = 0.0, dim: int = 1536, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.embedding_latency_ms = embedding_latency_ms
+        self.error_rate = error_rate
+        self.dim = dim
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.stats = {'chat': 0, 'embeddings': 0, 'errors': 0}
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+def fake_embedding(text, dim: int) -> np.ndarray:
+    """Vector unitario determinista a partir del texto (o de sus tokens)."""
+    payload = text if isinstance(text, str) else json.dumps(text)
+    seed = int.from_bytes(hashlib.sha1(payload.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+def message_text(messages: List[Dict]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get('content') or ""
+        if isinstance(content, list):
+            content = " ".join(part.get('text', '') for part in content if isinstance(part, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+def build_reply(prompt: str, answer_tokens: int) -> str:
+    """Respuesta ReAct para el agente, texto plano para el resto."""
+    answer_words = (ANSWER_TEXT * (answer_tokens // 20 + 1)).split()[:answer_tokens]
+    answer = " ".join(answer_words)
+
+    if "search_documents" in prompt and "Action Input" in prompt:
+        # Las instrucciones del formato ReAct también mencionan "Observation:";
+        # solo cuenta lo que viene después de la pregunta
+        scratchpad = prompt[prompt.rfind("Question:"):]
+        if "Observation:" in scratchpad:
+            return f"Thought: Ya tengo la información necesaria.\nFinal Answer: {answer}"
+        match = re.search(r'Consulta actual:\s*(.+)', prompt)
+        query = match.group(1).strip() if match else "consulta"
+        return f"Thought: Debo buscar en los documentos.\nAction: search_documents\nAction Input: {query}"
+    return answer
+
+def apply_stop(text: str, stop) -> str:
+    if not stop:
+        return text
+    for sequence in ([stop] if isinstance(stop, str) else stop):
+        index = text.find(sequence)
+        if index >= 0:
+            text = text[:index]
+    return text
+
+def split_tokens(text: str) -> List[str]:
+    """Aproximación de tokens: palabras con su espacio o salto de línea."""
+    return re.findall(r'\S+\s*|\s+', text)
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: FakeOpenAIConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self) -> None:
+        self.config.count('errors')
+        status = random.choice([429, 500, 503])
+        self._send_json(status, {'error': {
+            'message': "Error simulado por el servidor de pruebas",
+            'type': "server_error" if status != 429 else "rate_limit_exceeded",
+            'code': None
+        }})
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': "JSON inválido"}})
+            return
+
+        path = self.path.rstrip("/")
+        if path.endswith("/embeddings"):
+            self.handle_embeddings(request)
+        elif path.endswith("/chat/completions"):
+            self.handle_chat(request)
+        else:
+            self._send_json(404, {'error': {'message': f"Ruta no soportada: {self.path}"}})
+
+    def handle_embeddings(self, request: Dict) -> None:
+        self.config.count('embeddings')
+        time.sleep(self.config.embedding_latency_ms / 1000)
+        if self.config.should_fail():
+            self._send_error()
+            return
+
+        inputs = request.get('input', [])
+        # Un texto, una lista de textos o listas de tokens
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text, request.get('dimensions') or self.config.dim)
+            if request.get('encoding_format') == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode('ascii')
+            else:
+                embedding = vector.tolist()
+            data.append({'object': "embedding", 'index': index, 'embedding': embedding})
+
+        self._send_json(200, {
+            'object': "list",
+            'data': data,
+            'model': request.get('model', "text-embedding-ada-002"),
+            'usage': {'prompt_tokens': 0, 'total_tokens': 0}
+        })
+
+    def handle_chat(self, request: Dict) -> None:
+        self.config.count('chat')
+        if self.config.should_fail():
+            time.sleep(self.config.latency_ms / 1000)
+            self._send_error()
+            return
+
+        prompt = message_text(request.get('messages', []))
+        max_tokens = request.get('max_tokens') or request.get('max_completion_tokens') or self.config.answer_tokens
+        reply = apply_stop(build_reply(prompt, min(self.config.answer_tokens, max_tokens)), request.get('stop'))
+        tokens = split_tokens(reply)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        model = request.get('model', "gpt-4")
+        usage = {
+            'prompt_tokens': len(split_tokens(prompt)),
+            'completion_tokens': len(tokens),
+            'total_tokens': len(split_tokens(prompt)) + len(tokens)
+        }
+
+        time.sleep(self.config.latency_ms / 1000)
+        delay = 1 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0
+
+        if not request.get('stream'):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {
+                'id': completion_id,
+                'object': "chat.completion",
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': "assistant", 'content': reply},
+                    'finish_reason': "stop"
+                }],
+                'usage': usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(delta: Dict, finish_reason: Optional[str] = None) -> bytes:
+            chunk = {
+                'id': completion_id,
+                'object': "chat.completion.chunk",
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            return f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+
+        try:
+            self._write_chunk(event({'role': "assistant", 'content': ""}))
+            for token in tokens:
+                self._write_chunk(event({'content': token}))
+                time.sleep(delay)
+            self._write_chunk(event({}, "stop"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente canceló la respuesta
+            self.close_connection = True
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Los clientes cierran conexiones keep-alive sin aviso
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+def create_server(config: FakeOpenAIConfig, host: str = "127.0.0.1",
+                  port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    handler = type("ConfiguredFakeOpenAIHandler", (FakeOpenAIHandler,), {'config': config})
+    server = FakeOpenAIServer((host, port), handler)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Espera hasta el primer token")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Velocidad de generación")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Largo de las respuestas")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="Latencia de /embeddings")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fracción de solicitudes que fallan con 429/500/503")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimensión de los embeddings")
+    parser.add_argument("--seed", type=int, default=None, help="Semilla de los errores simulados")
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        embedding_latency_ms=args.embedding_latency_ms,
+        error_rate=args.error_rate,
+        dim=args.dim,
+        seed=args.seed
+    )
+    server = create_server(config, args.host, args.port)
+    print(f"OpenAI simulado en http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Solicitudes: {config.stats}")
+
+if __name__ == "__main__":
+    main()
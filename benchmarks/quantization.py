@@ -0,0 +1,183 @@
+# benchmarks/quantization.py
+"""
+Reporta el compromiso entre recall, memoria y disco de los índices cuantizados.
+
+Para cada documento (o un vectorstore sintético) se generan índices int8 y
+PQ y se mide el recall@k frente a la búsqueda exacta en float32, con y sin
+re-puntuación, junto con la memoria residente que agrega cada índice al
+abrirlo y buscar (RSS del proceso, incluidas las páginas del memory-map
+leídas al re-puntuar) y su tamaño en disco. Los índices no usan Chroma al
+buscar; su tamaño se muestra como referencia porque se conserva. Uso:
+
+    python -m benchmarks.quantization
+    python -m benchmarks.quantization --synthetic 20000 --pq-subspaces 48
+"""
+import pysqlite3
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+import os
+import gc
+import shutil
+import multiprocessing
+import argparse
+import tempfile
+from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from langchain_chroma import Chroma
+
+from utils.document_manager import DocumentManager
+from utils.numpy_store import NumpyVectorStore
+from utils.quantized_store import QuantizedVectorStore
+from benchmarks.chat_load import current_rss_bytes
+from benchmarks.vector_backends import (
+    build_synthetic_store, dir_size, make_queries, percentile, time_search
+)
+
+def recall_at_k(store: NumpyVectorStore, queries: np.ndarray, truth: List[set], k: int, **kwargs) -> float:
+    hits = 0
+    for query, expected in zip(queries, truth):
+        hits += len(expected & {i for i, _ in store.top_k(query, k, **kwargs)})
+    return hits / (k * len(queries))
+
+def measure_store(index_dir: str, queries: np.ndarray, truth: List[set], k: int,
+                  rescore_factor: Optional[int] = None, rescore: bool = True) -> Dict:
+    """
+    Abrir un índice (cuantizado si se indica `rescore_factor`), ejecutar
+    todas las consultas y medir cuánta memoria residente agregó al proceso.
+    Se ejecuta en un proceso nuevo para que la memoria liberada por otras
+    mediciones no se reutilice y oculte el costo.
+    """
+    gc.collect()
+    before = current_rss_bytes()
+    if rescore_factor is None:
+        store = NumpyVectorStore(index_dir, None)
+        kwargs = {}
+        label = "float32"
+    else:
+        store = QuantizedVectorStore(index_dir, None, rescore_factor=rescore_factor)
+        kwargs = {'rescore': rescore}
+        label = store.method if store.method == "int8" else f"pq{store.codes.shape[1]}"
+    latencies = time_search(lambda q: store.top_k(q, k, **kwargs), queries)
+    recall = recall_at_k(store, queries, truth, k, **kwargs)
+    return {
+        'index': label,
+        'ram_bytes': max(0, current_rss_bytes() - before),
+        'recall': recall,
+        'p50': percentile(latencies, 50)
+    }
+
+def measure_in_process(*args, **kwargs) -> Dict:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(measure_store, *args, **kwargs).result()
+
+def benchmark_store(name: str, chroma_dir: str, k: int, num_queries: int, noise: float,
+                    rescore_factors: List[int], pq_subspaces: int) -> List[Dict]:
+    chroma = Chroma(persist_directory=chroma_dir, embedding_function=None)
+    base_dir = tempfile.mkdtemp(prefix="bench_quant_")
+    rows = []
+    try:
+        exact_dir = os.path.join(base_dir, "float32")
+        exact = NumpyVectorStore.from_chroma(chroma, exact_dir)
+        if len(exact) == 0:
+            print(f"{name}: sin embeddings, se omite")
+            return []
+
+        embeddings = np.asarray(exact.matrix, dtype=np.float32)
+        queries = make_queries(embeddings, num_queries, noise, seed=42)
+        truth = [{i for i, _ in exact.top_k(q, k)} for q in queries]
+
+        exact_disk = dir_size(exact_dir)
+        rows.append({
+            'store': name, 'index': 'chroma', 'rescore': '-',
+            'ram_bytes': None, 'ratio': None,
+            'disk_bytes': dir_size(chroma_dir), 'disk_ratio': dir_size(chroma_dir) / exact_disk,
+            'recall': None, 'p50': None
+        })
+        stats = measure_in_process(exact_dir, queries, truth, k)
+        exact_ram = max(stats['ram_bytes'], 1)
+        rows.append({
+            'store': name, 'rescore': '-',
+            'ratio': 1.0, 'disk_bytes': exact_disk, 'disk_ratio': 1.0, **stats
+        })
+
+        for method in ["int8", "pq"]:
+            index_dir = os.path.join(base_dir, method)
+            shutil.copytree(exact_dir, index_dir)
+            QuantizedVectorStore.quantize_index(index_dir, method, pq_subspaces)
+            disk_bytes = dir_size(index_dir)
+
+            for factor in [0] + rescore_factors:
+                rescore = factor > 0
+                stats = measure_in_process(
+                    index_dir, queries, truth, k, rescore_factor=max(factor, 1), rescore=rescore
+                )
+                rows.append({
+                    'store': name,
+                    'rescore': f"x{factor}" if rescore else "no",
+                    'ratio': stats['ram_bytes'] / exact_ram,
+                    'disk_bytes': disk_bytes,
+                    'disk_ratio': disk_bytes / exact_disk,
+                    **stats
+                })
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+    return rows
+
+def print_report(rows: List[Dict], k: int) -> None:
+    header = (
+        f"{'Documento':<40} {'Índice':<8} {'Re-punt.':>8} {'RSS KB':>10} {'% RSS':>7} "
+        f"{'Disco KB':>10} {'% Disco':>8} {f'Recall@{k}':>10} {'p50 ms':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        if row['ram_bytes'] is None:
+            # Chroma: solo el tamaño en disco, como referencia
+            print(
+                f"{row['store'][:40]:<40} {row['index']:<8} {'-':>8} {'-':>10} {'-':>7} "
+                f"{row['disk_bytes'] / 1024:>10.1f} {row['disk_ratio'] * 100:>7.1f}% {'-':>10} {'-':>8}"
+            )
+            continue
+        print(
+            f"{row['store'][:40]:<40} {row['index']:<8} {row['rescore']:>8} "
+            f"{row['ram_bytes'] / 1024:>10.1f} {row['ratio'] * 100:>6.1f}% "
+            f"{row['disk_bytes'] / 1024:>10.1f} {row['disk_ratio'] * 100:>7.1f}% "
+            f"{row['recall']:>10.3f} {row['p50']:>8.2f}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs memoria de los índices cuantizados")
+    parser.add_argument("--k", type=int, default=5, help="Fragmentos por consulta")
+    parser.add_argument("--queries", type=int, default=100, help="Consultas por documento")
+    parser.add_argument("--noise", type=float, default=0.02, help="Ruido agregado a las consultas")
+    parser.add_argument("--rescore", type=int, nargs="+", default=[2, 4, 8],
+                        help="Factores de candidatos a re-puntuar")
+    parser.add_argument("--pq-subspaces", type=int, default=96, help="Subespacios de PQ")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Usar un vectorstore sintético con N fragmentos en lugar de processed_docs")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimensión de los embeddings sintéticos")
+    args = parser.parse_args()
+
+    rows = []
+    if args.synthetic:
+        chroma_dir = build_synthetic_store(args.synthetic, args.dim)
+        try:
+            rows.extend(benchmark_store(f"sintético ({args.synthetic})", chroma_dir, args.k,
+                                        args.queries, args.noise, args.rescore, args.pq_subspaces))
+        finally:
+            shutil.rmtree(chroma_dir, ignore_errors=True)
+    else:
+        doc_manager = DocumentManager()
+        for doc in doc_manager.metadata.values():
+            path = doc.get('vectorstore_path', '')
+            if os.path.exists(os.path.join(path, "chroma.sqlite3")):
+                rows.extend(benchmark_store(doc['title'], path, args.k, args.queries,
+                                            args.noise, args.rescore, args.pq_subspaces))
+
+    print_report(rows, args.k)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# benchmarks/retrieval.py
+"""
+Mide la calidad y la latencia de la búsqueda de los chats.
+
+Ejecuta un conjunto de preguntas con etiquetas de referencia contra los
+vectorstores de `processed_docs`, usando la misma búsqueda que los chats
+(`utils.retrieval.search_vectorstores` sobre los retrievers de
+`utils.vector_backends`), y reporta recall@k, MRR y latencias p50/p95/p99.
+
+Formato del archivo de preguntas (JSON, lista de objetos):
+
+    {
+        "question": "¿Qué es Python?",
+        "doc_hashes": ["4fb0..."],         # opcional, por defecto los del agente
+        "gold_pages": [2],                 # páginas relevantes (desde 1)
+        "gold_texts": ["Creado a principios"]  # o fragmentos de texto relevantes
+    }
+
+Uso:
+
+    python -m benchmarks.retrieval --questions benchmarks/questions.example.json
+    python -m benchmarks.retrieval --questions q.json --agent agent_20241123_025215
+    python -m benchmarks.retrieval --questions q.json --concurrency 32 --rounds 5
+"""
+import pysqlite3
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai.embeddings import OpenAIEmbeddings
+
+from utils.document_manager import DocumentManager
+from utils.retrieval import search_vectorstores, open_agent_vectorstore
+from utils.vector_backends import VECTOR_BACKENDS
+
+EMBEDDING_CACHE_FILE = os.path.join("data", "benchmarks", "query_embeddings.json")
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Memoriza los embeddings de las preguntas para no pagarlos en cada ronda.
+    Con el caché caliente la latencia medida es solo la de la búsqueda.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_file: str = EMBEDDING_CACHE_FILE):
+        self._embeddings = embeddings
+        self.cache_file = cache_file
+        self._cache: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                self._cache = json.load(f)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            cached = self._cache.get(text)
+        if cached is not None:
+            return cached
+        vector = self._embeddings.embed_query(text)
+        with self._lock:
+            self._cache[text] = vector
+        return vector
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file, 'w', encoding='utf-8') as f:
+            json.dump(self._cache, f)
+
+def load_questions(path: str) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def is_relevant(result: Dict, question: Dict) -> bool:
+    """Un fragmento es relevante si coincide con alguna etiqueta de referencia."""
+    if question.get('doc_hashes') and result.get('hash') not in question['doc_hashes']:
+        return False
+    page = result['metadata'].get('page')
+    if page is not None and int(page) + 1 in question.get('gold_pages', []):
+        return True
+    return any(text in result['content'] for text in question.get('gold_texts', []))
+
+def found_labels(results: List[Dict], question: Dict) -> int:
+    """Cuántas etiquetas de referencia distintas aparecen en los resultados."""
+    found = set()
+    for result in results:
+        if question.get('doc_hashes') and result.get('hash') not in question['doc_hashes']:
+            continue
+        page = result['metadata'].get('page')
+        if page is not None and int(page) + 1 in question.get('gold_pages', []):
+            found.add(('page', int(page) + 1))
+        for text in question.get('gold_texts', []):
+            if text in result['content']:
+                found.add(('text', text))
+    return len(found)
+
+def evaluate(results: List[Dict], question: Dict) -> Dict:
+    total_labels = len(question.get('gold_pages', [])) + len(question.get('gold_texts', []))
+    rank = next((i + 1 for i, r in enumerate(results) if is_relevant(r, question)), None)
+    return {
+        'recall': found_labels(results, question) / total_labels if total_labels else 0.0,
+        'reciprocal_rank': 1 / rank if rank else 0.0
+    }
+
+def open_vectorstores(doc_hashes: List[str], k: int, embeddings: Embeddings,
+                      backend: Optional[str], doc_manager: DocumentManager) -> List[Dict]:
+    vectorstores = []
+    for doc_hash in doc_hashes:
+        doc = doc_manager.get_document(doc_hash)
+        if not doc or not os.path.exists(doc.get('vectorstore_path', '')):
+            print(f"Documento no disponible: {doc_hash}")
+            continue
+        if backend:
+            doc = {**doc, 'vector_backend': backend}
+        vectorstores.append(open_agent_vectorstore(doc, k, embeddings))
+    return vectorstores
+
+def run_question(vectorstores: List[Dict], question: Dict, k: int) -> Dict:
+    stores = vectorstores
+    if question.get('doc_hashes'):
+        stores = [vs for vs in vectorstores if vs['hash'] in question['doc_hashes']] or vectorstores
+
+    start = time.perf_counter()
+    results = search_vectorstores(stores, question['question'], k)
+    latency_ms = (time.perf_counter() - start) * 1000
+    return {'latency_ms': latency_ms, **evaluate(results, question)}
+
+def summarize(measurements: List[Dict], elapsed: float) -> Dict:
+    latencies = [m['latency_ms'] for m in measurements]
+    return {
+        'queries': len(measurements),
+        'recall_at_k': float(np.mean([m['recall'] for m in measurements])) if measurements else 0.0,
+        'mrr': float(np.mean([m['reciprocal_rank'] for m in measurements])) if measurements else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) if latencies else 0.0,
+        'p95_ms': float(np.percentile(latencies, 95)) if latencies else 0.0,
+        'p99_ms': float(np.percentile(latencies, 99)) if latencies else 0.0,
+        'throughput_qps': len(measurements) / elapsed if elapsed > 0 else 0.0
+    }
+
+def run_sequential(vectorstores: List[Dict], questions: List[Dict], k: int, rounds: int) -> Dict:
+    measurements = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for question in questions:
+            measurements.append(run_question(vectorstores, question, k))
+    return summarize(measurements, time.perf_counter() - start)
+
+def run_concurrent(open_stores, questions: List[Dict], k: int, rounds: int,
+                   concurrency: int, shared_stores: bool) -> Dict:
+    """
+    Simula `concurrency` sesiones simultáneas, cada una haciendo todas las
+    preguntas `rounds` veces. Con shared_stores=False cada sesión abre sus
+    propios vectorstores, como ocurre hoy al cargar un asistente.
+    """
+    shared = open_stores() if shared_stores else None
+    measurements = []
+    lock = threading.Lock()
+
+    def session(session_id: int):
+        vectorstores = shared if shared_stores else open_stores()
+        local = []
+        for round_num in range(rounds):
+            # Cada sesión recorre las preguntas en un orden distinto
+            offset = (session_id + round_num) % len(questions)
+            for question in questions[offset:] + questions[:offset]:
+                local.append(run_question(vectorstores, question, k))
+        with lock:
+            measurements.extend(local)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(session, range(concurrency)))
+    return summarize(measurements, time.perf_counter() - start)
+
+def print_summary(label: str, summary: Dict, k: int) -> None:
+    print(f"\n=== {label} ===")
+    print(f"Consultas:        {summary['queries']}")
+    print(f"Recall@{k}:         {summary['recall_at_k']:.3f}")
+    print(f"MRR:              {summary['mrr']:.3f}")
+    print(f"Latencia p50/p95/p99: {summary['p50_ms']:.1f} / {summary['p95_ms']:.1f} / {summary['p99_ms']:.1f} ms")
+    print(f"Rendimiento:      {summary['throughput_qps']:.1f} consultas/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de calidad y latencia de la búsqueda")
+    parser.add_argument("--questions", required=True, help="Archivo JSON/JSONL con preguntas y etiquetas")
+    parser.add_argument("--agent", help="ID de un asistente de saved_agents.json (usa sus documentos y contexto)")
+    parser.add_argument("--k", type=int, default=None, help="Fragmentos por consulta (context_window)")
+    parser.add_argument("--backend", choices=list(VECTOR_BACKENDS.keys()),
+                        help="Forzar un motor de búsqueda para todos los documentos")
+    parser.add_argument("--rounds", type=int, default=1, help="Repeticiones del conjunto de preguntas")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="Sesiones simultáneas a simular (0 = solo secuencial)")
+    parser.add_argument("--per-session-stores", action="store_true",
+                        help="Cada sesión simulada abre sus propios vectorstores")
+    parser.add_argument("--no-embedding-cache", action="store_true",
+                        help="Incluir la llamada de embeddings en cada consulta")
+    parser.add_argument("--output", help="Guardar el resumen en un archivo JSON")
+    args = parser.parse_args()
+
+    doc_manager = DocumentManager()
+    questions = load_questions(args.questions)
+    if not questions:
+        print("El archivo de preguntas está vacío")
+        return
+
+    k = args.k or 5
+    doc_hashes = []
+    if args.agent:
+        with open(os.path.join("data", "saved_agents.json"), 'r') as f:
+            agent = json.load(f)[args.agent]
+        doc_hashes = [d['hash'] for d in agent['docs']]
+        k = args.k or agent['context_window']
+    for question in questions:
+        for doc_hash in question.get('doc_hashes', []):
+            if doc_hash not in doc_hashes:
+                doc_hashes.append(doc_hash)
+    if not doc_hashes:
+        doc_hashes = list(doc_manager.metadata.keys())
+
+    embeddings = OpenAIEmbeddings()
+    if not args.no_embedding_cache:
+        embeddings = CachedQueryEmbeddings(embeddings)
+        # Calentar el caché para medir solo la búsqueda
+        for question in questions:
+            embeddings.embed_query(question['question'])
+        embeddings.save()
+
+    def open_stores():
+        return open_vectorstores(doc_hashes, k, embeddings, args.backend, doc_manager)
+
+    vectorstores = open_stores()
+    if not vectorstores:
+        print("No se pudo abrir ningún vectorstore")
+        return
+
+    report = {
+        'k': k,
+        'backend': args.backend or "configurado por documento",
+        'documents': [vs['title'] for vs in vectorstores],
+        'sequential': run_sequential(vectorstores, questions, k, args.rounds)
+    }
+    print(f"Documentos: {', '.join(report['documents'])}")
+    print_summary("Secuencial", report['sequential'], k)
+
+    if args.concurrency:
+        report['concurrent'] = run_concurrent(
+            open_stores, questions, k, args.rounds, args.concurrency,
+            shared_stores=not args.per_session_stores
+        )
+        report['concurrency'] = args.concurrency
+        print_summary(f"{args.concurrency} sesiones simultáneas", report['concurrent'], k)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# benchmarks/vector_backends.py
+"""
+Compara la latencia de búsqueda de Chroma (HNSW) con el índice NumPy exacto.
+
+Las consultas se generan perturbando embeddings ya guardados, por lo que no
+se llama a la API de OpenAI. Uso:
+
+    python -m benchmarks.vector_backends
+    python -m benchmarks.vector_backends --synthetic 5000 --queries 200
+"""
+import pysqlite3
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+from langchain_chroma import Chroma
+
+from utils.document_manager import DocumentManager
+from utils.numpy_store import NumpyVectorStore
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+def make_queries(embeddings: np.ndarray, count: int, noise: float, seed: int) -> np.ndarray:
+    """Consultas cercanas a fragmentos existentes, como preguntas reales."""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, embeddings.shape[0], size=count)
+    queries = embeddings[picks] + rng.normal(0, noise, size=(count, embeddings.shape[1]))
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+def exact_top_k(embeddings: np.ndarray, query: np.ndarray, k: int) -> List[int]:
+    scores = embeddings @ query
+    return list(np.argsort(-scores)[:k])
+
+def time_search(search, queries: np.ndarray) -> List[float]:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def benchmark_store(name: str, chroma_dir: str, k: int, num_queries: int, noise: float) -> List[Dict]:
+    """Ejecutar el benchmark sobre un vectorstore Chroma existente."""
+    start = time.perf_counter()
+    chroma = Chroma(persist_directory=chroma_dir, embedding_function=None)
+    data = chroma.get(include=["embeddings"])
+    chroma_load_ms = (time.perf_counter() - start) * 1000
+
+    ids = data['ids']
+    embeddings = np.asarray(data['embeddings'], dtype=np.float32)
+    if embeddings.shape[0] == 0:
+        print(f"{name}: sin embeddings, se omite")
+        return []
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    position_by_id = {doc_id: i for i, doc_id in enumerate(ids)}
+
+    queries = make_queries(embeddings, num_queries, noise, seed=42)
+    truth = [set(exact_top_k(embeddings, q, k)) for q in queries]
+
+    rows = []
+
+    # Chroma (ruta actual)
+    def chroma_search(query):
+        return chroma._collection.query(query_embeddings=[query.tolist()], n_results=k)
+
+    latencies = time_search(chroma_search, queries)
+    hits = 0
+    for query, expected in zip(queries, truth):
+        found = chroma_search(query)['ids'][0]
+        hits += len(expected & {position_by_id[i] for i in found})
+    rows.append({
+        'store': name, 'backend': 'chroma', 'chunks': len(ids),
+        'load_ms': chroma_load_ms, 'disk_bytes': dir_size(chroma_dir),
+        'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+        'recall': hits / (k * len(queries))
+    })
+
+    # Índices NumPy en un directorio temporal
+    for dtype in ["float32", "float16"]:
+        index_dir = tempfile.mkdtemp(prefix=f"bench_{dtype}_")
+        try:
+            NumpyVectorStore.from_chroma(chroma, index_dir, dtype=dtype)
+            start = time.perf_counter()
+            store = NumpyVectorStore(index_dir, None)
+            load_ms = (time.perf_counter() - start) * 1000
+
+            latencies = time_search(lambda q: store.top_k(q, k), queries)
+            hits = 0
+            for query, expected in zip(queries, truth):
+                hits += len(expected & {i for i, _ in store.top_k(query, k)})
+            rows.append({
+                'store': name, 'backend': f'numpy_{dtype}', 'chunks': len(ids),
+                'load_ms': load_ms, 'disk_bytes': dir_size(index_dir),
+                'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                'recall': hits / (k * len(queries))
+            })
+        finally:
+            shutil.rmtree(index_dir, ignore_errors=True)
+
+    return rows
+
+def build_synthetic_store(num_chunks: int, dim: int) -> str:
+    """Crear un vectorstore Chroma temporal con embeddings aleatorios."""
+    chroma_dir = tempfile.mkdtemp(prefix="bench_chroma_")
+    rng = np.random.default_rng(0)
+    # Vectores agrupados para parecerse a fragmentos de un mismo libro
+    centers = rng.normal(size=(max(1, num_chunks // 50), dim))
+    vectors = centers[rng.integers(0, centers.shape[0], size=num_chunks)] + rng.normal(0, 0.5, size=(num_chunks, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    chroma = Chroma(persist_directory=chroma_dir, embedding_function=None)
+    batch = 1000
+    for start in range(0, num_chunks, batch):
+        end = min(start + batch, num_chunks)
+        chroma._collection.add(
+            ids=[str(i) for i in range(start, end)],
+            embeddings=vectors[start:end].tolist(),
+            documents=[f"fragmento {i}" for i in range(start, end)]
+        )
+    return chroma_dir
+
+def print_report(rows: List[Dict], k: int) -> None:
+    header = f"{'Documento':<40} {'Motor':<14} {'Frag.':>7} {'Carga ms':>9} {'Disco KB':>10} {'p50 ms':>8} {'p95 ms':>8} {f'Recall@{k}':>10}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['store'][:40]:<40} {row['backend']:<14} {row['chunks']:>7} "
+            f"{row['load_ms']:>9.1f} {row['disk_bytes'] / 1024:>10.1f} "
+            f"{row['p50']:>8.2f} {row['p95']:>8.2f} {row['recall']:>10.3f}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Chroma vs índice NumPy exacto")
+    parser.add_argument("--k", type=int, default=5, help="Fragmentos por consulta")
+    parser.add_argument("--queries", type=int, default=100, help="Consultas por documento")
+    parser.add_argument("--noise", type=float, default=0.02, help="Ruido agregado a las consultas")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Usar un vectorstore sintético con N fragmentos en lugar de processed_docs")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimensión de los embeddings sintéticos")
+    args = parser.parse_args()
+
+    rows = []
+    if args.synthetic:
+        chroma_dir = build_synthetic_store(args.synthetic, args.dim)
+        try:
+            rows.extend(benchmark_store(f"sintético ({args.synthetic})", chroma_dir,
+                                        args.k, args.queries, args.noise))
+        finally:
+            shutil.rmtree(chroma_dir, ignore_errors=True)
+    else:
+        doc_manager = DocumentManager()
+        for doc in doc_manager.metadata.values():
+            path = doc.get('vectorstore_path', '')
+            if os.path.exists(os.path.join(path, "chroma.sqlite3")):
+                rows.extend(benchmark_store(doc['title'], path, args.k, args.queries, args.noise))
+
+    print_report(rows, args.k)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 # pages/1_📚_catalog.py
 import streamlit as st
 from utils.document_manager import DocumentManager
+from utils.file_server import FileServerNotConfigured, download_url, get_base_url
+from utils.thumbnails import ThumbnailCache
 import os
 from datetime import datetime
-import base64
+from typing import Optional
 
 st.set_page_config(
         page_title="Catálogo de Documentos",
@@ -31,18 +33,41 @@ def format_file_size(size_in_bytes):
         size_in_bytes /= 1024
     return f"{size_in_bytes:.1f} GB"
 
+def get_file_base_url() -> Optional[str]:
+    """URL del servidor de descargas para este navegador, o None si no lo alcanza."""
+    try:
+        return get_base_url(st.context.headers.get("Host"))
+    except FileServerNotConfigured:
+        return None
+
 def create_download_link(file_path: str, link_text: str):
-    """Crea un link de descarga para un archivo."""
+    """
+    Crea un link de descarga para un archivo. El archivo no se lee aquí:
+    el servidor de descargas lo envía cuando se hace clic.
+    """
     try:
-        with open(file_path, "rb") as f:
-            bytes_data = f.read()
-        b64 = base64.b64encode(bytes_data).decode()
+        base_url = get_file_base_url()
+        url = download_url(file_path, base_url) if base_url else None
+        if not url:
+            return None
         filename = os.path.basename(file_path)
-        mime_type = "application/octet-stream"
-        return f'<a href="data:{mime_type};base64,{b64}" download="{filename}" class="download-link">{link_text}</a>'
+        return f'<a href="{url}" download="{filename}" class="download-link">{link_text}</a>'
     except Exception:
         return None
 
+@st.cache_resource
+def get_thumbnail_cache() -> ThumbnailCache:
+    """Miniaturas de las vistas previas, compartidas por todas las sesiones."""
+    return ThumbnailCache()
+
+def show_preview(preview_path):
+    """Miniatura de la vista previa; el navegador la carga al acercarse a la pantalla."""
+    base_url = get_file_base_url()
+    if base_url and preview_path and os.path.exists(preview_path):
+        img_tag = get_thumbnail_cache().img_tag(preview_path, base_url)
+        if img_tag:
+            st.markdown(img_tag, unsafe_allow_html=True)
+
 def show_document_details(doc, is_full_view=True):
     """Muestra los detalles del documento con manejo seguro de campos."""
     base_info = f"""
@@ -82,6 +107,12 @@ def main():
 
     doc_manager = DocumentManager()
 
+    # Sin un servidor de descargas alcanzable, los enlaces y miniaturas no funcionarían
+    try:
+        get_base_url(st.context.headers.get("Host"))
+    except FileServerNotConfigured as e:
+        st.error(f"📥 Descargas y miniaturas no disponibles: {str(e)}")
+
     # Layout de dos columnas principales
     col_catalog, col_search = st.columns([2, 1])
 
@@ -191,9 +222,7 @@ def main():
                         with cols[idx % 3]:
                             with st.container():
                                 # Mostrar preview si existe
-                                preview_path = get_safe_value(doc, 'preview_path')
-                                if preview_path and os.path.exists(preview_path):
-                                    st.image(preview_path, use_column_width=True)
+                                show_preview(get_safe_value(doc, 'preview_path'))
                                 
                                 st.markdown(f"""
                                 #### 📄 {get_safe_value(doc, 'title')}
@@ -232,17 +261,14 @@ def main():
                                 
                                 # Agregar link de descarga si existe el archivo
                                 original_path = get_safe_value(doc, 'original_path')
-                                if original_path and os.path.exists(original_path):
-                                    st.markdown(
-                                        create_download_link(original_path, "📥 Descargar documento"),
-                                        unsafe_allow_html=True
-                                    )
+                                download_link = create_download_link(original_path, "📥 Descargar documento") \
+                                    if original_path and os.path.exists(original_path) else None
+                                if download_link:
+                                    st.markdown(download_link, unsafe_allow_html=True)
                             
                             with col2:
                                 # Preview
-                                preview_path = get_safe_value(doc, 'preview_path')
-                                if preview_path and os.path.exists(preview_path):
-                                    st.image(preview_path, use_column_width=True)
+                                show_preview(get_safe_value(doc, 'preview_path'))
                                 
                                 # Selección
                                 is_selected = st.checkbox(
@@ -266,6 +292,7 @@ def main():
                                 - 📄 {get_safe_value(doc, 'pages', '0')} páginas
                                 - 📦 {get_safe_value(doc, 'chunks', '0')} fragmentos
                                 """)
+                                
             else:
                 st.info("No hay documentos en el catálogo. Ve a la sección de carga para agregar documentos.")
 
@@ -294,17 +321,14 @@ def main():
                                 
                                 # Link de descarga
                                 original_path = get_safe_value(doc, 'original_path')
-                                if original_path and os.path.exists(original_path):
-                                    st.markdown(
-                                        create_download_link(original_path, "📥 Descargar"),
-                                        unsafe_allow_html=True
-                                    )
+                                download_link = create_download_link(original_path, "📥 Descargar") \
+                                    if original_path and os.path.exists(original_path) else None
+                                if download_link:
+                                    st.markdown(download_link, unsafe_allow_html=True)
                             
                             with col2:
                                 # Preview
-                                preview_path = get_safe_value(doc, 'preview_path')
-                                if preview_path and os.path.exists(preview_path):
-                                    st.image(preview_path, use_column_width=True)
+                                show_preview(get_safe_value(doc, 'preview_path'))
                                 
                                 # Selección
                                 is_selected = st.checkbox(
@@ -338,9 +362,10 @@ def render_badges(doc):
 
 def render_document_card(doc, preview_path=None):
     """Renderiza una tarjeta de documento para la vista grid."""
+    base_url = get_file_base_url()
     return f"""
     <div class="document-grid">
-        {'<img src="data:image/png;base64,' + encode_image(preview_path) + '" class="preview-image" />' if preview_path else ''}
+        {get_thumbnail_cache().img_tag(preview_path, base_url) if preview_path and base_url else ''}
         <h4>{get_safe_value(doc, 'title')}</h4>
         {render_badges(doc)}
         <div class="stats-container">
@@ -354,12 +379,5 @@ def render_document_card(doc, preview_path=None):
     </div>
     """
 
-def encode_image(image_path):
-    """Codifica una imagen en base64 para mostrarla en HTML."""
-    if image_path and os.path.exists(image_path):
-        with open(image_path, "rb") as f:
-            return base64.b64encode(f.read()).decode()
-    return ""
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -5,8 +5,10 @@ sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 import os
 import streamlit as st
 from utils.document_manager import DocumentManager
-from langchain_chroma import Chroma
-from langchain_openai.embeddings import OpenAIEmbeddings
+from utils.retrieval import open_agent_vectorstore
+from utils.chat_engine import ANSWER_MODES, DEFAULT_ANSWER_MODE
+from utils.context_builder import DEFAULT_CONTEXT_BUDGET
+from utils.llm_scheduler import build_embeddings
 import json
 from datetime import datetime
 
@@ -43,6 +45,9 @@ def save_agent(agent_config):
             'temperature': agent_config['temperature'],
             'max_tokens': agent_config['max_tokens'],
             'context_window': agent_config['context_window'],
+            'context_budget': agent_config['context_budget'],
+            'cache_threshold': agent_config['cache_threshold'],
+            'answer_mode': agent_config['answer_mode'],
             'docs': [{'title': vs['title'], 'hash': vs['hash']} for vs in agent_config['vectorstores']],
             'created_at': datetime.now().isoformat()
         }
@@ -83,19 +88,9 @@ def load_agent_config(agent_id, doc_manager):
         for doc_info in saved_agent['docs']:
             doc = doc_manager.get_document(doc_info['hash'])
             if doc and os.path.exists(doc.get('vectorstore_path', '')):
-                vectorstore = Chroma(
-                    persist_directory=doc['vectorstore_path'],
-                    embedding_function=OpenAIEmbeddings()
-                )
-                
-                vectorstores.append({
-                    'hash': doc['hash'],
-                    'title': doc['title'],
-                    'vectorstore': vectorstore,
-                    'retriever': vectorstore.as_retriever(
-                        search_kwargs={"k": saved_agent['context_window']}
-                    )
-                })
+                vectorstores.append(open_agent_vectorstore(
+                    doc, saved_agent['context_window'], build_embeddings()
+                ))
         
         # Reconstruir configuración completa
         return {
@@ -132,6 +127,7 @@ def main():
                     - 🎭 **Rol:** {agent['role']}
                     - 💬 **Estilo:** {agent['style']}
                     - 📚 **Documentos:** {len(agent['docs'])}
+                    - ⚡ **Modo:** {ANSWER_MODES[agent.get('answer_mode', DEFAULT_ANSWER_MODE)]}
                     - 📅 **Creado:** {datetime.fromisoformat(agent['created_at']).strftime('%d/%m/%Y %H:%M')}
                     """)
                     
@@ -256,6 +252,13 @@ def main():
                         value=5,
                         help="Número de fragmentos de contexto a usar"
                     )
+
+                    context_budget = st.select_slider(
+                        "Presupuesto de contexto (tokens)",
+                        options=[1000, 2000, 3000, 4000, 6000, 8000],
+                        value=DEFAULT_CONTEXT_BUDGET,
+                        help="Tokens máximos de historial y fragmentos por consulta; los fragmentos de menor puntaje se comprimen o descartan"
+                    )
                 
                 with col4:
                     max_tokens = st.select_slider(
@@ -264,6 +267,24 @@ def main():
                         value=2048,
                         help="Longitud máxima de las respuestas"
                     )
+                    
+                    cache_threshold = st.slider(
+                        "Similitud para reutilizar respuestas",
+                        min_value=0.80,
+                        max_value=1.0,
+                        value=0.95,
+                        step=0.01,
+                        help="Preguntas con similitud mayor o igual reutilizan una respuesta guardada (1.0 = solo preguntas idénticas)"
+                    )
+
+                answer_mode = st.radio(
+                    "Modo de respuesta",
+                    options=list(ANSWER_MODES.keys()),
+                    format_func=lambda x: ANSWER_MODES[x],
+                    index=list(ANSWER_MODES.keys()).index(DEFAULT_ANSWER_MODE),
+                    horizontal=True,
+                    help="El RAG directo siempre busca con la pregunta y responde con una sola llamada al modelo: más rápido y económico. El agente decide si buscar y puede reformular la búsqueda."
+                )
             
             submitted = st.form_submit_button("🚀 Crear Asistente", use_container_width=True)
 
@@ -283,19 +304,9 @@ def main():
                     for doc in selected_docs_info:
                         vectorstore_path = doc.get('vectorstore_path')
                         if vectorstore_path and os.path.exists(vectorstore_path):
-                            vectorstore = Chroma(
-                                persist_directory=vectorstore_path,
-                                embedding_function=OpenAIEmbeddings()
-                            )
-                            
-                            vectorstores.append({
-                                'hash': doc['hash'],
-                                'title': doc['title'],
-                                'vectorstore': vectorstore,
-                                'retriever': vectorstore.as_retriever(
-                                    search_kwargs={"k": context_window}
-                                )
-                            })
+                            vectorstores.append(open_agent_vectorstore(
+                                doc, context_window, build_embeddings()
+                            ))
                         else:
                             st.warning(f"⚠️ No se encontró el vectorstore para {doc['title']}")
 
@@ -309,6 +320,9 @@ def main():
                             'temperature': temperature,
                             'max_tokens': max_tokens,
                             'context_window': context_window,
+                            'context_budget': context_budget,
+                            'cache_threshold': cache_threshold,
+                            'answer_mode': answer_mode,
                             'vectorstores': vectorstores
                         }
                         
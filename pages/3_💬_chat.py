@@ -1,14 +1,17 @@
 import streamlit as st
-from langchain_openai import ChatOpenAI
-from langchain.agents import initialize_agent
-from langchain.agents.types import AgentType
-from langchain.memory import ConversationBufferMemory
-from langchain.tools import Tool
 from typing import List, Dict
 import re
-import json
-import os
 from datetime import datetime
+from utils.document_manager import DocumentManager
+from utils.answer_cache import AnswerCache, get_answer_cache
+from utils.chat_history import ChatHistoryStore, DEFAULT_USER, SESSIONS_PAGE_SIZE, new_session_id, format_session_label
+from utils.conversation_memory import ConversationMemory
+from utils.chat_engine import AgentStream, DirectAnswerStream, SpeculativeSearch, build_chat_prompt, get_session_agent, build_llm, ANSWER_MODES, DEFAULT_ANSWER_MODE
+from utils.context_builder import DEFAULT_CONTEXT_BUDGET, build_context, count_tokens, format_token_report, merge_reports, split_budget
+from utils.llm_scheduler import build_embeddings
+from utils.transcript import reset_transcript, show_chat_message, show_transcript
+from utils.tracing import SPAN_KIND_SERVER, set_attribute, span, traced
+from utils.retrieval import search_vectorstores, get_sources
 
 # Configuración de la página
 st.set_page_config(
@@ -17,49 +20,50 @@ st.set_page_config(
     layout="wide"
 )
 
-def load_agent_history(agent_id: str) -> List[Dict]:
-    """Carga el historial de conversaciones de un agente específico."""
-    history_path = os.path.join("data", "chat_history", f"{agent_id}.json")
-    if os.path.exists(history_path):
-        with open(history_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+def load_agent_history(agent_id: str, session_id: str) -> List[Dict]:
+    """Carga los últimos mensajes de una sesión de un agente."""
+    return get_history_store().load(agent_id, session_id)
 
+@traced("history.save")
 def save_agent_history(agent_id: str, messages: List[Dict]):
-    """Guarda el historial de conversaciones de un agente."""
-    os.makedirs(os.path.join("data", "chat_history"), exist_ok=True)
-    history_path = os.path.join("data", "chat_history", f"{agent_id}.json")
-    with open(history_path, 'w', encoding='utf-8') as f:
-        json.dump(messages, f, ensure_ascii=False, indent=2)
+    """Agrega al historial los mensajes de la sesión actual que aún no se guardaron."""
+    session_id = get_history_session()
+    saved = st.session_state.history_saved
+    if len(messages) > saved:
+        get_history_store().append(agent_id, session_id, messages[saved:], user_id=get_history_user())
+        st.session_state.history_saved = len(messages)
 
-def format_timestamp(timestamp: str) -> str:
-    """Formatea un timestamp para mostrar."""
-    dt = datetime.fromisoformat(timestamp)
-    return dt.strftime("%d/%m/%Y %H:%M")
+@st.cache_resource
+def get_history_store() -> ChatHistoryStore:
+    """Historial de chat compartido por todas las sesiones."""
+    return ChatHistoryStore()
 
-def show_chat_message(message: Dict, show_timestamp: bool = True):
-    """Muestra un mensaje del chat con formato mejorado."""
-    with st.chat_message(message["role"]):
-        if show_timestamp and "timestamp" in message:
-            st.caption(format_timestamp(message["timestamp"]))
-        st.markdown(message["content"])
+def get_history_user() -> str:
+    """Usuario dueño del historial (su correo si la app usa autenticación)."""
+    try:
+        return st.user.get("email") or DEFAULT_USER
+    except Exception:
+        return DEFAULT_USER
 
-def get_agent_id(config: Dict) -> str:
-    """Genera un ID único para el agente basado en su configuración."""
-    return f"agent_{config['name']}_{datetime.now().strftime('%Y%m%d')}"
-
-def get_recent_history(messages: List[Dict], max_messages: int = 5) -> str:
-    """Obtiene el historial reciente de mensajes formateado."""
-    recent_messages = messages[-max_messages:] if messages else []
-    formatted_history = []
-    
-    for msg in recent_messages:
-        role = "Human" if msg["role"] == "user" else "Assistant"
-        formatted_history.append(f"{role}: {msg['content']}")
-    
-    return "\n".join(formatted_history)
+def get_history_session() -> str:
+    """ID de la sesión de historial de esta conversación."""
+    if 'history_session' not in st.session_state:
+        st.session_state.history_session = new_session_id()
+        st.session_state.history_saved = 0
+    return st.session_state.history_session
 
+def get_conversation_memory() -> ConversationMemory:
+    """Memoria de la conversación actual; se reinicia al cambiar de sesión de historial."""
+    session_id = get_history_session()
+    memory = st.session_state.get('conversation_memory')
+    if memory is None or memory.key != session_id:
+        memory = ConversationMemory(key=session_id)
+        st.session_state.conversation_memory = memory
+    return memory
 
+def get_agent_id(config: Dict) -> str:
+    """Genera un ID único para el agente basado en su configuración."""
+    return f"agent_{config['name']}"
 
 def main():
     st.title("💬 Chat Educativo")
@@ -107,42 +111,71 @@ def main():
                 - Temperature: {config['temperature']}
                 - Max Tokens: {config['max_tokens']}
                 - Context Window: {config['context_window']}
+                - Presupuesto de contexto: {config.get('context_budget', DEFAULT_CONTEXT_BUDGET)} tokens
+                - Modo: {ANSWER_MODES[config.get('answer_mode', DEFAULT_ANSWER_MODE)]}
                 """)
             
             # Gestión de historiales
             st.markdown("### 💾 Gestión de Historial")
             
-            histories = []
-            history_dir = os.path.join("data", "chat_history")
-            if os.path.exists(history_dir):
-                for file in os.listdir(history_dir):
-                    if file.startswith(f"agent_{config['name']}_") and file.endswith(".json"):
-                        histories.append(file[:-5])
+            store = get_history_store()
+            current_session = get_history_session()
+            history_user = get_history_user()
+
+            # Listado paginado desde el catálogo de sesiones
+            total_sessions = store.count_sessions(agent_id, user_id=history_user)
+            page = 1
+            if total_sessions > SESSIONS_PAGE_SIZE:
+                page = st.number_input(
+                    "Página de historiales",
+                    min_value=1,
+                    max_value=(total_sessions - 1) // SESSIONS_PAGE_SIZE + 1,
+                    value=1
+                )
+            sessions = store.list_sessions(
+                agent_id,
+                user_id=history_user,
+                limit=SESSIONS_PAGE_SIZE,
+                offset=(page - 1) * SESSIONS_PAGE_SIZE
+            )
+            histories = {
+                session['session_id']: session for session in sessions
+                if session['session_id'] != current_session
+            }
             
             if histories:
                 selected_history = st.selectbox(
                     "Cargar historial anterior",
-                    options=["Actual"] + histories,
-                    format_func=lambda x: f"Sesión {x.split('_')[-1]}" if x != "Actual" else "Sesión Actual"
+                    options=["Actual"] + list(histories.keys()),
+                    format_func=lambda x: (
+                        f"{format_session_label(x)} · {histories[x]['message_count']} mensajes"
+                        if x != "Actual" else "Sesión Actual"
+                    )
                 )
                 
                 if selected_history != "Actual":
                     if st.button("📂 Cargar Historial"):
-                        st.session_state.messages = load_agent_history(selected_history)
-                        if 'agent' in st.session_state:
-                            del st.session_state.agent
+                        st.session_state.messages = load_agent_history(agent_id, selected_history)
+                        # Los mensajes nuevos se agregan a la sesión cargada
+                        st.session_state.history_session = selected_history
+                        st.session_state.history_saved = len(st.session_state.messages)
+                        reset_transcript()
+                        st.session_state.pop("chat_agent", None)
                         st.rerun()
             
             # Opciones de historial
             if st.button("🗑️ Limpiar Chat"):
                 st.session_state.messages = []
-                if 'agent' in st.session_state:
-                    del st.session_state.agent
+                st.session_state.history_session = new_session_id()
+                st.session_state.history_saved = 0
+                reset_transcript()
+                st.session_state.pop("chat_agent", None)
                 st.rerun()
             
             if st.button("💾 Guardar Historial"):
                 if st.session_state.messages:
                     save_agent_history(agent_id, st.session_state.messages)
+                    get_history_store().flush()
                     st.success("✅ Historial guardado correctamente")
 
     with chat_col:
@@ -158,9 +191,9 @@ def main():
             }
             st.session_state.messages.append(welcome_message)
 
-        # Mostrar historial
-        for message in st.session_state.messages:
-            show_chat_message(message)
+        # Mostrar historial (solo los últimos mensajes; los anteriores se cargan a pedido)
+        with span("chat.render_history", messages=len(st.session_state.messages)):
+            show_transcript(st.session_state.messages)
 
         # Input del usuario
         if prompt := st.chat_input("¿Qué deseas saber?"):
@@ -171,105 +204,145 @@ def main():
             }
             st.session_state.messages.append(user_message)
             show_chat_message(user_message)
+            set_attribute('chat.turn', True)
+
+            # La búsqueda de la consulta empieza ya, en paralelo al caché y al agente
+            speculative = st.session_state.speculative_search = SpeculativeSearch(
+                prompt,
+                build_embeddings().embed_query,
+                lambda query, embedding: search_vectorstores(
+                    config['vectorstores'], query, config['context_window'], embedding
+                )
+            )
+
+            answer_cache = get_answer_cache()
+            cache_key = AnswerCache.build_key(config, DocumentManager())
+            cache_threshold = config.get('cache_threshold', answer_cache.similarity_threshold)
+            # Los seguimientos dependen de la conversación: sin caché
+            use_cache = AnswerCache.applies_to(st.session_state.messages[:-1])
 
             with st.chat_message("assistant"):
-                with st.spinner(f"💭 {config['name']} está pensando..."):
-                    try:
-                        # Inicializar agente si no existe
-                        if "agent" not in st.session_state:
-                            llm = ChatOpenAI(
-                                temperature=config['temperature'],
-                                model="gpt-4-0125-preview",
-                                max_tokens=config['max_tokens']
-                            )
+                try:
+                    # Buscar una respuesta previa a una pregunta similar
+                    query_embedding = None
+                    cached = None
+                    with st.spinner(f"💭 {config['name']} está pensando..."):
+                        try:
+                            with span("cache.lookup"):
+                                query_embedding = speculative.get_embedding()
+                                if use_cache and query_embedding is not None:
+                                    cached = answer_cache.lookup(cache_key, query_embedding, cache_threshold)
+                        except Exception as e:
+                            print(f"Error consulting answer cache: {str(e)}")
 
-                            def search_documents(query: str) -> str:
-                                """Buscar información en los documentos base."""
-                                try:
-                                    results = []
-                                    
-                                    for vs in config['vectorstores']:
-                                        docs = vs['retriever'].get_relevant_documents(query)
-                                        for doc in docs:
-                                            content = doc.page_content.strip()
-                                            source = vs['title']
-                                            
-                                            if content not in [r.split(']:')[1].strip() for r in results]:
-                                                results.append(f"[{source}]: {content}")
-                                    
-                                    if results:
-                                        return "\n\n".join(results[:config['context_window']])
-                                    return "No encontré información específica. ¿Podrías reformular la pregunta?"
-                                
-                                except Exception as e:
-                                    return f"Error al buscar: {str(e)}"
+                    if cached:
+                        assistant_message = {
+                            "role": "assistant",
+                            "content": cached['answer'],
+                            "sources": cached['sources'],
+                            "cached": True,
+                            "timestamp": datetime.now().isoformat()
+                        }
 
-                            tools = [
-                                Tool(
-                                    name="search_documents",
-                                    func=search_documents,
-                                    description="Busca información en los documentos base."
+                        st.markdown(cached['answer'])
+                        if cached['sources']:
+                            st.caption(f"📚 Fuentes: {', '.join(cached['sources'])}")
+                        st.caption(f"⚡ Respuesta desde caché (similitud {cached['similarity']:.2f})")
+                        st.session_state.messages.append(assistant_message)
+                        save_agent_history(agent_id, st.session_state.messages)
+                        # Resumir en segundo plano los turnos que salen de la ventana
+                        get_conversation_memory().update(st.session_state.messages)
+
+                    else:
+                        history_budget, chunk_budget = split_budget(config.get('context_budget'))
+
+                        @traced("search_documents")
+                        def search_documents(query: str) -> str:
+                            """Buscar información en los documentos base."""
+                            try:
+                                # El agente se crea una vez: la búsqueda y el presupuesto del turno se leen del estado
+                                results = st.session_state.speculative_search.results_for(query)
+                                st.session_state.turn_sources.extend(
+                                    s for s in get_sources(results)
+                                    if s not in st.session_state.turn_sources
                                 )
-                            ]
+                                context, report = build_context(results, query, st.session_state.turn_chunk_budget)
+                                st.session_state.turn_tokens = merge_reports(st.session_state.turn_tokens, report)
+                                return context
+                        
+                            except Exception as e:
+                                return f"Error al buscar: {str(e)}"
 
-                            memory = ConversationBufferMemory(
-                                memory_key="chat_history",
-                                return_messages=True
-                            )
+                        direct_mode = config.get('answer_mode', DEFAULT_ANSWER_MODE) == "direct"
 
-                            st.session_state.agent = initialize_agent(
-                                tools,
-                                llm,
-                                agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-                                verbose=True,
-                                max_iterations=3,
-                                memory=memory,
-                                handle_parsing_errors=True
-                            )
+                        # Inicializar agente si no existe
+                        agent = None
+                        if not direct_mode:
+                            agent = get_session_agent("chat_agent", config, search_documents)
 
-                        # Obtener historial reciente
-                        recent_history = get_recent_history(st.session_state.messages)
-                        
+                        # Resumen y turnos recientes, sin la consulta actual
+                        recent_history, history_tokens = get_conversation_memory().render(
+                            st.session_state.messages[:-1], history_budget
+                        )
                         # Procesar consulta con contexto
-                        prompt_text = f"""Actúa como {config['name']}, un {config['role']} con estilo {config['style'].lower()}.
-                        
-                        Historial reciente de la conversación:
-                        {recent_history}
-                        
-                        Consulta actual: {prompt}
-                        
-                        Instrucciones:
-                        1. Usa search_documents para encontrar información relevante
-                        2. Responde usando SOLO información de los documentos
-                        3. Cita las fuentes usando [Documento]
-                        4. Mantén un nivel de detalle {config['detail_level'].lower()}
-                        5. Si no encuentras información, sugiere cómo reformular la pregunta
-                        6. Ten en cuenta el contexto del historial reciente
-                        7. Mantén la coherencia con las respuestas anteriores
-                        """
-                        
-                        response = st.session_state.agent.run(prompt_text)
-                        
+                        prompt_text = build_chat_prompt(config, recent_history, prompt, direct_mode)
+                    
+                        st.session_state.turn_sources = []
+                        # El agente guardado en la sesión lee el presupuesto del turno actual
+                        st.session_state.turn_chunk_budget = chunk_budget
+                        st.session_state.turn_tokens = {
+                            'budget': chunk_budget + history_budget,
+                            'prompt_tokens': count_tokens(prompt_text),
+                            'history_tokens': history_tokens
+                        }
+                        # Los pasos de búsqueda aparecen sobre la respuesta mientras se genera
+                        status_area = st.container()
+                        if direct_mode:
+                            stream = DirectAnswerStream(
+                                build_llm(config), prompt_text, prompt, search_documents, status_area
+                            )
+                        else:
+                            stream = AgentStream(agent, prompt_text, status_area)
+                        with span("answer", mode="direct" if direct_mode else "agent"):
+                            st.write_stream(stream)
+                        response = stream.response
+                        sources = list(st.session_state.turn_sources)
+                    
+                        token_report = dict(st.session_state.turn_tokens)
+                    
                         assistant_message = {
                             "role": "assistant",
                             "content": response,
+                            "sources": sources,
+                            "tokens": token_report,
                             "timestamp": datetime.now().isoformat()
                         }
-                        
-                        st.markdown(response)
+                    
+                        if sources:
+                            st.caption(f"📚 Fuentes: {', '.join(sources)}")
+                        st.caption(format_token_report(token_report))
                         st.session_state.messages.append(assistant_message)
-                        
+                    
                         # Guardar historial automáticamente
                         save_agent_history(agent_id, st.session_state.messages)
+                        # Resumir en segundo plano los turnos que salen de la ventana
+                        get_conversation_memory().update(st.session_state.messages)
 
-                    except Exception as e:
-                        error_msg = f"❌ Error: {str(e)}"
-                        st.error(error_msg)
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": error_msg,
-                            "timestamp": datetime.now().isoformat()
-                        })
+                        # Solo se guardan respuestas respaldadas por documentos
+                        if use_cache and query_embedding is not None and sources:
+                            answer_cache.store(
+                                cache_key, prompt, query_embedding, response, sources,
+                                AnswerCache.doc_versions(config, DocumentManager())
+                            )
+
+                except Exception as e:
+                    error_msg = f"❌ Error: {str(e)}"
+                    st.error(error_msg)
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": error_msg,
+                        "timestamp": datetime.now().isoformat()
+                    })
 
 # Estilos CSS
 st.markdown("""
@@ -315,4 +388,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Un span raíz por ejecución de la página
+    with span("page.chat", kind=SPAN_KIND_SERVER):
+        main()
\ No newline at end of file
@@ -6,6 +6,13 @@ import streamlit as st
 import os
 import tempfile
 from utils.document_manager import DocumentManager
+from utils.answer_cache import get_answer_cache
+from utils.vector_backends import VECTOR_BACKENDS, DEFAULT_BACKEND, build_backend_index
+from utils.llm_scheduler import PRIORITY_INGESTION, SchedulerCallbackHandler, build_embeddings
+from utils.openai_clients import get_chat_model
+from utils.file_server import download_url, get_base_url
+from utils.page_store import PageStore
+from utils.page_search import PageIndex
 from langchain_community.document_loaders import (
     PyPDFLoader, 
     UnstructuredWordDocumentLoader,
@@ -15,13 +22,11 @@ from langchain_community.document_loaders import (
 )
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from langchain_openai.embeddings import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
 import fitz  # PyMuPDF
 from docx import Document
 from pptx import Presentation
-import base64
 from pathlib import Path
+from datetime import datetime
 import re
 import shutil
 
@@ -65,7 +70,8 @@ def clean_text_with_ai(text: str, llm) -> str:
         Texto: {text[:1500]}  # Limitamos para no usar muchos tokens
         """
         
-        response = llm.invoke(prompt)
+        # La ingesta cede el turno a las consultas de los chats
+        response = llm.invoke(prompt, config={'callbacks': [SchedulerCallbackHandler(PRIORITY_INGESTION)]})
         return response.content
     except Exception as e:
         st.warning(f"No se pudo aplicar limpieza IA: {str(e)}")
@@ -112,14 +118,14 @@ def get_document_loader(file_path: str, file_type: str):
     return loader_class(file_path)
 
 def create_download_link(file_path: str, link_text: str):
-    """Crea un link de descarga para un archivo."""
+    """Crea un link de descarga para un archivo, servido por el servidor de descargas."""
     try:
-        with open(file_path, "rb") as f:
-            bytes_data = f.read()
-        b64 = base64.b64encode(bytes_data).decode()
+        url = download_url(file_path, get_base_url(st.context.headers.get("Host")))
+        if not url:
+            st.error("El archivo no está registrado como documento.")
+            return None
         filename = os.path.basename(file_path)
-        mime_type = "application/octet-stream"
-        href = f'<a href="data:{mime_type};base64,{b64}" download="{filename}" class="download-link">{link_text}</a>'
+        href = f'<a href="{url}" download="{filename}" class="download-link">{link_text}</a>'
         return href
     except Exception as e:
         st.error(f"Error al crear link de descarga: {str(e)}")
@@ -145,6 +151,13 @@ def process_document(file, metadata, temp_dir):
         # Guardar copia del original
         original_path = os.path.join(doc_dir, f"original_{safe_title}{Path(file.name).suffix}")
         shutil.copy2(temp_path, original_path)
+
+        # Texto por página e índice de búsqueda para el visor, una sola vez
+        if file_extension == "pdf":
+            try:
+                PageIndex.build(PageStore.build(original_path))
+            except Exception as e:
+                st.warning(f"No se pudo guardar el texto por página: {str(e)}")
         
         # Crear vista previa
         preview_path = os.path.join(doc_dir, f"{safe_title}_preview.png")
@@ -155,7 +168,7 @@ def process_document(file, metadata, temp_dir):
         documents = loader.load()
         
         # Limpiar texto con IA (muestra)
-        llm = ChatOpenAI(temperature=0, max_tokens=500)
+        llm = get_chat_model(temperature=0, max_tokens=500)
         if documents:
             st.write("🔍 Analizando y limpiando el texto...")
             progress_bar = st.progress(0)
@@ -171,7 +184,11 @@ def process_document(file, metadata, temp_dir):
             
             progress_bar.progress(100)
         
-        # Dividir en chunks
+        # Asegurar el número de página (desde 0) en todos los formatos
+        for page_num, document in enumerate(documents):
+            document.metadata.setdefault("page", page_num)
+        
+        # Dividir en chunks (cada fragmento conserva la página de origen)
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=150,
@@ -181,13 +198,24 @@ def process_document(file, metadata, temp_dir):
         chunks = text_splitter.split_documents(documents)
         
         # Crear vectorstore
-        embeddings = OpenAIEmbeddings()
+        embeddings = build_embeddings(PRIORITY_INGESTION)
         vectorstore = Chroma.from_documents(
             documents=chunks,
             embedding=embeddings,
             persist_directory=doc_dir
         )
         
+        # Exportar embeddings al índice del motor elegido (NumPy o cuantizado),
+        # marcado con la versión del documento que se registra en los metadatos
+        processed_date = datetime.now().isoformat()
+        build_backend_index(
+            doc_dir,
+            metadata.get("vector_backend", DEFAULT_BACKEND),
+            embeddings,
+            chroma_store=vectorstore,
+            processed_date=processed_date
+        )
+        
         return {
             "success": True,
             "num_pages": len(documents),
@@ -196,7 +224,8 @@ def process_document(file, metadata, temp_dir):
             "original_path": original_path,
             "preview_path": preview_path if preview_created else None,
             "file_type": file_extension,
-            "file_size": os.path.getsize(original_path)
+            "file_size": os.path.getsize(original_path),
+            "processed_date": processed_date
         }
         
     except Exception as e:
@@ -306,7 +335,9 @@ def main():
                     "author": author,
                     "year": year,
                     "tags": [tag.strip() for tag in tags.split(",") if tag.strip()],
-                    "description": description
+                    "description": description,
+                    # El motor se cambia solo desde la página de administración
+                    "vector_backend": DEFAULT_BACKEND
                 }
                 st.session_state.upload_step = 2
                 st.rerun()
@@ -359,11 +390,14 @@ def main():
                     if result["success"]:
                         try:
                             doc_hash = doc_manager.add_document(
-                                st.session_state.doc_metadata,
+                                {**st.session_state.doc_metadata, "processed_date": result["processed_date"]},
                                 result["vectorstore_path"],
                                 result["original_path"]
                             )
                             
+                            # Las respuestas guardadas de una versión anterior ya no son válidas
+                            get_answer_cache().invalidate_document(doc_hash)
+                            
                             st.success(f"""
                             ✅ Documento procesado exitosamente:
                             - 📄 {result["num_pages"]} páginas procesadas
@@ -383,10 +417,12 @@ Vectorstore: {result['vectorstore_path']}
                                 """)
                                 
                                 st.markdown("**💾 Descargas disponibles:**")
-                                st.markdown(create_download_link(
+                                download_link = create_download_link(
                                     result['original_path'],
                                     "📥 Descargar documento original"
-                                ), unsafe_allow_html=True)
+                                )
+                                if download_link:
+                                    st.markdown(download_link, unsafe_allow_html=True)
                             with col2:
                                 if result.get('preview_path'):
                                     st.image(
@@ -404,6 +440,7 @@ Vectorstore: {result['vectorstore_path']}
                                 - Formato: {SUPPORTED_FORMATS[result['file_type']][0]}
                                 - Páginas: {result['num_pages']}
                                 - Fragmentos generados: {result['num_chunks']}
+                                - Motor de búsqueda: {VECTOR_BACKENDS[st.session_state.doc_metadata.get('vector_backend', DEFAULT_BACKEND)]}
                                 - Tamaño: {result['file_size'] / 1024:.1f} KB
                                 
                                 **Rutas del sistema:**
@@ -1,15 +1,20 @@
 import streamlit as st
-from langchain_openai import ChatOpenAI
-from langchain.agents import initialize_agent
-from langchain.agents.types import AgentType
-from langchain.memory import ConversationBufferMemory
-from langchain.tools import Tool
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import re
-import json
-import os
 from datetime import datetime
-import base64
+from utils.document_manager import DocumentManager
+from utils.answer_cache import AnswerCache, get_answer_cache
+from utils.chat_history import ChatHistoryStore, DEFAULT_USER, new_session_id
+from utils.conversation_memory import ConversationMemory
+from utils.chat_engine import AgentStream, DirectAnswerStream, SpeculativeSearch, get_session_agent, build_llm, build_chat_prompt, DEFAULT_ANSWER_MODE
+from utils.context_builder import build_context, count_tokens, format_token_report, merge_reports, split_budget
+from utils.llm_scheduler import build_embeddings
+from utils.page_renderer import DEFAULT_ZOOM, ZOOM_LEVELS, PageRenderer
+from utils.page_search import PageIndex, open_page_index
+from utils.page_store import PageStore
+from utils.transcript import show_chat_message, show_transcript
+from utils.tracing import SPAN_KIND_SERVER, set_attribute, span, traced
+from utils.retrieval import search_vectorstores, search_vectorstores_scoped, get_sources
 
 # Configuración de la página
 st.set_page_config(
@@ -19,103 +24,172 @@ st.set_page_config(
 )
 
 # Funciones auxiliares del chat (reutilizadas del chat.py)
-def load_agent_history(agent_id: str) -> List[Dict]:
-    """Carga el historial de conversaciones de un agente específico."""
-    history_path = os.path.join("data", "chat_history", f"{agent_id}.json")
-    if os.path.exists(history_path):
-        with open(history_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+def load_agent_history(agent_id: str, session_id: str) -> List[Dict]:
+    """Carga los últimos mensajes de una sesión de un agente."""
+    return get_history_store().load(agent_id, session_id)
 
+@traced("history.save")
 def save_agent_history(agent_id: str, messages: List[Dict]):
-    """Guarda el historial de conversaciones de un agente."""
-    os.makedirs(os.path.join("data", "chat_history"), exist_ok=True)
-    history_path = os.path.join("data", "chat_history", f"{agent_id}.json")
-    with open(history_path, 'w', encoding='utf-8') as f:
-        json.dump(messages, f, ensure_ascii=False, indent=2)
-
-def format_timestamp(timestamp: str) -> str:
-    """Formatea un timestamp para mostrar."""
-    dt = datetime.fromisoformat(timestamp)
-    return dt.strftime("%d/%m/%Y %H:%M")
-
-def show_chat_message(message: Dict, show_timestamp: bool = True):
-    """Muestra un mensaje del chat con formato mejorado."""
-    with st.chat_message(message["role"]):
-        if show_timestamp and "timestamp" in message:
-            st.caption(format_timestamp(message["timestamp"]))
-        st.markdown(message["content"])
+    """Agrega al historial los mensajes de la sesión actual que aún no se guardaron."""
+    session_id = get_history_session()
+    saved = st.session_state.history_saved
+    if len(messages) > saved:
+        get_history_store().append(agent_id, session_id, messages[saved:], user_id=get_history_user())
+        st.session_state.history_saved = len(messages)
+
+@st.cache_resource
+def get_history_store() -> ChatHistoryStore:
+    """Historial de chat compartido por todas las sesiones."""
+    return ChatHistoryStore()
+
+def get_history_user() -> str:
+    """Usuario dueño del historial (su correo si la app usa autenticación)."""
+    try:
+        return st.user.get("email") or DEFAULT_USER
+    except Exception:
+        return DEFAULT_USER
+
+def get_history_session() -> str:
+    """ID de la sesión de historial de esta conversación."""
+    if 'history_session' not in st.session_state:
+        st.session_state.history_session = new_session_id()
+        st.session_state.history_saved = 0
+    return st.session_state.history_session
+
+def get_conversation_memory() -> ConversationMemory:
+    """Memoria de la conversación actual; se reinicia al cambiar de sesión de historial."""
+    session_id = get_history_session()
+    memory = st.session_state.get('conversation_memory')
+    if memory is None or memory.key != session_id:
+        memory = ConversationMemory(key=session_id)
+        st.session_state.conversation_memory = memory
+    return memory
 
 def get_agent_id(config: Dict) -> str:
     """Genera un ID único para el agente basado en su configuración."""
-    return f"agent_{config['name']}_{datetime.now().strftime('%Y%m%d')}"
-
-def get_recent_history(messages: List[Dict], max_messages: int = 5) -> str:
-    """Obtiene el historial reciente de mensajes formateado."""
-    recent_messages = messages[-max_messages:] if messages else []
-    formatted_history = []
-    for msg in recent_messages:
-        role = "Human" if msg["role"] == "user" else "Assistant"
-        formatted_history.append(f"{role}: {msg['content']}")
-    return "\n".join(formatted_history)
-
-def display_pdf(pdf_path: str):
-    """Muestra un PDF en el iframe."""
-    with open(pdf_path, "rb") as f:
-        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="800" type="application/pdf"></iframe>'
-    st.markdown(pdf_display, unsafe_allow_html=True)
-
-def extract_pdf_content(pdf_path: str) -> List[Dict]:
+    return f"agent_{config['name']}"
+
+@st.cache_resource
+def get_page_renderer() -> PageRenderer:
+    """Renderizador de páginas compartido por todas las sesiones."""
+    return PageRenderer()
+
+def display_pdf_page(pdf_path: str, page: int, page_count: int, zoom: float):
+    """Muestra solo la página abierta como imagen y prepara las vecinas."""
+    renderer = get_page_renderer()
+    try:
+        with st.spinner("Cargando página..."):
+            image_path = renderer.render(pdf_path, page, zoom)
+        st.image(image_path, use_container_width=True)
+    except Exception as e:
+        st.error(f"Error al mostrar la página: {str(e)}")
+        return
+    renderer.prefetch(pdf_path, page, page_count, zoom)
+
+@st.cache_resource
+def get_page_indexes() -> Dict[str, Tuple[str, PageIndex]]:
+    """Índices de búsqueda por documento, compartidos por todas las sesiones."""
+    return {}
+
+def get_page_index(document: Dict) -> PageIndex:
     """
-    Extrae el contenido del PDF página por página y lo devuelve como una lista de diccionarios.
-    Cada diccionario contiene el número de página y su contenido.
+    Índice de búsqueda del documento. Se guarda solo el de la versión
+    actual: si el documento se vuelve a subir, se reemplaza.
     """
-    import fitz  # PyMuPDF
-    pages_content = []
-    
+    indexes = get_page_indexes()
+    cached = indexes.get(document['hash'])
+    if cached is None or cached[0] != document['version']:
+        with st.spinner("Indexando el documento..."):
+            cached = (document['version'], open_page_index(document['path'], document['page_store']))
+        indexes[document['hash']] = cached
+    return cached[1]
+
+def go_to_page(page: int):
+    st.session_state.current_page = page
+
+def show_search_results(document: Dict, query: str):
+    """Páginas donde aparece la consulta; al elegir una, el visor salta a ella."""
     try:
-        doc = fitz.open(pdf_path)
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            content = page.get_text("text").strip()
-            # Extraer los primeros caracteres para el índice
-            preview = content[:100] + "..." if len(content) > 100 else content
-            
-            pages_content.append({
-                'page_num': page_num + 1,
-                'content': content,
-                'preview': preview
-            })
-        return pages_content
+        hits = get_page_index(document).search(query)
     except Exception as e:
-        st.error(f"Error al extraer contenido del PDF: {str(e)}")
-        return []
+        st.error(f"Error al buscar en el documento: {str(e)}")
+        return
 
-def display_content_viewer(pdf_path: str):
+    if not hits:
+        st.caption("No se encontró la búsqueda en el documento.")
+        return
+
+    st.caption(f"{len(hits)} página(s) con resultados")
+    with st.container(height=250):
+        for hit in hits:
+            col1, col2 = st.columns([1, 5])
+            with col1:
+                st.button(
+                    f"Pág. {hit['page'] + 1}",
+                    key=f"search_hit_{hit['page']}",
+                    on_click=go_to_page,
+                    args=(hit['page'],),
+                    use_container_width=True
+                )
+            with col2:
+                st.markdown(hit['snippet'])
+
+def show_page(page_store: PageStore, pdf_path: str, view_mode: str, zoom: float):
+    """Contenido de la página abierta: su imagen o su texto."""
+    page = st.session_state.current_page
+    if view_mode == "Página":
+        st.markdown(f"#### Página {page + 1} de {len(page_store)}")
+        display_pdf_page(pdf_path, page, len(page_store), zoom)
+        return
+
+    st.markdown(f"""
+    <div class="content-box">
+        <div class="page-header">
+            <h4>Página {page + 1} de {len(page_store)}</h4>
+        </div>
+        <div class="page-content">
+            {page_store.page_text(page).replace('\n', '<br>')}
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+
+@st.cache_resource
+def get_document_manager() -> DocumentManager:
+    """
+    Documentos compartidos por todas las sesiones; guarda la ruta, las
+    páginas y el texto por página de cada documento ya abierto.
+    """
+    return DocumentManager()
+
+def display_content_viewer(document: Dict):
     """
     Muestra el contenido del PDF con navegación mejorada.
     """
-    if not pdf_path or not os.path.exists(pdf_path):
-        st.error("El archivo no se encuentra disponible.")
-        st.markdown(f"Ruta esperada: {pdf_path}")
-        return
+    pdf_path = document['path']
+    # Texto por página en disco; solo se lee la página que se muestra
+    page_store = document['page_store']
 
-    # Extraer contenido del PDF si no está en caché
-    cache_key = f"pdf_content_{pdf_path}"
-    if cache_key not in st.session_state:
-        st.session_state[cache_key] = extract_pdf_content(pdf_path)
-    
-    pages_content = st.session_state[cache_key]
-    
-    if not pages_content:
+    if not len(page_store):
         st.error("No se pudo extraer el contenido del documento.")
         return
 
+    # Otro documento puede tener menos páginas que la abierta antes
+    if st.session_state.get('current_page', 0) >= len(page_store):
+        st.session_state.current_page = 0
+
     # Inicializar página actual si no existe
     if 'current_page' not in st.session_state:
         st.session_state.current_page = 0
 
+    # Búsqueda de términos o frases en todo el documento
+    query = st.text_input(
+        "🔎 Buscar en el documento",
+        placeholder='Términos o "frase exacta"',
+        key="viewer_search"
+    )
+    if query.strip():
+        show_search_results(document, query)
+
     # Selector de estilo de navegación
     nav_style = st.radio(
         "Estilo de navegación",
@@ -123,6 +197,20 @@ def display_content_viewer(pdf_path: str):
         horizontal=True
     )
 
+    # La vista de página envía solo la imagen de la página abierta
+    view_col, zoom_col = st.columns([2, 1])
+    with view_col:
+        view_mode = st.radio("Vista", options=["Texto", "Página"], horizontal=True)
+    zoom = DEFAULT_ZOOM
+    if view_mode == "Página":
+        with zoom_col:
+            zoom = st.select_slider(
+                "Zoom",
+                options=ZOOM_LEVELS,
+                value=DEFAULT_ZOOM,
+                format_func=lambda z: f"{int(z * 100)}%"
+            )
+
     # Contenedor para el contenido
     content_container = st.container()
     
@@ -130,16 +218,7 @@ def display_content_viewer(pdf_path: str):
     if nav_style == "Flechas":
         # Mostrar contenido
         with content_container:
-            st.markdown(f"""
-            <div class="content-box">
-                <div class="page-header">
-                    <h4>Página {st.session_state.current_page + 1} de {len(pages_content)}</h4>
-                </div>
-                <div class="page-content">
-                    {pages_content[st.session_state.current_page]['content'].replace('\n', '<br>')}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+            show_page(page_store, pdf_path, view_mode, zoom)
         
         # Navegación con flechas en la parte inferior
         col1, col2, col3 = st.columns([1, 3, 1])
@@ -151,11 +230,11 @@ def display_content_viewer(pdf_path: str):
                 
         with col2:
             # Barra de progreso
-            progress = (st.session_state.current_page + 1) / len(pages_content)
+            progress = (st.session_state.current_page + 1) / len(page_store)
             st.progress(progress)
                 
         with col3:
-            if st.button("Siguiente →", disabled=st.session_state.current_page >= len(pages_content) - 1):
+            if st.button("Siguiente →", disabled=st.session_state.current_page >= len(page_store) - 1):
                 st.session_state.current_page += 1
                 st.rerun()
     
@@ -167,7 +246,7 @@ def display_content_viewer(pdf_path: str):
         """, unsafe_allow_html=True)
         
         # Dividir en grupos de 10 páginas
-        cols = st.columns(min(10, len(pages_content)))
+        cols = st.columns(min(10, len(page_store)))
         for idx, col in enumerate(cols):
             with col:
                 page_num = idx + 1
@@ -184,43 +263,15 @@ def display_content_viewer(pdf_path: str):
         
         # Mostrar contenido
         with content_container:
-            st.markdown(f"""
-            <div class="content-box">
-                <div class="page-header">
-                    <h4>Página {st.session_state.current_page + 1} de {len(pages_content)}</h4>
-                </div>
-                <div class="page-content">
-                    {pages_content[st.session_state.current_page]['content'].replace('\n', '<br>')}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+            show_page(page_store, pdf_path, view_mode, zoom)
 def get_document_info(vectorstores: List[Dict]) -> List[Dict]:
     """
-    Extrae información de los vectorstores para el selector.
-    La estructura es:
-    processed_docs/[NOMBRE_AGENTE]/[ARCHIVO].pdf
+    Documentos del asistente para el selector, resueltos por su hash en
+    `DocumentManager`: ruta del PDF, número de páginas y texto por página.
     """
-    # Obtener el nombre del agente de la configuración
-    agent_name = vectorstores[0]['title']  # Usamos el título como nombre del agente
-    docs_info = []
-    
-    # Directorio base donde están los PDFs del agente
-    agent_dir = os.path.join('data/processed_docs', agent_name)
-    
-    # Si el directorio existe, buscar los PDFs
-    if os.path.exists(agent_dir):
-        # Listar todos los PDFs en el directorio del agente
-        pdf_files = [f for f in os.listdir(agent_dir) if f.endswith('.pdf')]
-        
-        for pdf_file in pdf_files:
-            pdf_path = os.path.join(agent_dir, pdf_file)
-            docs_info.append({
-                'title': os.path.splitext(pdf_file)[0],  # Nombre del PDF sin extensión
-                'path': pdf_path,
-                'agent_name': agent_name
-            })
-    
-    return docs_info
+    # Solo la primera vez extrae el texto de documentos subidos sin él
+    with st.spinner("Abriendo los documentos del asistente..."):
+        return get_document_manager().get_document_files([vs['hash'] for vs in vectorstores])
 
 
 def main():
@@ -254,34 +305,26 @@ def main():
             
             if docs_info:
                 # Mostrar el nombre del agente
-                st.markdown(f"**🤖 Agente:** {docs_info[0]['agent_name']}")
+                st.markdown(f"**🤖 Agente:** {config['name']}")
                 
-                # Selector de documento
-                selected_doc = st.selectbox(
+                # Selector de documento: por hash, para tomar siempre la versión
+                # actual aunque el documento se vuelva a subir
+                docs_by_hash = {doc['hash']: doc for doc in docs_info}
+                selected_hash = st.selectbox(
                     "Seleccionar documento",
-                    options=docs_info,
-                    format_func=lambda x: x['title']
+                    options=list(docs_by_hash),
+                    format_func=lambda x: f"{docs_by_hash[x]['title']} ({docs_by_hash[x]['page_count']} págs.)"
                 )
+                selected_doc = docs_by_hash.get(selected_hash)
                 
                 if selected_doc:
-                    # Verificar que el archivo existe
-                    if os.path.exists(selected_doc['path']):
-                        display_content_viewer(selected_doc['path'])
-                    else:
-                        st.error(f"""
-                        No se encontró el archivo PDF.
-                        Buscando en: {selected_doc['path']}
-                        
-                        Estructura esperada:
-                        processed_docs/
-                        └── {selected_doc['agent_name']}/
-                            └── [archivos PDF]
-                        """)
+                    # El chat usa el documento y la página abiertos para acotar la búsqueda
+                    st.session_state.viewer_doc_hash = selected_doc['hash']
+                    display_content_viewer(selected_doc)
             else:
-                st.warning(f"""
-                No se encontraron documentos PDF.
-                Verifica que existan archivos PDF en la carpeta:
-                processed_docs/{config['vectorstores'][0]['title']}/
+                st.warning("""
+                No se encontraron documentos PDF para este asistente.
+                Verifica que sus documentos se hayan subido como PDF.
                 """)
                 
         except Exception as e:
@@ -300,6 +343,13 @@ def main():
             - 💬 Estilo: {config['style']}
             - 📝 Nivel: {config['detail_level']}
             """)
+        
+        st.toggle(
+            "🔎 Priorizar la página actual",
+            value=True,
+            key="page_scoped",
+            help="Busca primero en la página abierta y sus vecinas; amplía a todo el material solo si no hay buenos resultados"
+        )
 
         # Chat container con scroll
         chat_container = st.container()
@@ -316,9 +366,9 @@ def main():
                 }
                 st.session_state.messages.append(welcome_message)
 
-            # Mostrar mensajes
-            for message in st.session_state.messages:
-                show_chat_message(message)
+            # Mostrar mensajes (solo los últimos; los anteriores se cargan a pedido)
+            with span("chat.render_history", messages=len(st.session_state.messages)):
+                show_transcript(st.session_state.messages)
 
         # Input del usuario
         if prompt := st.chat_input("¿Qué deseas saber sobre el material?"):
@@ -329,95 +379,164 @@ def main():
             }
             st.session_state.messages.append(user_message)
             show_chat_message(user_message)
+            set_attribute('chat.turn', True)
+
+            page_scoped = st.session_state.get('page_scoped', True)
+            viewer_doc_hash = st.session_state.get('viewer_doc_hash')
+            current_page = st.session_state.get('current_page')
+
+            def run_search(query: str, embedding=None):
+                """Búsqueda acotada a la página abierta o en todos los documentos."""
+                if page_scoped:
+                    return search_vectorstores_scoped(
+                        config['vectorstores'], query, config['context_window'],
+                        viewer_doc_hash, current_page, embedding=embedding
+                    )
+                return search_vectorstores(
+                    config['vectorstores'], query, config['context_window'], embedding
+                ), None
+
+            # La búsqueda de la consulta empieza ya, en paralelo al caché y al agente
+            speculative = st.session_state.speculative_search = SpeculativeSearch(
+                prompt, build_embeddings().embed_query, run_search
+            )
+
+            answer_cache = get_answer_cache()
+            cache_scope = None
+            if page_scoped:
+                cache_scope = f"{viewer_doc_hash}:{current_page}"
+            cache_key = AnswerCache.build_key(config, DocumentManager(), scope=cache_scope)
+            cache_threshold = config.get('cache_threshold', answer_cache.similarity_threshold)
+            # Los seguimientos dependen de la conversación: sin caché
+            use_cache = AnswerCache.applies_to(st.session_state.messages[:-1])
 
             with st.chat_message("assistant"):
-                with st.spinner(f"💭 {config['name']} está pensando..."):
-                    try:
-                        # Inicializar agente si no existe
-                        if "agent" not in st.session_state:
-                            llm = ChatOpenAI(
-                                temperature=config['temperature'],
-                                model="gpt-4-0125-preview",
-                                max_tokens=config['max_tokens']
-                            )
+                try:
+                    # Buscar una respuesta previa a una pregunta similar
+                    query_embedding = None
+                    cached = None
+                    with st.spinner(f"💭 {config['name']} está pensando..."):
+                        try:
+                            with span("cache.lookup"):
+                                query_embedding = speculative.get_embedding()
+                                if use_cache and query_embedding is not None:
+                                    cached = answer_cache.lookup(cache_key, query_embedding, cache_threshold)
+                        except Exception as e:
+                            print(f"Error consulting answer cache: {str(e)}")
+
+                    if cached:
+                        assistant_message = {
+                            "role": "assistant",
+                            "content": cached['answer'],
+                            "sources": cached['sources'],
+                            "cached": True,
+                            "timestamp": datetime.now().isoformat()
+                        }
 
-                            def search_documents(query: str) -> str:
-                                """Buscar información en los documentos base."""
-                                try:
-                                    results = []
-                                    for vs in config['vectorstores']:
-                                        docs = vs['retriever'].get_relevant_documents(query)
-                                        for doc in docs:
-                                            content = doc.page_content.strip()
-                                            source = vs['title']
-                                            if content not in [r.split(']:')[1].strip() for r in results]:
-                                                results.append(f"[{source}]: {content}")
-                                    if results:
-                                        return "\n\n".join(results[:config['context_window']])
-                                    return "No encontré información específica. ¿Podrías reformular la pregunta?"
-                                except Exception as e:
-                                    return f"Error al buscar: {str(e)}"
-
-                            tools = [
-                                Tool(
-                                    name="search_documents",
-                                    func=search_documents,
-                                    description="Busca información en los documentos base."
+                        st.markdown(cached['answer'])
+                        if cached['sources']:
+                            st.caption(f"📚 Fuentes: {', '.join(cached['sources'])}")
+                        st.caption(f"⚡ Respuesta desde caché (similitud {cached['similarity']:.2f})")
+                        st.session_state.messages.append(assistant_message)
+                        save_agent_history(agent_id, st.session_state.messages)
+                        # Resumir en segundo plano los turnos que salen de la ventana
+                        get_conversation_memory().update(st.session_state.messages)
+
+                    else:
+                        history_budget, chunk_budget = split_budget(config.get('context_budget'))
+
+                        @traced("search_documents")
+                        def search_documents(query: str) -> str:
+                            """Buscar información en los documentos base."""
+                            try:
+                                # El agente se crea una vez: la búsqueda y el presupuesto del turno se leen del estado
+                                results, pages = st.session_state.speculative_search.results_for(query)
+                                if pages:
+                                    st.session_state.turn_scope = pages
+                                st.session_state.turn_sources.extend(
+                                    s for s in get_sources(results)
+                                    if s not in st.session_state.turn_sources
                                 )
-                            ]
+                                context, report = build_context(results, query, st.session_state.turn_chunk_budget)
+                                st.session_state.turn_tokens = merge_reports(st.session_state.turn_tokens, report)
+                                return context
+                            except Exception as e:
+                                return f"Error al buscar: {str(e)}"
 
-                            memory = ConversationBufferMemory(
-                                memory_key="chat_history",
-                                return_messages=True
-                            )
+                        direct_mode = config.get('answer_mode', DEFAULT_ANSWER_MODE) == "direct"
 
-                            st.session_state.agent = initialize_agent(
-                                tools,
-                                llm,
-                                agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-                                verbose=True,
-                                max_iterations=3,
-                                memory=memory,
-                                handle_parsing_errors=True
-                            )
+                        # Inicializar agente si no existe
+                        agent = None
+                        if not direct_mode:
+                            agent = get_session_agent("viewer_agent", config, search_documents)
 
                         # Procesar consulta
-                        recent_history = get_recent_history(st.session_state.messages)
-                        prompt_text = f"""Actúa como {config['name']}, un {config['role']} con estilo {config['style'].lower()}.
-                        
-                        Historial reciente:
-                        {recent_history}
+                        recent_history, history_tokens = get_conversation_memory().render(
+                            st.session_state.messages[:-1], history_budget
+                        )
+                        prompt_text = build_chat_prompt(
+                            config, recent_history, prompt, direct_mode,
+                            page_context=f"Página abierta en el visor: {st.session_state.get('current_page', 0) + 1}"
+                        )
                         
-                        Consulta actual: {prompt}
-                        
-                        Instrucciones:
-                        1. Usa search_documents para buscar información relevante
-                        2. Responde usando SOLO información de los documentos
-                        3. Cita las fuentes usando [Documento]
-                        4. Mantén un nivel de detalle {config['detail_level'].lower()}
-                        5. Si no encuentras información, sugiere cómo reformular la pregunta
-                        """
-                        
-                        response = st.session_state.agent.run(prompt_text)
+                        st.session_state.turn_sources = []
+                        # El agente guardado en la sesión lee el presupuesto del turno actual
+                        st.session_state.turn_chunk_budget = chunk_budget
+                        st.session_state.turn_tokens = {
+                            'budget': chunk_budget + history_budget,
+                            'prompt_tokens': count_tokens(prompt_text),
+                            'history_tokens': history_tokens
+                        }
+                        st.session_state.turn_scope = None
+                        # Los pasos de búsqueda aparecen sobre la respuesta mientras se genera
+                        status_area = st.container()
+                        if direct_mode:
+                            stream = DirectAnswerStream(
+                                build_llm(config), prompt_text, prompt, search_documents, status_area
+                            )
+                        else:
+                            stream = AgentStream(agent, prompt_text, status_area)
+                        with span("answer", mode="direct" if direct_mode else "agent"):
+                            st.write_stream(stream)
+                        response = stream.response
+                        sources = list(st.session_state.turn_sources)
                         
+                        token_report = dict(st.session_state.turn_tokens)
+                    
                         assistant_message = {
                             "role": "assistant",
                             "content": response,
+                            "sources": sources,
+                            "tokens": token_report,
                             "timestamp": datetime.now().isoformat()
                         }
                         
-                        st.markdown(response)
+                        if sources:
+                            st.caption(f"📚 Fuentes: {', '.join(sources)}")
+                        st.caption(format_token_report(token_report))
+                        if st.session_state.turn_scope:
+                            scope = st.session_state.turn_scope
+                            st.caption(f"🔎 Búsqueda en las páginas {scope[0] + 1}–{scope[-1] + 1}")
                         st.session_state.messages.append(assistant_message)
                         save_agent_history(agent_id, st.session_state.messages)
+                        # Resumir en segundo plano los turnos que salen de la ventana
+                        get_conversation_memory().update(st.session_state.messages)
+
+                        # Solo se guardan respuestas respaldadas por documentos
+                        if use_cache and query_embedding is not None and sources:
+                            answer_cache.store(
+                                cache_key, prompt, query_embedding, response, sources,
+                                AnswerCache.doc_versions(config, DocumentManager())
+                            )
 
-                    except Exception as e:
-                        error_msg = f"❌ Error: {str(e)}"
-                        st.error(error_msg)
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": error_msg,
-                            "timestamp": datetime.now().isoformat()
-                        })
+                except Exception as e:
+                    error_msg = f"❌ Error: {str(e)}"
+                    st.error(error_msg)
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": error_msg,
+                        "timestamp": datetime.now().isoformat()
+                    })
 
 # Agregar estilos CSS adicionales
 st.markdown("""
@@ -507,4 +626,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Un span raíz por ejecución de la página
+    with span("page.document_chat", kind=SPAN_KIND_SERVER):
+        main()
\ No newline at end of file
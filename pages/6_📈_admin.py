@@ -0,0 +1,182 @@
+# pages/6_📈_admin.py
+import os
+import time
+import streamlit as st
+from datetime import datetime
+from typing import Dict, List, Optional
+from utils.document_manager import DocumentManager
+from utils.llm_scheduler import get_scheduler
+from utils.openai_clients import pool_snapshots
+from utils.tracing import get_trace_file, read_spans, summarize_spans, tracing_enabled, turn_trace_ids
+from utils.vector_backends import DEFAULT_BACKEND, VECTOR_BACKENDS
+
+st.set_page_config(
+    page_title="Administración",
+    page_icon="📈",
+    layout="wide"
+)
+
+TIME_WINDOWS = {
+    "Última hora": 3600,
+    "Últimas 24 horas": 24 * 3600,
+    "Últimos 7 días": 7 * 24 * 3600,
+    "Todo": None
+}
+
+# Bytes leídos como máximo desde el final del archivo de trazas
+MAX_READ_BYTES = 8 * 1024 * 1024
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_spans(trace_file: str, modified: float, window_seconds: Optional[int]) -> List[Dict]:
+    """
+    Spans del periodo elegido, leídos desde el final del archivo de trazas;
+    `modified` invalida el caché cuando cambia. Se guarda una sola copia.
+    """
+    since_ns = time.time_ns() - window_seconds * 10 ** 9 if window_seconds else None
+    return read_spans(trace_file, since_ns=since_ns, max_bytes=MAX_READ_BYTES)
+
+def format_ms(value: float) -> str:
+    return f"{value / 1000:.2f} s" if value >= 1000 else f"{value:.0f} ms"
+
+def show_trace(trace_spans: List[Dict]):
+    """Desglose de una traza: cada span con su sangría según la jerarquía."""
+    children: Dict[str, List[Dict]] = {}
+    for item in trace_spans:
+        children.setdefault(item['parent_span_id'], []).append(item)
+
+    lines = []
+    def walk(parent_id: str, depth: int):
+        for item in sorted(children.get(parent_id, []), key=lambda s: s['start_ns']):
+            detail = item['attributes'].get('document') or item['attributes'].get('llm.model') or ""
+            marker = " ❌" if item['error'] else ""
+            lines.append(f"{'    ' * depth}- **{item['name']}** {format_ms(item['duration_ms'])} {detail}{marker}")
+            walk(item['span_id'], depth + 1)
+
+    walk("", 0)
+    st.markdown("\n".join(lines))
+
+def show_scheduler():
+    """Estado en vivo de la fila de solicitudes a OpenAI de este proceso."""
+    state = get_scheduler().snapshot()
+    st.markdown("### 🚦 Fila de OpenAI")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("En curso", state['active'])
+    with col2:
+        st.metric("En espera", sum(state['waiting'].values()))
+    with col3:
+        st.metric("Tokens disponibles", f"{state['available_tokens']:,}")
+    with col4:
+        st.metric("Límites de tasa (429)", state['rate_limited'])
+    if state['paused_s'] > 0:
+        st.warning(f"OpenAI pidió esperar: despachos en pausa por {state['paused_s']:.0f} s")
+    waiting = {name: count for name, count in state['waiting'].items() if count}
+    if waiting:
+        st.caption("En espera por prioridad: " + ", ".join(f"{name} {count}" for name, count in waiting.items()))
+
+    pools = pool_snapshots()
+    if pools:
+        st.markdown("#### 🔌 Conexiones HTTP")
+        st.dataframe([{
+            'endpoint': pool['endpoint'],
+            'solicitudes': pool['requests'],
+            'conexiones_abiertas': pool['open_connections'],
+            'libres': pool['idle_connections'],
+            'conexiones_creadas': pool['connections_opened'],
+            'saludos_tls': pool['tls_handshakes'],
+            'reutilizacion_pct': round(pool['reuse_pct'], 1)
+        } for pool in pools], use_container_width=True, hide_index=True)
+
+def show_vector_backends():
+    """Motor de búsqueda de cada documento; el cambio aplica a todos los usuarios."""
+    st.markdown("### 🧭 Motores de búsqueda")
+    doc_manager = DocumentManager()
+    documents = sorted(doc_manager.metadata.values(), key=lambda d: d.get('title', ''))
+    if not documents:
+        st.caption("No hay documentos en el catálogo.")
+        return
+
+    with st.expander(f"Motor por documento ({len(documents)})"):
+        for doc in documents:
+            current_backend = doc.get('vector_backend', DEFAULT_BACKEND)
+            if current_backend not in VECTOR_BACKENDS:
+                current_backend = DEFAULT_BACKEND
+            backend = st.selectbox(
+                doc.get('title', doc['hash']),
+                options=list(VECTOR_BACKENDS.keys()),
+                index=list(VECTOR_BACKENDS.keys()).index(current_backend),
+                format_func=lambda x: VECTOR_BACKENDS[x],
+                key=f"backend_{doc['hash']}"
+            )
+            if backend != current_backend:
+                doc_manager.set_vector_backend(doc['hash'], backend)
+                st.success("Motor actualizado. Se aplicará al cargar el asistente.")
+
+def main():
+    st.title("📈 Latencia por etapa")
+    show_scheduler()
+    show_vector_backends()
+
+    trace_file = get_trace_file()
+    if not tracing_enabled():
+        st.warning("Las trazas están desactivadas (YACHANI_TRACING=0).")
+    if not os.path.exists(trace_file):
+        st.info(f"Aún no hay trazas en `{trace_file}`. Se generan al usar los chats.")
+        st.stop()
+
+    with st.sidebar:
+        st.markdown("### 🔎 Filtros")
+        window = st.selectbox("Periodo", options=list(TIME_WINDOWS.keys()), index=1)
+        only_turns = st.checkbox(
+            "Solo consultas al chat",
+            value=True,
+            help="Excluye las ejecuciones de la página sin una pregunta (cambios de página, botones)"
+        )
+        if st.button("🔄 Actualizar"):
+            load_spans.clear()
+            st.rerun()
+
+    spans = load_spans(trace_file, os.path.getmtime(trace_file), TIME_WINDOWS[window])
+    if TIME_WINDOWS[window]:
+        since_ns = time.time_ns() - TIME_WINDOWS[window] * 10 ** 9
+        spans = [s for s in spans if s['start_ns'] >= since_ns]
+    else:
+        st.caption(f"Se muestran las trazas de los últimos {MAX_READ_BYTES // (1024 * 1024)} MB del archivo.")
+
+    turns = turn_trace_ids(spans)
+    if only_turns:
+        spans = [s for s in spans if s['trace_id'] in turns]
+
+    if not spans:
+        st.info("No hay trazas en el periodo seleccionado.")
+        st.stop()
+
+    roots = [s for s in spans if not s['parent_span_id'] and s['trace_id'] in turns]
+    summary = summarize_spans(spans)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Consultas", len(roots))
+    if roots:
+        turn_summary = summarize_spans(roots)[0]
+        with col2:
+            st.metric("Tiempo de respuesta p50", format_ms(turn_summary['p50_ms']))
+        with col3:
+            st.metric("Tiempo de respuesta p95", format_ms(turn_summary['p95_ms']))
+
+    st.markdown("### ⏱️ Percentiles por etapa")
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+    st.bar_chart({row['etapa']: row['p95_ms'] for row in summary}, x_label="Etapa", y_label="p95 (ms)")
+
+    st.markdown("### 🐢 Consultas más lentas")
+    by_trace: Dict[str, List[Dict]] = {}
+    for item in spans:
+        by_trace.setdefault(item['trace_id'], []).append(item)
+
+    for root in sorted(roots, key=lambda s: s['duration_ms'], reverse=True)[:10]:
+        started = datetime.fromtimestamp(root['start_ns'] / 1e9).strftime('%d/%m/%Y %H:%M:%S')
+        with st.expander(f"{format_ms(root['duration_ms'])} · {root['name']} · {started}"):
+            show_trace(by_trace[root['trace_id']])
+
+if __name__ == "__main__":
+    main()
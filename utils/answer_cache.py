@@ -0,0 +1,320 @@
+# utils/answer_cache.py
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.document_manager import DocumentManager
+
+# Campos de la configuración del agente que afectan a la respuesta
+AGENT_KEY_FIELDS = [
+    'name', 'role', 'style', 'detail_level',
+    'temperature', 'max_tokens', 'context_window', 'context_budget', 'answer_mode'
+]
+
+# Grupos de respuestas que se mantienen en memoria (los menos usados se descartan)
+MAX_LOADED_BUCKETS = 32
+
+# Cada cuánto se revisan en disco los grupos vencidos
+SWEEP_INTERVAL_SECONDS = 3600
+
+class AnswerCache:
+    """
+    Caché semántico de respuestas por agente.
+
+    Las respuestas se agrupan por una clave derivada de la configuración del
+    agente y de su conjunto de documentos, y se buscan por similitud coseno
+    entre el embedding de la consulta nueva y el de las consultas guardadas.
+    Solo se usa para preguntas que abren una conversación: la clave no
+    incluye los turnos anteriores.
+
+    En memoria se conservan los `MAX_LOADED_BUCKETS` grupos usados más
+    recientemente; `sweep` borra del disco los grupos vencidos o de
+    versiones de documentos que ya no existen.
+    """
+
+    def __init__(self, cache_dir: str = os.path.join("data", "answer_cache"),
+                 similarity_threshold: float = 0.95,
+                 ttl_seconds: int = 7 * 24 * 3600,
+                 max_entries: int = 500,
+                 max_loaded_buckets: int = MAX_LOADED_BUCKETS):
+        self.CACHE_DIR = cache_dir
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_loaded_buckets = max_loaded_buckets
+
+        os.makedirs(self.CACHE_DIR, exist_ok=True)
+
+        # clave -> {"doc_versions": {...}, "entries": [...], "matrix": np.ndarray},
+        # en orden de uso; los embeddings solo se guardan en la matriz
+        self._buckets: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    @staticmethod
+    def build_key(config: Dict, doc_manager, scope: Optional[str] = None) -> str:
+        """
+        Genera la clave del caché para un agente.
+        Incluye la fecha de procesamiento de cada documento para que una
+        nueva carga del documento invalide automáticamente las respuestas.
+        `scope` separa respuestas que dependen de contexto adicional, como
+        la página abierta en el visor.
+        """
+        payload = {
+            'agent': {field: config.get(field) for field in AGENT_KEY_FIELDS},
+            'docs': sorted(AnswerCache.doc_versions(config, doc_manager).items()),
+            'scope': scope
+        }
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+
+    @staticmethod
+    def doc_versions(config: Dict, doc_manager) -> Dict[str, str]:
+        """Fecha de procesamiento de cada documento del agente, por hash."""
+        versions = {}
+        for vs in config.get('vectorstores', []):
+            doc = doc_manager.get_document(vs['hash']) or {}
+            versions[vs['hash']] = doc.get('processed_date', '')
+        return versions
+
+    @staticmethod
+    def applies_to(history: List[Dict]) -> bool:
+        """
+        Indica si una consulta puede leerse o guardarse en el caché, dados
+        los mensajes anteriores a ella. Con turnos previos la pregunta puede
+        depender de ellos ("explícalo más", "¿y el segundo?") y una respuesta
+        guardada vendría de otra conversación, quizá de otro estudiante.
+        El saludo inicial del asistente no cuenta como contexto.
+        """
+        return not any(message.get('role') == 'user' for message in history)
+
+    def _bucket_path(self, cache_key: str) -> str:
+        return os.path.join(self.CACHE_DIR, f"{cache_key}.json")
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm > 0 else array
+
+    def _load_bucket(self, cache_key: str) -> Dict:
+        """Cargar (o crear) el grupo de respuestas de una clave."""
+        bucket = self._buckets.get(cache_key)
+        if bucket is not None:
+            self._buckets.move_to_end(cache_key)
+            return bucket
+
+        bucket = {"doc_versions": {}, "entries": []}
+        path = self._bucket_path(cache_key)
+        try:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    bucket = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Error decoding {path}, discarding cache bucket")
+        except Exception as e:
+            print(f"Error loading answer cache: {str(e)}")
+
+        entries = bucket["entries"]
+        bucket["matrix"] = np.vstack([self._normalize(e.pop('embedding')) for e in entries]) \
+            if entries else np.zeros((0, 0), dtype=np.float32)
+        bucket.setdefault("doc_versions", {})
+        self._buckets[cache_key] = bucket
+        while len(self._buckets) > self.max_loaded_buckets:
+            self._buckets.popitem(last=False)
+        return bucket
+
+    def _save_bucket(self, cache_key: str, bucket: Dict) -> None:
+        """Guardar un grupo de respuestas de forma segura."""
+        try:
+            data = {
+                "doc_hashes": sorted(bucket["doc_versions"]),
+                "doc_versions": bucket["doc_versions"],
+                "entries": [
+                    {**entry, 'embedding': [float(x) for x in row]}
+                    for entry, row in zip(bucket["entries"], bucket["matrix"])
+                ]
+            }
+            tmp_path = self._bucket_path(cache_key) + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self._bucket_path(cache_key))
+        except Exception as e:
+            print(f"Error saving answer cache: {str(e)}")
+
+    def _drop_expired(self, bucket: Dict) -> bool:
+        """Eliminar entradas vencidas. Devuelve True si hubo cambios."""
+        now = time.time()
+        alive = [
+            i for i, e in enumerate(bucket["entries"])
+            if now - e['created_at'] <= self.ttl_seconds
+        ]
+        if len(alive) == len(bucket["entries"]):
+            return False
+        bucket["entries"] = [bucket["entries"][i] for i in alive]
+        bucket["matrix"] = bucket["matrix"][alive] if alive else np.zeros((0, 0), dtype=np.float32)
+        return True
+
+    def lookup(self, cache_key: str, query_embedding: List[float],
+               threshold: Optional[float] = None) -> Optional[Dict]:
+        """
+        Buscar una respuesta para una consulta similar.
+        Devuelve la entrada (respuesta, fuentes, similitud) o None.
+        """
+        if threshold is None:
+            threshold = self.similarity_threshold
+
+        with self._lock:
+            bucket = self._load_bucket(cache_key)
+            if self._drop_expired(bucket):
+                self._save_bucket(cache_key, bucket)
+
+            if not bucket["entries"]:
+                return None
+
+            query = self._normalize(query_embedding)
+            if bucket["matrix"].shape[1] != query.shape[0]:
+                return None
+
+            scores = bucket["matrix"] @ query
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < threshold:
+                return None
+
+            entry = bucket["entries"][best]
+            return {
+                'query': entry['query'],
+                'answer': entry['answer'],
+                'sources': entry.get('sources', []),
+                'similarity': similarity
+            }
+
+    def store(self, cache_key: str, query: str, query_embedding: List[float],
+              answer: str, sources: List[str], doc_versions: Dict[str, str]) -> None:
+        """
+        Guardar una respuesta nueva en el caché. `doc_versions` son las
+        versiones de los documentos del agente (ver `doc_versions`).
+        """
+        with self._lock:
+            bucket = self._load_bucket(cache_key)
+            bucket["doc_versions"] = dict(doc_versions)
+            bucket["entries"].append({
+                'query': query,
+                'answer': answer,
+                'sources': sources,
+                'created_at': time.time()
+            })
+            row = self._normalize(query_embedding)[None, :]
+            matrix = bucket["matrix"]
+            bucket["matrix"] = np.vstack([matrix, row]) \
+                if matrix.shape[0] and matrix.shape[1] == row.shape[1] else row
+
+            # Conservar solo las entradas más recientes
+            if len(bucket["entries"]) > self.max_entries:
+                bucket["entries"] = bucket["entries"][-self.max_entries:]
+                bucket["matrix"] = bucket["matrix"][-self.max_entries:]
+
+            self._save_bucket(cache_key, bucket)
+
+        if time.time() - self._last_sweep > SWEEP_INTERVAL_SECONDS:
+            self.sweep()
+
+    def sweep(self, documents: Optional[Dict[str, Dict]] = None) -> int:
+        """
+        Borrar del disco los grupos sin respuestas vigentes (el archivo no
+        se escribe desde hace más que el TTL) y, si se pasan los metadatos
+        de los documentos (`{hash: doc}`), los de documentos eliminados o
+        de una versión anterior. Devuelve el número de grupos eliminados.
+        """
+        removed = 0
+        now = time.time()
+        with self._lock:
+            self._last_sweep = now
+            for file in os.listdir(self.CACHE_DIR):
+                if not file.endswith(".json"):
+                    continue
+                cache_key = file[:-5]
+                path = self._bucket_path(cache_key)
+                try:
+                    stale = now - os.path.getmtime(path) > self.ttl_seconds
+                    if not stale and documents is not None:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            doc_versions = json.load(f).get("doc_versions", {})
+                        stale = any(
+                            doc_hash not in documents
+                            or documents[doc_hash].get('processed_date', '') != processed_date
+                            for doc_hash, processed_date in doc_versions.items()
+                        )
+                except (OSError, ValueError):
+                    # Archivo ilegible: se descarta
+                    stale = True
+
+                if stale:
+                    self._buckets.pop(cache_key, None)
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError as e:
+                        print(f"Error removing cache bucket: {str(e)}")
+        return removed
+
+    def invalidate_document(self, doc_hash: str) -> int:
+        """
+        Eliminar todas las respuestas de agentes que usan un documento.
+        Devuelve el número de grupos eliminados.
+        """
+        removed = 0
+        with self._lock:
+            for file in os.listdir(self.CACHE_DIR):
+                if not file.endswith(".json"):
+                    continue
+                cache_key = file[:-5]
+                try:
+                    with open(self._bucket_path(cache_key), 'r', encoding='utf-8') as f:
+                        doc_hashes = json.load(f).get("doc_hashes", [])
+                except Exception:
+                    doc_hashes = []
+
+                if doc_hash in doc_hashes:
+                    self._buckets.pop(cache_key, None)
+                    try:
+                        os.remove(self._bucket_path(cache_key))
+                    except OSError as e:
+                        print(f"Error removing cache bucket: {str(e)}")
+                    removed += 1
+        return removed
+
+    def clear(self, cache_key: str) -> None:
+        """Vaciar las respuestas guardadas de un agente."""
+        with self._lock:
+            self._buckets.pop(cache_key, None)
+            path = self._bucket_path(cache_key)
+            if os.path.exists(path):
+                os.remove(path)
+
+_answer_cache: Optional[AnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Caché de respuestas único del proceso, compartido por las páginas de
+    chat y la carga de documentos. Al crearlo se limpian los grupos
+    vencidos o de versiones anteriores de los documentos.
+    """
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+            try:
+                _answer_cache.sweep(DocumentManager().metadata)
+            except Exception as e:
+                print(f"Error sweeping answer cache: {str(e)}")
+        return _answer_cache
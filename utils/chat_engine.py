@@ -0,0 +1,376 @@
+# utils/chat_engine.py
+import re
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from langchain.agents import initialize_agent
+from langchain.agents.types import AgentType
+from langchain.tools import Tool
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage
+
+from utils.openai_clients import get_chat_model
+from utils.llm_scheduler import PRIORITY_INTERACTIVE, SchedulerCallbackHandler
+from utils.tracing import TracingCallbackHandler, propagate, span
+
+CHAT_MODEL = "gpt-4-0125-preview"
+
+# Formas de responder de un asistente
+ANSWER_MODES = {
+    "agent": "Agente ReAct (decide cuándo buscar)",
+    "direct": "RAG directo (busca primero, una sola llamada)"
+}
+
+DEFAULT_ANSWER_MODE = "agent"
+
+# Parecido mínimo (Jaccard de palabras de contenido) entre la consulta del agente y la
+# del usuario para reutilizar la búsqueda anticipada
+SPECULATIVE_MIN_OVERLAP = 0.5
+
+# Marca del agente ReAct que precede a la respuesta final
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+class QueueNotice:
+    """Aviso en `status_area` mientras la consulta espera turno para el modelo."""
+
+    def __init__(self, status_area=None):
+        self.status_area = status_area
+        self._placeholder = None
+
+    def show(self, position: int) -> None:
+        if self.status_area is None:
+            return
+        if self._placeholder is None:
+            if position == 0:
+                return
+            with self.status_area:
+                self._placeholder = st.empty()
+        if position > 0:
+            self._placeholder.info(
+                f"⏳ Hay muchas consultas en curso: tu pregunta es la número {position} en la fila"
+            )
+        else:
+            self._placeholder.empty()
+
+def build_llm(config: Dict):
+    """Modelo de chat con la configuración del asistente (compartido entre sesiones)."""
+    return get_chat_model(
+        CHAT_MODEL,
+        temperature=config['temperature'],
+        max_tokens=config['max_tokens'],
+        # Necesario para recibir los tokens en los callbacks
+        streaming=True
+    )
+
+def build_chat_prompt(config: Dict, recent_history: str, query: str, direct_mode: bool,
+                      page_context: Optional[str] = None) -> str:
+    """
+    Instrucciones de un turno del chat educativo. `page_context` describe
+    lo que el estudiante tiene abierto en el visor de documentos.
+    """
+    if direct_mode:
+        search_instruction = "Usa los fragmentos de los documentos incluidos al final"
+    else:
+        search_instruction = "Usa search_documents para encontrar información relevante"
+    viewer = f"\n    {page_context}\n" if page_context else ""
+
+    return f"""Actúa como {config['name']}, un {config['role']} con estilo {config['style'].lower()}.
+
+    Historial reciente de la conversación:
+    {recent_history}
+
+    Consulta actual: {query}
+{viewer}
+    Instrucciones:
+    1. {search_instruction}
+    2. Responde usando SOLO información de los documentos
+    3. Cita las fuentes usando [Documento]
+    4. Mantén un nivel de detalle {config['detail_level'].lower()}
+    5. Si no encuentras información, sugiere cómo reformular la pregunta
+    6. Ten en cuenta el contexto del historial reciente
+    7. Mantén la coherencia con las respuestas anteriores
+    """
+
+def build_agent(config: Dict, search_documents: Callable[[str], str]):
+    """
+    Crear el agente ReAct del asistente con la herramienta de búsqueda.
+    El agente no guarda memoria propia: el historial llega en el prompt
+    desde `ConversationMemory`.
+    """
+    llm = build_llm(config)
+
+    tools = [
+        Tool(
+            name="search_documents",
+            func=search_documents,
+            description="Busca información en los documentos base."
+        )
+    ]
+
+    return initialize_agent(
+        tools,
+        llm,
+        agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+        verbose=True,
+        max_iterations=3,
+        handle_parsing_errors=True
+    )
+
+def agent_signature(config: Dict) -> tuple:
+    """Lo que define al agente de un asistente: si cambia, hay que volver a crearlo."""
+    return (
+        config['name'],
+        tuple(vs['hash'] for vs in config['vectorstores']),
+        config['temperature'],
+        config['max_tokens']
+    )
+
+def get_session_agent(key: str, config: Dict, search_documents: Callable[[str], str]):
+    """
+    Agente de una página, guardado en la sesión bajo `key`. Cada página usa
+    su propia clave porque su herramienta de búsqueda es distinta, y el
+    agente se vuelve a crear al elegir otro asistente.
+    """
+    signature = agent_signature(config)
+    stored = st.session_state.get(key)
+    if stored is None or stored[0] != signature:
+        stored = (signature, build_agent(config, search_documents))
+        st.session_state[key] = stored
+    return stored[1]
+
+class AgentStreamHandler(BaseCallbackHandler):
+    """
+    Envía a una cola los tokens de la respuesta final y los pasos de búsqueda.
+    Los pensamientos y acciones intermedios del ReAct no se muestran.
+    """
+
+    def __init__(self, events: queue.Queue):
+        self.events = events
+        self._buffer = ""
+        self._sent: Optional[int] = None
+        self._started = False
+
+    def _reset(self) -> None:
+        self._buffer = ""
+        self._sent = None
+        self._started = False
+
+    def on_llm_start(self, *args: Any, **kwargs: Any) -> None:
+        self._reset()
+
+    def on_chat_model_start(self, *args: Any, **kwargs: Any) -> None:
+        self._reset()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._buffer += token
+        if self._sent is None:
+            start = self._buffer.find(FINAL_ANSWER_MARKER)
+            if start < 0:
+                return
+            self._sent = start + len(FINAL_ANSWER_MARKER)
+
+        pending = self._buffer[self._sent:]
+        if not self._started:
+            pending = pending.lstrip()
+            if not pending:
+                return
+            self._started = True
+        self._sent = len(self._buffer)
+        self.events.put(('token', pending))
+
+    def on_tool_start(self, serialized: Dict, input_str: str, **kwargs: Any) -> None:
+        self.events.put(('tool_start', input_str))
+
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        self.events.put(('tool_end', str(output)))
+
+class AgentStream:
+    """
+    Ejecuta el agente en un hilo y entrega la respuesta token a token para
+    `st.write_stream`. Las búsquedas se muestran en `status_area` mientras
+    ocurren. Al terminar, `response` contiene la respuesta completa del agente.
+    """
+
+    def __init__(self, agent, prompt_text: str, status_area=None):
+        self.agent = agent
+        self.prompt_text = prompt_text
+        self.status_area = status_area
+        self.response: Optional[str] = None
+        self._status = None
+        self._searches = 0
+        self._queue_notice = QueueNotice(status_area)
+
+    def _show_search(self, query: str) -> None:
+        if self.status_area is None:
+            return
+        self._searches += 1
+        if self._status is None:
+            with self.status_area:
+                self._status = st.status("🔍 Buscando en los documentos...", expanded=False)
+        else:
+            self._status.update(label="🔍 Buscando en los documentos...", state="running")
+        self._status.write(f"Búsqueda {self._searches}: {query}")
+
+    def _finish_search(self) -> None:
+        if self._status is not None:
+            self._status.update(
+                label=f"📚 {self._searches} búsqueda(s) en los documentos",
+                state="complete"
+            )
+
+    def __iter__(self) -> Iterator[str]:
+        events: queue.Queue = queue.Queue()
+        handler = AgentStreamHandler(events)
+        # El turno para el modelo se pide antes que los demás callbacks
+        scheduler = SchedulerCallbackHandler(
+            PRIORITY_INTERACTIVE, on_wait=lambda position: events.put(('queued', position))
+        )
+
+        def run():
+            try:
+                with span("agent"):
+                    response = self.agent.run(
+                        self.prompt_text, callbacks=[scheduler, handler, TracingCallbackHandler()]
+                    )
+                events.put(('done', response))
+            except Exception as e:
+                events.put(('error', e))
+
+        thread = threading.Thread(target=propagate(run), daemon=True)
+        # La herramienta de búsqueda del agente usa st.session_state
+        add_script_run_ctx(thread, get_script_run_ctx())
+        thread.start()
+
+        streamed = False
+        while True:
+            kind, value = events.get()
+            if kind == 'token':
+                streamed = True
+                yield value
+            elif kind == 'tool_start':
+                self._show_search(value)
+            elif kind == 'tool_end':
+                self._finish_search()
+            elif kind == 'queued':
+                self._queue_notice.show(value)
+            elif kind == 'error':
+                self._finish_search()
+                raise value
+            else:
+                self.response = value
+                # Respuestas sin el formato ReAct (p. ej. límite de iteraciones)
+                if not streamed:
+                    yield value
+                break
+
+class DirectAnswerStream:
+    """
+    Modo RAG directo: busca con la consulta del usuario y responde con una
+    sola llamada al modelo, sin el ciclo de decisión del agente ReAct.
+    Se usa igual que `AgentStream` con `st.write_stream`.
+    """
+
+    def __init__(self, llm, prompt_text: str, query: str,
+                 search_documents: Callable[[str], str], status_area=None):
+        self.llm = llm
+        self.prompt_text = prompt_text
+        self.query = query
+        self.search_documents = search_documents
+        self.status_area = status_area
+        self.response: Optional[str] = None
+
+    def __iter__(self) -> Iterator[str]:
+        status = None
+        if self.status_area is not None:
+            with self.status_area:
+                status = st.status("🔍 Buscando en los documentos...", expanded=False)
+            status.write(f"Búsqueda: {self.query}")
+
+        context = self.search_documents(self.query)
+        if status is not None:
+            status.update(label="📚 1 búsqueda(s) en los documentos", state="complete")
+
+        message = HumanMessage(content=f"{self.prompt_text}\n\nFragmentos de los documentos:\n{context}")
+        scheduler = SchedulerCallbackHandler(PRIORITY_INTERACTIVE, on_wait=QueueNotice(self.status_area).show)
+        parts = []
+        for chunk in self.llm.stream([message], config={'callbacks': [scheduler, TracingCallbackHandler()]}):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+        self.response = "".join(parts)
+
+def query_overlap(a: str, b: str) -> float:
+    """
+    Jaccard entre las palabras de contenido (más de 3 letras) de dos
+    consultas; el agente suele quitar interrogativos y artículos.
+    """
+    words_a = {w for w in re.findall(r'\w+', a.lower()) if len(w) > 3}
+    words_b = {w for w in re.findall(r'\w+', b.lower()) if len(w) > 3}
+    if not words_a or not words_b:
+        return 1.0 if a.strip().lower() == b.strip().lower() else 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+class SpeculativeSearch:
+    """
+    Búsqueda anticipada: apenas llega el mensaje, calcula el embedding de la
+    consulta y busca en los documentos en un hilo, mientras se consulta el
+    caché y el agente decide qué hacer. La herramienta de búsqueda toma
+    estos resultados si el agente busca esencialmente la misma consulta, y
+    solo busca de nuevo si la reformuló.
+
+    `search(query, embedding)` no debe usar `st.session_state`: corre fuera
+    del hilo de la página.
+    """
+
+    def __init__(self, query: str, embed: Callable[[str], List[float]],
+                 search: Callable[[str, Optional[List[float]]], Any]):
+        self.query = query
+        self.embed = embed
+        self.search = search
+        self.embedding: Optional[List[float]] = None
+        self.results: Any = None
+
+        self._embedded = threading.Event()
+        self._done = threading.Event()
+        thread = threading.Thread(target=propagate(self._run), daemon=True)
+        # Las llamadas a OpenAI del hilo se atribuyen a la sesión de la página
+        add_script_run_ctx(thread, get_script_run_ctx(suppress_warning=True))
+        thread.start()
+
+    def _run(self) -> None:
+        try:
+            with span("retrieval.embed", speculative=True):
+                self.embedding = self.embed(self.query)
+        except Exception as e:
+            print(f"Error embedding speculative query: {str(e)}")
+        finally:
+            self._embedded.set()
+
+        try:
+            with span("retrieval.speculative"):
+                self.results = self.search(self.query, self.embedding)
+        except Exception as e:
+            print(f"Error in speculative search: {str(e)}")
+        finally:
+            self._done.set()
+
+    def get_embedding(self, timeout: Optional[float] = None) -> Optional[List[float]]:
+        """Embedding de la consulta original (None si falló)."""
+        self._embedded.wait(timeout)
+        return self.embedding
+
+    def results_for(self, query: str, timeout: Optional[float] = None) -> Any:
+        """
+        Resultados para la consulta del agente: los anticipados si es
+        esencialmente la consulta original, o una búsqueda nueva si la
+        reformuló o la búsqueda anticipada falló.
+        """
+        if query_overlap(query, self.query) >= SPECULATIVE_MIN_OVERLAP:
+            with span("retrieval.speculative_wait"):
+                self._done.wait(timeout)
+            if self.results is not None:
+                return self.results
+        return self.search(query, None)
@@ -0,0 +1,408 @@
+# utils/chat_history.py
+import os
+import re
+import gzip
+import json
+import time
+import uuid
+import queue
+import atexit
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# Mensajes que se cargan por defecto al abrir un historial
+DEFAULT_TAIL = 200
+
+# Sesiones sin actividad por más de estos días se comprimen
+COMPACT_AFTER_DAYS = 7
+
+# Bytes leídos por bloque al buscar las últimas líneas de un archivo
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# Sesiones por página en el listado de historiales
+SESSIONS_PAGE_SIZE = 20
+
+# Usuario de los historiales cuando la app no tiene autenticación
+DEFAULT_USER = "local"
+
+SESSION_SUFFIX = ".jsonl"
+COMPACTED_SUFFIX = ".jsonl.gz"
+CATALOG_FILE = "catalog.db"
+
+def safe_name(value: str) -> str:
+    """Nombre de archivo seguro para un agente o una sesión."""
+    return re.sub(r'[^\w\-]+', '_', value).strip('_') or "sin_nombre"
+
+def new_session_id() -> str:
+    """ID de sesión ordenable por fecha de inicio."""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+def session_start(session_id: str) -> Optional[datetime]:
+    """Fecha de inicio codificada en el ID de sesión."""
+    try:
+        return datetime.strptime(session_id[:15], '%Y%m%d_%H%M%S')
+    except ValueError:
+        return None
+
+def read_tail_lines(path: str, limit: int) -> List[bytes]:
+    """Últimas `limit` líneas de un archivo leyendo bloques desde el final."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= limit:
+            step = min(TAIL_BLOCK_SIZE, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = [line for line in data.split(b"\n") if line.strip()]
+    return lines[-limit:]
+
+class SessionCatalog:
+    """
+    Índice SQLite de las sesiones de historial: agente, usuario, inicio,
+    última actividad y número de mensajes. Permite listar las sesiones de
+    un agente paginadas sin recorrer el directorio de historiales.
+    """
+
+    def __init__(self, db_path: str):
+        self.DB_PATH = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    agent_key TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    started_at TEXT NOT NULL,
+                    last_activity TEXT NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    compacted INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (agent_key, session_id)
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sessions_agent_activity "
+                "ON sessions (agent_key, last_activity DESC)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sessions_agent_user_activity "
+                "ON sessions (agent_key, user_id, last_activity DESC)"
+            )
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is None
+
+    def record_messages(self, agent_key: str, session_id: str, user_id: str,
+                        count: int, last_activity: str) -> None:
+        """Registrar `count` mensajes nuevos en una sesión (la crea si no existe)."""
+        started = session_start(session_id)
+        started_at = started.isoformat() if started else last_activity
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT INTO sessions (agent_key, session_id, user_id, started_at, last_activity, message_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (agent_key, session_id) DO UPDATE SET
+                    message_count = message_count + excluded.message_count,
+                    last_activity = excluded.last_activity,
+                    compacted = 0
+            """, (agent_key, session_id, user_id, started_at, last_activity, count))
+
+    def set_compacted(self, agent_key: str, session_id: str, compacted: bool) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE sessions SET compacted = ? WHERE agent_key = ? AND session_id = ?",
+                (int(compacted), agent_key, session_id)
+            )
+
+    def _where(self, agent_key: str, user_id: Optional[str],
+               since: Optional[str]) -> Tuple[str, List]:
+        clauses, params = ["agent_key = ?"], [agent_key]
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if since is not None:
+            clauses.append("last_activity >= ?")
+            params.append(since)
+        return " AND ".join(clauses), params
+
+    def list_sessions(self, agent_key: str, user_id: Optional[str] = None,
+                      since: Optional[str] = None, limit: int = SESSIONS_PAGE_SIZE,
+                      offset: int = 0) -> List[Dict]:
+        """Sesiones de un agente ordenadas por última actividad, paginadas."""
+        where, params = self._where(agent_key, user_id, since)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM sessions WHERE {where} "
+                "ORDER BY last_activity DESC, session_id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_sessions(self, agent_key: str, user_id: Optional[str] = None,
+                       since: Optional[str] = None) -> int:
+        where, params = self._where(agent_key, user_id, since)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM sessions WHERE {where}", params
+            ).fetchone()[0]
+
+    def get_session(self, agent_key: str, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM sessions WHERE agent_key = ? AND session_id = ?",
+                (agent_key, session_id)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def replace_all(self, rows: List[Dict]) -> None:
+        """Reemplazar el índice completo (reconstrucción desde los archivos)."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions")
+            self._conn.executemany("""
+                INSERT INTO sessions (agent_key, session_id, user_id, started_at,
+                                      last_activity, message_count, compacted)
+                VALUES (:agent_key, :session_id, :user_id, :started_at,
+                        :last_activity, :message_count, :compacted)
+            """, rows)
+
+class ChatHistoryStore:
+    """
+    Historial de chat en archivos JSONL de solo anexado.
+
+    Cada sesión de chat tiene su propio archivo
+    `chat_history/<agente>/<sesión>.jsonl` con un mensaje por línea. Las
+    escrituras se encolan y un hilo en segundo plano las agrega al final
+    del archivo, así que cada turno cuesta O(tamaño del mensaje). Las
+    sesiones inactivas se comprimen con gzip. `catalog` indexa las sesiones
+    para listarlas sin recorrer el directorio.
+    """
+
+    def __init__(self, history_dir: str = os.path.join("data", "chat_history"),
+                 compact_after_days: int = COMPACT_AFTER_DAYS):
+        self.HISTORY_DIR = history_dir
+        self.compact_after_days = compact_after_days
+
+        os.makedirs(self.HISTORY_DIR, exist_ok=True)
+        self.catalog = SessionCatalog(os.path.join(self.HISTORY_DIR, CATALOG_FILE))
+
+        self._queue: "queue.Queue[Tuple[str, str, str, Dict]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def _session_path(self, agent_key: str, session_id: str, compacted: bool = False) -> str:
+        suffix = COMPACTED_SUFFIX if compacted else SESSION_SUFFIX
+        return os.path.join(self.HISTORY_DIR, safe_name(agent_key), f"{safe_name(session_id)}{suffix}")
+
+    def append(self, agent_key: str, session_id: str, messages: List[Dict],
+               user_id: str = DEFAULT_USER) -> None:
+        """Encolar mensajes nuevos para agregarlos al final de la sesión."""
+        key = (safe_name(agent_key), safe_name(session_id), user_id)
+        for message in messages:
+            self._queue.put((*key, message))
+
+    def flush(self) -> None:
+        """Esperar a que se escriban todos los mensajes encolados."""
+        self._queue.join()
+
+    def _write_loop(self) -> None:
+        # Compactar una vez al iniciar, sin bloquear a las páginas
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Error compacting chat history: {str(e)}")
+
+        while True:
+            batch = [self._queue.get()]
+            # Agrupar lo que ya esté encolado en una sola escritura por archivo
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            by_session: Dict[Tuple[str, str, str], List[str]] = {}
+            for agent_key, session_id, user_id, message in batch:
+                by_session.setdefault((agent_key, session_id, user_id), []).append(
+                    json.dumps(message, ensure_ascii=False)
+                )
+
+            now = datetime.now().isoformat(timespec='seconds')
+            for (agent_key, session_id, user_id), lines in by_session.items():
+                path = self._session_path(agent_key, session_id)
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    self._restore_compacted(path)
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write("\n".join(lines) + "\n")
+                    self.catalog.record_messages(agent_key, session_id, user_id, len(lines), now)
+                except Exception as e:
+                    print(f"Error writing chat history {path}: {str(e)}")
+
+            for _ in batch:
+                self._queue.task_done()
+
+    def _restore_compacted(self, path: str) -> None:
+        """Descomprimir una sesión compactada antes de seguir agregándole mensajes."""
+        compacted_path = path[:-len(SESSION_SUFFIX)] + COMPACTED_SUFFIX
+        if os.path.exists(path) or not os.path.exists(compacted_path):
+            return
+        with gzip.open(compacted_path, 'rb') as src, open(path + ".tmp", 'wb') as dst:
+            dst.write(src.read())
+        os.replace(path + ".tmp", path)
+        os.remove(compacted_path)
+
+    def load(self, agent_key: str, session_id: str, limit: Optional[int] = DEFAULT_TAIL) -> List[Dict]:
+        """
+        Cargar los últimos `limit` mensajes de una sesión (todos si es None).
+        Solo se lee el archivo de esa sesión, y de él solo el final.
+        """
+        self.flush()
+        path = self._session_path(agent_key, session_id)
+        compacted_path = self._session_path(agent_key, session_id, compacted=True)
+
+        try:
+            if os.path.exists(path):
+                if limit is None:
+                    with open(path, 'rb') as f:
+                        lines = [line for line in f if line.strip()]
+                else:
+                    lines = read_tail_lines(path, limit)
+            elif os.path.exists(compacted_path):
+                with gzip.open(compacted_path, 'rb') as f:
+                    lines = [line for line in f if line.strip()]
+                if limit is not None:
+                    lines = lines[-limit:]
+            else:
+                return []
+        except Exception as e:
+            print(f"Error loading chat history {path}: {str(e)}")
+            return []
+
+        messages = []
+        for line in lines:
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Línea incompleta por una escritura interrumpida
+                continue
+        return messages
+
+    def list_sessions(self, agent_key: str, user_id: Optional[str] = None,
+                      since: Optional[str] = None, limit: int = SESSIONS_PAGE_SIZE,
+                      offset: int = 0) -> List[Dict]:
+        """
+        Sesiones de un agente (opcionalmente de un usuario y con actividad
+        desde `since`), de la más reciente a la más antigua.
+        """
+        return self.catalog.list_sessions(safe_name(agent_key), user_id, since, limit, offset)
+
+    def count_sessions(self, agent_key: str, user_id: Optional[str] = None,
+                       since: Optional[str] = None) -> int:
+        return self.catalog.count_sessions(safe_name(agent_key), user_id, since)
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Comprimir sesiones inactivas y migrar los historiales antiguos
+        `<agent_id>.json` (un arreglo completo por agente y día) a JSONL.
+        Si el catálogo está vacío se reconstruye a partir de los archivos.
+        """
+        stats = {'migrated': 0, 'compressed': 0, 'indexed': 0}
+        cutoff = time.time() - self.compact_after_days * 24 * 3600
+
+        if self.catalog.is_empty():
+            stats['indexed'] = self.rebuild_catalog()
+
+        for name in sorted(os.listdir(self.HISTORY_DIR)):
+            path = os.path.join(self.HISTORY_DIR, name)
+            if name.endswith(".json") and os.path.isfile(path):
+                self._migrate_legacy(path)
+                stats['migrated'] += 1
+
+        for agent_key in os.listdir(self.HISTORY_DIR):
+            agent_dir = os.path.join(self.HISTORY_DIR, agent_key)
+            if not os.path.isdir(agent_dir):
+                continue
+            for name in os.listdir(agent_dir):
+                path = os.path.join(agent_dir, name)
+                if not name.endswith(SESSION_SUFFIX) or os.path.getmtime(path) > cutoff:
+                    continue
+                compacted_path = path[:-len(SESSION_SUFFIX)] + COMPACTED_SUFFIX
+                with open(path, 'rb') as src, gzip.open(compacted_path + ".tmp", 'wb') as dst:
+                    dst.write(src.read())
+                os.replace(compacted_path + ".tmp", compacted_path)
+                os.remove(path)
+                self.catalog.set_compacted(agent_key, name[:-len(SESSION_SUFFIX)], True)
+                stats['compressed'] += 1
+        return stats
+
+    def rebuild_catalog(self) -> int:
+        """Reindexar todas las sesiones leyendo los archivos de historial."""
+        rows = []
+        for agent_key in sorted(os.listdir(self.HISTORY_DIR)):
+            agent_dir = os.path.join(self.HISTORY_DIR, agent_key)
+            if not os.path.isdir(agent_dir):
+                continue
+            for name in os.listdir(agent_dir):
+                path = os.path.join(agent_dir, name)
+                compacted = name.endswith(COMPACTED_SUFFIX)
+                if compacted:
+                    session_id = name[:-len(COMPACTED_SUFFIX)]
+                    opener = gzip.open
+                elif name.endswith(SESSION_SUFFIX):
+                    session_id = name[:-len(SESSION_SUFFIX)]
+                    opener = open
+                else:
+                    continue
+
+                with opener(path, 'rb') as f:
+                    message_count = sum(1 for line in f if line.strip())
+                last_activity = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds')
+                started = session_start(session_id)
+                rows.append({
+                    'agent_key': agent_key,
+                    'session_id': session_id,
+                    'user_id': DEFAULT_USER,
+                    'started_at': started.isoformat() if started else last_activity,
+                    'last_activity': last_activity,
+                    'message_count': message_count,
+                    'compacted': int(compacted)
+                })
+        self.catalog.replace_all(rows)
+        return len(rows)
+
+    def _migrate_legacy(self, path: str) -> None:
+        """`agent_<nombre>_<AAAAMMDD>.json` -> `agent_<nombre>/<AAAAMMDD>_000000_legacy.jsonl`."""
+        stem = os.path.basename(path)[:-len(".json")]
+        agent_key, _, day = stem.rpartition("_")
+        if not agent_key or not day.isdigit():
+            agent_key, day = stem, datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y%m%d')
+        last_activity = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds')
+
+        with open(path, 'r', encoding='utf-8') as f:
+            messages = json.load(f)
+
+        session_id = f"{day}_000000_legacy"
+        target = self._session_path(agent_key, session_id)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'a', encoding='utf-8') as f:
+            for message in messages:
+                f.write(json.dumps(message, ensure_ascii=False) + "\n")
+        self.catalog.record_messages(
+            safe_name(agent_key), session_id, DEFAULT_USER, len(messages), last_activity
+        )
+        os.remove(path)
+
+def format_session_label(session_id: str) -> str:
+    """Etiqueta legible de una sesión a partir de su ID."""
+    started = session_start(session_id)
+    if started is None:
+        return f"Sesión {session_id}"
+    return f"Sesión del {started.strftime('%d/%m/%Y %H:%M')}"
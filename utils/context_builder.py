@@ -0,0 +1,144 @@
+# utils/context_builder.py
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import tiktoken
+
+from utils.retrieval import NO_RESULTS_MESSAGE
+
+# Modelo cuyo tokenizador se usa para contar
+TOKENIZER_MODEL = "gpt-4-0125-preview"
+
+# Tokens por defecto para historial y fragmentos de cada consulta
+DEFAULT_CONTEXT_BUDGET = 3000
+
+# Parte del presupuesto reservada al historial reciente
+HISTORY_SHARE = 0.25
+
+# Un fragmento recortado por debajo de este tamaño se descarta
+MIN_CHUNK_TOKENS = 60
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """Codificador de tiktoken (None si no se pudo cargar)."""
+    try:
+        return tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    except Exception as e:
+        print(f"Error loading tiktoken encoding, estimating tokens: {str(e)}")
+        return None
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        # Aproximación de ~4 caracteres por token
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+def compress_chunk(text: str, query: str, max_tokens: int) -> str:
+    """
+    Reducir un fragmento a `max_tokens` conservando las oraciones que
+    comparten más palabras con la consulta, en su orden original.
+    """
+    sentences = [s for s in re.split(r'(?<=[.!?])\s+', text) if s.strip()]
+    query_terms = {w for w in re.findall(r'\w+', query.lower()) if len(w) > 3}
+
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: len(query_terms & set(re.findall(r'\w+', sentences[i].lower()))),
+        reverse=True
+    )
+
+    kept, used = [], 0
+    for i in ranked:
+        tokens = count_tokens(sentences[i])
+        if used + tokens > max_tokens:
+            continue
+        kept.append(i)
+        used += tokens
+
+    if not kept:
+        return truncate_tokens(text, max_tokens)
+    return " ".join(sentences[i] for i in sorted(kept))
+
+def build_context(results: List[Dict], query: str, budget: int) -> Tuple[str, Dict]:
+    """
+    Armar el texto de contexto con los fragmentos en orden de puntaje hasta
+    llenar `budget` tokens. El primer fragmento que no cabe se comprime al
+    espacio restante y los siguientes se descartan.
+    Devuelve el texto y el desglose de tokens.
+    """
+    report = {
+        'budget': budget,
+        'context_tokens': 0,
+        'chunks_used': 0,
+        'chunks_trimmed': 0,
+        'chunks_dropped': 0
+    }
+    if not results:
+        return NO_RESULTS_MESSAGE, report
+
+    ordered = sorted(results, key=lambda r: r.get('score', 0.0), reverse=True)
+    parts, used = [], 0
+    for result in ordered:
+        prefix = f"[{result['source']}]: "
+        part = prefix + result['content']
+        tokens = count_tokens(part)
+        # Separador entre fragmentos
+        if parts:
+            tokens += 1
+
+        remaining = budget - used
+        if tokens <= remaining:
+            parts.append(part)
+            used += tokens
+            report['chunks_used'] += 1
+            continue
+
+        available = remaining - count_tokens(prefix) - 1
+        if available >= MIN_CHUNK_TOKENS:
+            part = prefix + compress_chunk(result['content'], query, available)
+            parts.append(part)
+            used += count_tokens(part) + 1
+            report['chunks_used'] += 1
+            report['chunks_trimmed'] += 1
+        else:
+            report['chunks_dropped'] += 1
+
+    report['context_tokens'] = used
+    return "\n\n".join(parts), report
+
+def split_budget(budget: Optional[int]) -> Tuple[int, int]:
+    """Repartir el presupuesto entre historial y fragmentos."""
+    budget = budget or DEFAULT_CONTEXT_BUDGET
+    history_budget = int(budget * HISTORY_SHARE)
+    return history_budget, budget - history_budget
+
+def merge_reports(total: Optional[Dict], report: Dict) -> Dict:
+    """Acumular los desgloses de varias búsquedas del mismo turno."""
+    if total is None:
+        return dict(report)
+    merged = dict(total)
+    for key in ['context_tokens', 'chunks_used', 'chunks_trimmed', 'chunks_dropped']:
+        merged[key] = merged.get(key, 0) + report.get(key, 0)
+    return merged
+
+def format_token_report(report: Dict) -> str:
+    """Resumen del desglose de tokens para mostrar bajo la respuesta."""
+    text = (
+        f"🧮 Tokens: {report.get('prompt_tokens', 0)} de instrucciones "
+        f"(historial {report.get('history_tokens', 0)}) + {report.get('context_tokens', 0)} de contexto"
+    )
+    if report.get('chunks_used') or report.get('chunks_dropped'):
+        text += f" · {report.get('chunks_used', 0)} fragmentos"
+        if report.get('chunks_trimmed'):
+            text += f", {report['chunks_trimmed']} comprimidos"
+        if report.get('chunks_dropped'):
+            text += f", {report['chunks_dropped']} descartados"
+    return text
@@ -0,0 +1,146 @@
+# utils/conversation_memory.py
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage
+
+from utils.chat_engine import CHAT_MODEL
+from utils.context_builder import count_tokens, truncate_tokens
+from utils.openai_clients import get_chat_model
+from utils.llm_scheduler import PRIORITY_BACKGROUND, SchedulerCallbackHandler, current_session
+from utils.tracing import span
+
+# Turnos (pregunta y respuesta) que se conservan textuales
+RECENT_TURNS = 3
+
+# Tokens máximos del resumen de los turnos anteriores
+SUMMARY_MAX_TOKENS = 300
+
+SUMMARY_PROMPT = """Actualiza el resumen de una conversación entre un estudiante y su asistente.
+
+Resumen actual:
+{summary}
+
+Nuevos mensajes:
+{messages}
+
+Escribe el resumen actualizado en español, en menos de {max_words} palabras.
+Conserva los temas consultados, las conclusiones y los datos que el estudiante
+haya dado sobre sí mismo. No agregues información que no esté en la conversación."""
+
+def format_message(message: Dict) -> str:
+    role = "Human" if message["role"] == "user" else "Assistant"
+    return f"{role}: {message['content']}"
+
+def build_summary_llm():
+    """Modelo para resumir: determinista y con salida corta."""
+    return get_chat_model(CHAT_MODEL, temperature=0, max_tokens=SUMMARY_MAX_TOKENS)
+
+class ConversationMemory:
+    """
+    Memoria acotada de una conversación.
+
+    Los últimos `recent_turns` turnos se envían textuales; los anteriores se
+    integran en un resumen que se actualiza en un hilo después de cada
+    respuesta, así que la consulta siguiente no espera al resumen. Mientras
+    el resumen no alcanza a los mensajes más antiguos de la ventana, estos
+    se envían textuales para no perderlos. `render` limita el total a un
+    presupuesto de tokens.
+    """
+
+    def __init__(self, key: Optional[str] = None, recent_turns: int = RECENT_TURNS,
+                 summary_max_tokens: int = SUMMARY_MAX_TOKENS):
+        # Identifica la conversación (sesión de historial) a la que pertenece
+        self.key = key
+        self.recent_turns = recent_turns
+        self.summary_max_tokens = summary_max_tokens
+
+        self.summary = ""
+        # Mensajes del inicio de la conversación ya incluidos en el resumen
+        self.summarized = 0
+
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def _window_start(self, messages: List[Dict]) -> int:
+        """Índice del primer mensaje que se conserva textual."""
+        return max(0, len(messages) - 2 * self.recent_turns)
+
+    def render(self, messages: List[Dict], budget: int) -> Tuple[str, int]:
+        """
+        Historial para el prompt: resumen más mensajes recientes, desde el
+        más nuevo hacia atrás mientras quepan en `budget` tokens.
+        Devuelve el texto y sus tokens.
+        """
+        with self._lock:
+            summary, summarized = self.summary, self.summarized
+
+        parts, used = [], 0
+        if summary:
+            # El resumen no puede ocupar más de la mitad del presupuesto
+            summary_text = "Resumen de la conversación anterior: " + truncate_tokens(summary, budget // 2)
+            used = count_tokens(summary_text) + 1
+            parts.append(summary_text)
+
+        lines = []
+        start = min(summarized, self._window_start(messages))
+        for message in reversed(messages[start:]):
+            line = format_message(message)
+            tokens = count_tokens(line) + 1
+            if used + tokens > budget:
+                break
+            lines.append(line)
+            used += tokens
+
+        return "\n".join(parts + list(reversed(lines))), used
+
+    def update(self, messages: List[Dict], llm=None) -> None:
+        """
+        Después de cada respuesta: resumir en segundo plano los mensajes que
+        salieron de la ventana de turnos recientes.
+        """
+        window_start = self._window_start(messages)
+        with self._lock:
+            if window_start <= self.summarized:
+                return
+            if self._worker is not None and self._worker.is_alive():
+                # El siguiente update incluirá estos mensajes
+                return
+            pending = list(messages[self.summarized:window_start])
+            summary = self.summary
+
+            self._worker = threading.Thread(
+                target=self._summarize,
+                args=(llm or build_summary_llm(), summary, pending, window_start, current_session()),
+                daemon=True
+            )
+            self._worker.start()
+
+    def _summarize(self, llm, summary: str, pending: List[Dict], upto: int, session: str) -> None:
+        try:
+            prompt = SUMMARY_PROMPT.format(
+                summary=summary or "(vacío)",
+                messages="\n".join(format_message(m) for m in pending),
+                # ~0.75 palabras por token
+                max_words=int(self.summary_max_tokens * 0.75)
+            )
+            with span("memory.summarize", messages=len(pending)):
+                # Los resúmenes ceden el turno a las consultas del chat
+                scheduler = SchedulerCallbackHandler(PRIORITY_BACKGROUND, session=session)
+                new_summary = llm.invoke(
+                    [HumanMessage(content=prompt)], config={'callbacks': [scheduler]}
+                ).content.strip()
+            new_summary = truncate_tokens(new_summary, self.summary_max_tokens)
+        except Exception as e:
+            print(f"Error summarizing conversation: {str(e)}")
+            return
+
+        with self._lock:
+            self.summary = new_summary
+            self.summarized = upto
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Esperar a que termine el resumen en curso."""
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
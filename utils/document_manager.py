@@ -6,6 +6,9 @@ from typing import Dict, List, Optional
 import hashlib
 from pathlib import Path
 import shutil
+import threading
+
+from utils.page_store import PageStore, open_page_store
 
 class DocumentManager:
     def __init__(self):
@@ -22,6 +25,11 @@ class DocumentManager:
         self.metadata = self._load_metadata()
         self.categories = self._load_categories()
 
+        # Archivos de los documentos para el visor, por hash (solo la versión actual)
+        self._metadata_mtime = self._get_metadata_mtime()
+        self._document_files: Dict[str, Dict] = {}
+        self._files_lock = threading.Lock()
+
     def _ensure_directory_structure(self):
         """Crear estructura de directorios necesaria."""
         os.makedirs(self.BASE_DIR, exist_ok=True)
@@ -72,16 +80,21 @@ class DocumentManager:
     def _save_metadata(self, metadata: Dict) -> None:
         """Guardar metadatos de forma segura."""
         try:
-            with open(self.METADATA_FILE, 'w', encoding='utf-8') as f:
+            # Archivo temporal y reemplazo atómico: otros procesos nunca leen un JSON a medias
+            tmp_path = f"{self.METADATA_FILE}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump(metadata, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.METADATA_FILE)
         except Exception as e:
             print(f"Error saving metadata: {str(e)}")
 
     def _save_categories(self, categories: Dict) -> None:
         """Guardar categorías de forma segura."""
         try:
-            with open(self.CATEGORIES_FILE, 'w', encoding='utf-8') as f:
+            tmp_path = f"{self.CATEGORIES_FILE}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump(categories, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.CATEGORIES_FILE)
         except Exception as e:
             print(f"Error saving categories: {str(e)}")
 
@@ -136,6 +149,93 @@ class DocumentManager:
         """Obtener metadata de un documento específico."""
         return self.metadata.get(doc_hash)
 
+    def _get_metadata_mtime(self) -> float:
+        try:
+            return os.path.getmtime(self.METADATA_FILE)
+        except OSError:
+            return 0.0
+
+    def refresh_metadata(self) -> None:
+        """Volver a leer los metadatos si otra página o proceso los cambió."""
+        mtime = self._get_metadata_mtime()
+        if mtime != self._metadata_mtime:
+            self.metadata = self._load_metadata()
+            self._metadata_mtime = mtime
+
+    def _find_document_pdf(self, doc: Dict) -> Optional[str]:
+        """PDF original del documento (o, en documentos antiguos, el PDF de su carpeta)."""
+        original_path = doc.get('original_path')
+        if original_path and original_path.lower().endswith('.pdf') and os.path.exists(original_path):
+            return original_path
+
+        doc_dir = doc.get('vectorstore_path')
+        if doc_dir and os.path.isdir(doc_dir):
+            pdf_files = sorted(f for f in os.listdir(doc_dir) if f.lower().endswith('.pdf'))
+            if pdf_files:
+                return os.path.join(doc_dir, pdf_files[0])
+        return None
+
+    def get_document_file(self, doc_hash: str) -> Optional[Dict]:
+        """
+        Archivo de un documento para el visor: título, ruta del PDF, número
+        de páginas y su `PageStore`. Se resuelve una vez por versión del
+        documento (`processed_date`); las siguientes consultas no leen el disco.
+        Al abrir una versión nueva se cierra el `PageStore` de la anterior.
+        """
+        doc = self.metadata.get(doc_hash)
+        if doc is None:
+            self._drop_document_file(doc_hash)
+            return None
+
+        version = doc.get('processed_date')
+        with self._files_lock:
+            cached = self._document_files.get(doc_hash)
+        if cached is not None and cached['version'] == version:
+            return cached
+
+        pdf_path = self._find_document_pdf(doc)
+        if pdf_path is None:
+            return None
+        store: PageStore = open_page_store(pdf_path)
+        document_file = {
+            'hash': doc_hash,
+            'title': doc.get('title', os.path.basename(pdf_path)),
+            'path': pdf_path,
+            'version': doc.get('processed_date'),
+            'page_count': len(store),
+            'page_store': store
+        }
+        with self._files_lock:
+            cached = self._document_files.get(doc_hash)
+            if cached is not None and cached['version'] == version:
+                # Otro hilo abrió la misma versión primero
+                store.close()
+                return cached
+            self._document_files[doc_hash] = document_file
+        if cached is not None:
+            cached['page_store'].close()
+        return document_file
+
+    def _drop_document_file(self, doc_hash: str) -> None:
+        with self._files_lock:
+            cached = self._document_files.pop(doc_hash, None)
+        if cached is not None:
+            cached['page_store'].close()
+
+    def get_document_files(self, doc_hashes: List[str]) -> List[Dict]:
+        """Archivos de varios documentos (p. ej. los de un asistente), en el mismo orden."""
+        self.refresh_metadata()
+        files = []
+        for doc_hash in doc_hashes:
+            try:
+                document_file = self.get_document_file(doc_hash)
+            except Exception as e:
+                print(f"Error opening document {doc_hash}: {str(e)}")
+                continue
+            if document_file:
+                files.append(document_file)
+        return files
+
     def get_new_documents_count(self, date: datetime) -> int:
         """Obtener cantidad de documentos nuevos para una fecha."""
         count = 0
@@ -197,7 +297,8 @@ class DocumentManager:
                 "hash": doc_hash,
                 "vectorstore_path": vectorstore_path,
                 "original_path": original_path,
-                "processed_date": datetime.now().isoformat()
+                # La fecha de procesamiento identifica la versión del documento
+                "processed_date": metadata.get("processed_date") or datetime.now().isoformat()
             }
             
             # Actualizar metadata
@@ -213,4 +314,13 @@ class DocumentManager:
             return doc_hash
             
         except Exception as e:
-            raise Exception(f"Error adding document: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error adding document: {str(e)}")
+
+    def set_vector_backend(self, doc_hash: str, backend: str) -> bool:
+        """Cambiar el motor de búsqueda vectorial de un documento."""
+        doc = self.metadata.get(doc_hash)
+        if not doc:
+            return False
+        doc['vector_backend'] = backend
+        self._save_metadata(self.metadata)
+        return True
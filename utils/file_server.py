@@ -0,0 +1,328 @@
+# utils/file_server.py
+"""
+Servidor de descargas de los documentos.
+
+Antes cada enlace de descarga llevaba el archivo completo en base64
+dentro del HTML, así que el catálogo enviaba todos los libros a cada
+visitante en cada rerun. Ahora el enlace apunta a este servidor, que lee
+el archivo solo cuando se hace clic y lo envía por partes, con soporte de
+`Range` (descargas reanudables y visores que piden trozos del PDF).
+Las miniaturas del catálogo (`utils/thumbnails.py`) se sirven por
+`/images/`, en línea y con caché de larga duración: su nombre es el hash
+de su contenido, así que nunca cambian.
+
+Los enlaces van firmados con HMAC y `/files/` solo entrega los
+documentos originales registrados en `data/metadata.json`: el historial
+de chat, los cachés y las trazas que también viven en `data/` nunca se
+sirven. La clave de las firmas se toma de `YACHANI_FILE_SERVER_SECRET` o
+se genera al azar la primera vez y se guarda en `data/.file_server_secret`
+(permisos 0600), así que varios procesos de Streamlit pueden compartir un
+mismo servidor. La primera página que pide un enlace lo inicia en un hilo
+del proceso; también se puede ejecutar aparte:
+
+    python -m utils.file_server --port 8502
+
+`YACHANI_FILE_SERVER` fija la dirección de escucha (por defecto solo
+local). Los enlaces usan `YACHANI_FILE_SERVER_URL` si está definida; si
+no, el host con el que el navegador abrió la app y el puerto del
+servidor, siempre que el servidor escuche en una dirección alcanzable
+desde ese host. Si no lo es, `get_base_url` lo informa con
+`FileServerNotConfigured` para que la página lo muestre.
+"""
+import os
+import re
+import hmac
+import hashlib
+import argparse
+import mimetypes
+import json
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Set, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+from utils.local_secrets import is_loopback, load_or_create_secret
+
+SERVER_ENV = "YACHANI_FILE_SERVER"
+URL_ENV = "YACHANI_FILE_SERVER_URL"
+SECRET_ENV = "YACHANI_FILE_SERVER_SECRET"
+DEFAULT_ADDRESS = "127.0.0.1:8502"
+
+# Directorio servido; las rutas de los enlaces son relativas a él
+ROOT_DIR = "data"
+SECRET_FILE = os.path.join(ROOT_DIR, ".file_server_secret")
+METADATA_FILE = os.path.join(ROOT_DIR, "metadata.json")
+
+# Directorio (dentro de ROOT_DIR) de las imágenes direccionadas por contenido
+IMAGES_DIR = "thumbnails"
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Tamaño de cada lectura al enviar un archivo
+CHUNK_SIZE = 64 * 1024
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+class FileServerNotConfigured(Exception):
+    """Los enlaces no serían alcanzables desde el navegador con la configuración actual."""
+
+_secret: Optional[bytes] = None
+
+def get_secret() -> bytes:
+    global _secret
+    configured = os.environ.get(SECRET_ENV)
+    if configured:
+        return configured.encode('utf-8')
+    if _secret is None:
+        _secret = load_or_create_secret(SECRET_FILE).encode('utf-8')
+    return _secret
+
+def sign(relative_path: str) -> str:
+    return hmac.new(get_secret(), relative_path.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Primer y último byte (inclusive) de un encabezado `Range` de un solo
+    rango. Devuelve None si no hay rango, o (-1, -1) si no se puede servir.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        # Varios rangos u otras unidades: se envía el archivo completo
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Últimos `end` bytes
+        length = int(end)
+        if length == 0:
+            return (-1, -1)
+        return (max(0, size - length), size - 1)
+    first = int(start)
+    last = min(int(end), size - 1) if end else size - 1
+    if first >= size or last < first:
+        return (-1, -1)
+    return (first, last)
+
+_registered: Tuple[float, Set[str]] = (-1.0, set())
+
+def registered_files() -> Set[str]:
+    """
+    Rutas reales de los documentos originales de `metadata.json`, releídas
+    solo cuando el archivo cambia.
+    """
+    global _registered
+    try:
+        mtime = os.path.getmtime(METADATA_FILE)
+    except OSError:
+        return set()
+    if mtime != _registered[0]:
+        try:
+            with open(METADATA_FILE, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading {METADATA_FILE}: {str(e)}")
+            return _registered[1]
+        paths = {
+            os.path.realpath(doc['original_path'])
+            for doc in metadata.values()
+            if isinstance(doc, dict) and doc.get('original_path')
+        }
+        _registered = (mtime, paths)
+    return _registered[1]
+
+def relative_to_root(file_path: str) -> Optional[str]:
+    """Ruta relativa a `ROOT_DIR` (con `/`), o None si el archivo está fuera."""
+    root = os.path.realpath(ROOT_DIR)
+    path = os.path.realpath(file_path)
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET/HEAD de `/files/<firma>/<ruta>` (descargas) e `/images/<firma>/<ruta>`
+    (miniaturas), con soporte de rangos.
+    """
+
+    server_version = "YachaniFiles/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def _resolve(self) -> Tuple[Optional[str], bool]:
+        """Archivo pedido y si es una imagen; (None, False) si no se puede servir."""
+        parts = urlsplit(self.path).path.split("/", 3)
+        if len(parts) != 4 or parts[1] not in ("files", "images"):
+            return None, False
+        signature, relative_path = parts[2], unquote(parts[3])
+        if not hmac.compare_digest(signature, sign(relative_path)):
+            return None, False
+        is_image = parts[1] == "images"
+        if is_image and not relative_path.startswith(IMAGES_DIR + "/"):
+            return None, False
+
+        root = os.path.realpath(ROOT_DIR)
+        path = os.path.realpath(os.path.join(root, relative_path))
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            return None, False
+        if not is_image and path not in registered_files():
+            return None, False
+        return path, is_image
+
+    def _send_empty(self, status: int, headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _handle(self, send_body: bool) -> None:
+        path, is_image = self._resolve()
+        if path is None:
+            self._send_empty(404)
+            return
+
+        stat = os.stat(path)
+        size = stat.st_size
+        byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range == (-1, -1):
+            self._send_empty(416, {"Content-Range": f"bytes */{size}"})
+            return
+        first, last = byte_range or (0, size - 1)
+        length = last - first + 1 if size else 0
+
+        filename = os.path.basename(path)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        if is_image:
+            self.send_header("Cache-Control", IMAGE_CACHE_CONTROL)
+        else:
+            self.send_header("Cache-Control", "private, max-age=3600")
+            self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(filename)}")
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        self.end_headers()
+        if not send_body:
+            return
+
+        with open(path, "rb") as f:
+            f.seek(first)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def do_GET(self):
+        try:
+            self._handle(send_body=True)
+        except (BrokenPipeError, ConnectionResetError):
+            # El navegador canceló la descarga
+            pass
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+class FileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+_server: Optional[FileServer] = None
+_lock = threading.Lock()
+
+def get_address() -> Tuple[str, int]:
+    return parse_address(os.environ.get(SERVER_ENV) or DEFAULT_ADDRESS)
+
+def ensure_file_server() -> None:
+    """
+    Iniciar el servidor en un hilo del proceso si todavía no corre. Si el
+    puerto está ocupado se asume que otro proceso ya lo sirve.
+    """
+    global _server
+    with _lock:
+        if _server is not None:
+            return
+        try:
+            _server = FileServer(get_address(), FileRequestHandler)
+        except OSError:
+            _server = None
+            return
+        threading.Thread(target=_server.serve_forever, name="file-server", daemon=True).start()
+
+def _hostname(host_header: Optional[str]) -> str:
+    """Nombre del host de un encabezado `Host` (sin puerto, también en IPv6)."""
+    if not host_header:
+        return "localhost"
+    if host_header.startswith("["):
+        return host_header[1:].split("]", 1)[0]
+    return host_header.rsplit(":", 1)[0] if host_header.count(":") == 1 else host_header
+
+def get_base_url(request_host: Optional[str] = None) -> str:
+    """
+    URL base de los enlaces para un navegador que abrió la app con el
+    encabezado `Host` `request_host`. Lanza `FileServerNotConfigured` si
+    el servidor no sería alcanzable desde ese navegador.
+    """
+    configured = os.environ.get(URL_ENV)
+    if configured:
+        return configured.rstrip("/")
+
+    host, port = get_address()
+    browser_host = _hostname(request_host)
+    if is_loopback(browser_host):
+        return f"http://localhost:{port}"
+    if is_loopback(host):
+        raise FileServerNotConfigured(
+            f"El servidor de descargas solo escucha en {host}:{port} y la app se abrió "
+            f"desde {browser_host}. Define {URL_ENV} (y {SERVER_ENV} con una dirección "
+            f"accesible) para habilitar las descargas y miniaturas."
+        )
+    if ":" in browser_host:
+        browser_host = f"[{browser_host}]"
+    return f"http://{browser_host}:{port}"
+
+def _signed_url(kind: str, file_path: str, base_url: str) -> Optional[str]:
+    relative_path = relative_to_root(file_path)
+    if relative_path is None:
+        return None
+    ensure_file_server()
+    return f"{base_url}/{kind}/{sign(relative_path)}/{quote(relative_path)}"
+
+def download_url(file_path: str, base_url: str) -> Optional[str]:
+    """
+    URL firmada de un documento original registrado en los metadatos, o
+    None si el archivo no es uno de ellos.
+    """
+    if os.path.realpath(file_path) not in registered_files():
+        return None
+    return _signed_url("files", file_path, base_url)
+
+def image_url(file_path: str, base_url: str) -> Optional[str]:
+    """URL firmada de una imagen bajo `data/thumbnails/`, para mostrarla en línea."""
+    return _signed_url("images", file_path, base_url)
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de descargas de documentos")
+    host, port = get_address()
+    parser.add_argument("--host", default=host, help="Dirección de escucha")
+    parser.add_argument("--port", type=int, default=port, help="Puerto de escucha")
+    args = parser.parse_args()
+
+    server = FileServer((args.host, args.port), FileRequestHandler)
+    print(f"Sirviendo {os.path.abspath(ROOT_DIR)} en http://{args.host}:{args.port}/files/")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+# utils/llm_scheduler.py
+"""
+Planificador de las llamadas a OpenAI compartido por todo el proceso.
+
+Cada sesión crea sus propios clientes de chat y de embeddings; sin
+coordinación, con un curso entero usando la aplicación todos chocan con
+el límite de tasa a la vez. Aquí todas las llamadas piden turno a un
+único `LLMScheduler` que:
+
+- reparte un presupuesto de tokens por minuto (cubeta que se rellena de
+  forma continua) y un máximo de solicitudes simultáneas;
+- atiende primero al chat, luego los resúmenes de memoria y al final la
+  ingesta de documentos (limpieza y embeddings);
+- dentro de una prioridad alterna entre sesiones, así una sesión con
+  muchas solicitudes no deja esperando a las demás;
+- informa la posición en la fila mientras se espera;
+- ante un 429 de OpenAI pausa los despachos unos segundos.
+
+Las llamadas al modelo pasan por `SchedulerCallbackHandler` y los
+embeddings por `ScheduledEmbeddings`. `YACHANI_OPENAI_TPM` y
+`YACHANI_OPENAI_CONCURRENCY` ajustan los límites.
+"""
+import os
+import time
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from utils.openai_clients import get_embeddings
+from utils.tracing import span
+
+TPM_ENV = "YACHANI_OPENAI_TPM"
+CONCURRENCY_ENV = "YACHANI_OPENAI_CONCURRENCY"
+
+DEFAULT_TOKENS_PER_MINUTE = 80000
+DEFAULT_MAX_CONCURRENT = 8
+
+# Prioridades (menor número, antes se atiende)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_INGESTION = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "chat",
+    PRIORITY_BACKGROUND: "segundo plano",
+    PRIORITY_INGESTION: "ingesta"
+}
+
+# Pausa de los despachos después de un 429
+RATE_LIMIT_COOLDOWN = 10.0
+
+# Una solicitud concedida que no se libera en este tiempo se da por perdida
+LEASE_SECONDS = 300.0
+
+# Cada cuánto revisa la fila un hilo en espera (la cubeta se rellena con el tiempo)
+POLL_SECONDS = 0.25
+
+# Textos por solicitud de embeddings durante la ingesta, para que el chat
+# pueda intercalarse entre lotes
+EMBEDDING_BATCH_SIZE = 100
+
+DEFAULT_SESSION = "local"
+
+_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("scheduler_session", default=None)
+
+def estimate_tokens(text: str) -> int:
+    """Aproximación de ~4 caracteres por token; basta para el presupuesto."""
+    return (len(text) + 3) // 4
+
+def current_session() -> str:
+    """Sesión a la que se atribuye una llamada: la fijada con `session_scope`
+    o la sesión de Streamlit del hilo."""
+    session = _session.get()
+    if session:
+        return session
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else DEFAULT_SESSION
+
+@contextmanager
+def session_scope(session: str) -> Iterator[None]:
+    """Atribuir a `session` las llamadas hechas dentro del bloque."""
+    token = _session.set(session)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+class Ticket:
+    """Una solicitud a OpenAI esperando turno o en curso."""
+
+    def __init__(self, session: str, priority: int, tokens: int):
+        self.session = session
+        self.priority = priority
+        self.tokens = tokens
+        self.created = time.monotonic()
+        self.granted_at: Optional[float] = None
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+class LLMScheduler:
+    """Fila con prioridades y presupuesto de tokens para las llamadas a OpenAI."""
+
+    def __init__(self, tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+                 max_concurrent: int = DEFAULT_MAX_CONCURRENT):
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrent = max_concurrent
+
+        self._available = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+
+        # Por prioridad, las filas de cada sesión en orden de turno
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {}
+        self._active: List[Ticket] = []
+        self._condition = threading.Condition()
+
+        self.stats = {'granted': 0, 'rate_limited': 0, 'expired': 0}
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled
+        self._refilled = now
+        self._available = min(
+            float(self.tokens_per_minute),
+            self._available + elapsed * self.tokens_per_minute / 60
+        )
+
+    def _expire_leases(self, now: float) -> None:
+        expired = [t for t in self._active if now - t.granted_at > LEASE_SECONDS]
+        for ticket in expired:
+            self._active.remove(ticket)
+            self.stats['expired'] += 1
+
+    def _next(self) -> Optional[Ticket]:
+        """Primer ticket de la prioridad más alta, alternando entre sesiones."""
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if sessions:
+                return sessions[next(iter(sessions))][0]
+        return None
+
+    def _pop(self, ticket: Ticket) -> None:
+        sessions = self._queues[ticket.priority]
+        pending = sessions.pop(ticket.session)
+        pending.popleft()
+        if pending:
+            # La sesión vuelve al final de la ronda
+            sessions[ticket.session] = pending
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        self._expire_leases(now)
+        if now < self._paused_until:
+            return
+
+        granted = False
+        while len(self._active) < self.max_concurrent:
+            ticket = self._next()
+            if ticket is None:
+                break
+            # Las solicitudes mayores que el presupuesto esperan la cubeta llena
+            cost = min(ticket.tokens, self.tokens_per_minute)
+            if self._available < cost:
+                # No se adelantan solicitudes de menor prioridad
+                break
+            self._pop(ticket)
+            self._available -= cost
+            ticket.granted_at = now
+            self._active.append(ticket)
+            self.stats['granted'] += 1
+            granted = True
+
+        if granted:
+            self._condition.notify_all()
+
+    def submit(self, session: str, priority: int, tokens: int) -> Ticket:
+        ticket = Ticket(session, priority, max(1, tokens))
+        with self._condition:
+            sessions = self._queues.setdefault(priority, OrderedDict())
+            sessions.setdefault(session, deque()).append(ticket)
+            self._dispatch()
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """Posición en la fila (1 = el siguiente; 0 si ya fue atendido)."""
+        with self._condition:
+            return self._position(ticket)
+
+    def _position(self, ticket: Ticket) -> int:
+        if ticket.granted:
+            return 0
+        ahead = 0
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if priority < ticket.priority:
+                ahead += sum(len(pending) for pending in sessions.values())
+                continue
+            if priority > ticket.priority or ticket.session not in sessions:
+                break
+            # Rondas: cada sesión aporta un ticket por vuelta
+            pending = sessions[ticket.session]
+            rounds = list(pending).index(ticket)
+            order = list(sessions)
+            own = order.index(ticket.session)
+            for index, other in enumerate(order):
+                if other != ticket.session:
+                    size = len(sessions[other])
+                    ahead += min(size, rounds + (1 if index < own else 0))
+            ahead += rounds
+            break
+        return ahead + 1
+
+    def wait(self, ticket: Ticket, on_wait: Optional[Callable[[int], None]] = None) -> None:
+        """
+        Esperar el turno del ticket. `on_wait(posición)` se llama cada vez
+        que cambia la posición y con 0 al obtener el turno, si hubo espera.
+        """
+        last_position = None
+        with self._condition:
+            while True:
+                self._dispatch()
+                if ticket.granted:
+                    break
+                position = self._position(ticket)
+                if on_wait is not None and position != last_position:
+                    last_position = position
+                    self._condition.release()
+                    try:
+                        on_wait(position)
+                    finally:
+                        self._condition.acquire()
+                    continue
+                self._condition.wait(POLL_SECONDS)
+
+        if on_wait is not None and last_position is not None:
+            on_wait(0)
+
+    def cancel(self, ticket: Ticket) -> None:
+        """Sacar de la fila un ticket que ya no se va a usar."""
+        with self._condition:
+            if not ticket.granted:
+                sessions = self._queues.get(ticket.priority, {})
+                pending = sessions.get(ticket.session)
+                if pending and ticket in pending:
+                    pending.remove(ticket)
+                    if not pending:
+                        del sessions[ticket.session]
+            self._dispatch()
+
+    def release(self, ticket: Ticket, used_tokens: Optional[int] = None) -> None:
+        """
+        Terminar una solicitud. Si se conocen los tokens usados, se devuelve
+        a la cubeta la diferencia con lo reservado.
+        """
+        with self._condition:
+            if ticket in self._active:
+                self._active.remove(ticket)
+                if used_tokens is not None:
+                    reserved = min(ticket.tokens, self.tokens_per_minute)
+                    self._available = min(
+                        float(self.tokens_per_minute),
+                        self._available + reserved - used_tokens
+                    )
+            self._dispatch()
+
+    def rate_limited(self, cooldown: float = RATE_LIMIT_COOLDOWN) -> None:
+        """OpenAI respondió 429: no despachar durante `cooldown` segundos."""
+        with self._condition:
+            self.stats['rate_limited'] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + cooldown)
+            # El límite real es menor que el estimado: vaciar la cubeta
+            self._available = min(self._available, 0.0)
+
+    @contextmanager
+    def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE,
+                session: Optional[str] = None,
+                on_wait: Optional[Callable[[int], None]] = None) -> Iterator[Ticket]:
+        """Bloque con turno concedido; se libera al salir."""
+        ticket = self.submit(session or current_session(), priority, tokens)
+        try:
+            with span("llm.queue", priority=PRIORITY_NAMES.get(priority, priority)):
+                self.wait(ticket, on_wait)
+        except BaseException:
+            self.cancel(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def snapshot(self) -> Dict:
+        """Estado actual para la página de administración."""
+        with self._condition:
+            self._refill(time.monotonic())
+            waiting = {
+                PRIORITY_NAMES.get(priority, priority): sum(len(p) for p in sessions.values())
+                for priority, sessions in self._queues.items()
+            }
+            return {
+                'active': len(self._active),
+                'waiting': waiting,
+                'available_tokens': int(self._available),
+                'paused_s': max(0.0, self._paused_until - time.monotonic()),
+                **self.stats
+            }
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> LLMScheduler:
+    """Planificador único del proceso, compartido por todas las sesiones."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(
+                tokens_per_minute=int(os.environ.get(TPM_ENV, DEFAULT_TOKENS_PER_MINUTE)),
+                max_concurrent=int(os.environ.get(CONCURRENCY_ENV, DEFAULT_MAX_CONCURRENT))
+            )
+        return _scheduler
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    return getattr(error, 'status_code', None) == 429 or type(error).__name__ == "RateLimitError"
+
+class SchedulerCallbackHandler(BaseCallbackHandler):
+    """
+    Pide turno al planificador antes de cada llamada al modelo y lo libera
+    al terminar. Debe ir antes que los demás callbacks para que la espera
+    no se cuente como tiempo del modelo.
+    """
+
+    def __init__(self, priority: int = PRIORITY_INTERACTIVE, session: Optional[str] = None,
+                 on_wait: Optional[Callable[[int], None]] = None):
+        self.priority = priority
+        self.session = session
+        self.on_wait = on_wait
+        self._tickets: Dict[UUID, Ticket] = {}
+        self._prompt_tokens: Dict[UUID, int] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, prompt: str, **kwargs) -> None:
+        params = kwargs.get('invocation_params') or {}
+        prompt_tokens = estimate_tokens(prompt)
+        # Se reserva el máximo de la respuesta; al terminar se ajusta a lo usado
+        reserved = prompt_tokens + (params.get('max_tokens') or 1000)
+
+        scheduler = get_scheduler()
+        ticket = scheduler.submit(self.session or current_session(), self.priority, reserved)
+        try:
+            with span("llm.queue", priority=PRIORITY_NAMES.get(self.priority, self.priority)):
+                scheduler.wait(ticket, self.on_wait)
+        except BaseException:
+            scheduler.cancel(ticket)
+            raise
+        with self._lock:
+            self._tickets[run_id] = ticket
+            self._prompt_tokens[run_id] = prompt_tokens
+
+    def _end(self, run_id: UUID, used_tokens: Optional[int] = None) -> None:
+        with self._lock:
+            ticket = self._tickets.pop(run_id, None)
+            self._prompt_tokens.pop(run_id, None)
+        if ticket is not None:
+            get_scheduler().release(ticket, used_tokens)
+
+    def on_llm_start(self, serialized: Dict, prompts: List[str], *, run_id: UUID, **kwargs) -> None:
+        self._start(run_id, "\n".join(prompts), **kwargs)
+
+    def on_chat_model_start(self, serialized: Dict, messages: List, *, run_id: UUID, **kwargs) -> None:
+        text = "\n".join(str(m.content) for batch in messages for m in batch)
+        self._start(run_id, text, **kwargs)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        usage = (getattr(response, 'llm_output', None) or {}).get('token_usage') or {}
+        used = usage.get('total_tokens')
+        if used is None:
+            # En streaming no llega el uso: prompt estimado más lo generado
+            with self._lock:
+                prompt_tokens = self._prompt_tokens.get(run_id, 0)
+            generated = "".join(g.text for batch in response.generations for g in batch)
+            used = prompt_tokens + estimate_tokens(generated)
+        self._end(run_id, used)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        if is_rate_limit_error(error):
+            get_scheduler().rate_limited()
+        self._end(run_id)
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeddings que piden turno al planificador. Los documentos se envían en
+    lotes de `EMBEDDING_BATCH_SIZE` textos, cada uno con su propio turno.
+    """
+
+    def __init__(self, embeddings: Embeddings, priority: int = PRIORITY_INTERACTIVE,
+                 session: Optional[str] = None):
+        self.embeddings = embeddings
+        self.priority = priority
+        self.session = session
+
+    def _call(self, func: Callable, texts, tokens: int):
+        scheduler = get_scheduler()
+        try:
+            with scheduler.acquire(tokens, self.priority, self.session):
+                return func(texts)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                scheduler.rate_limited()
+            raise
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+            vectors.extend(self._call(
+                self.embeddings.embed_documents, batch, sum(estimate_tokens(t) for t in batch)
+            ))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(self.embeddings.embed_query, text, estimate_tokens(text))
+
+def build_embeddings(priority: int = PRIORITY_INTERACTIVE, **kwargs) -> ScheduledEmbeddings:
+    """Embeddings de OpenAI (cliente compartido) con turno del planificador."""
+    return ScheduledEmbeddings(get_embeddings(**kwargs), priority)
@@ -0,0 +1,39 @@
+# utils/local_secrets.py
+"""
+Claves generadas al azar y guardadas en disco con permisos 0600.
+
+Los servicios locales (servidor de descargas, servicio de búsqueda) las
+usan cuando no se configura una clave por variable de entorno: cada
+instalación tiene la suya y todos los procesos de la máquina la leen del
+mismo archivo.
+"""
+import os
+import secrets
+
+LOOPBACK_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+def is_loopback(host: str) -> bool:
+    return host in LOOPBACK_HOSTS or host.startswith("127.")
+
+def load_or_create_secret(path: str) -> str:
+    """Clave guardada en `path`, creándola al azar (0600) si no existe."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(secrets.token_hex(32))
+    try:
+        # `link` falla si otro proceso ya la creó: se usa la suya
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
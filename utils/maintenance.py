@@ -0,0 +1,376 @@
+# utils/maintenance.py
+"""
+Mantenimiento de los vectorstores de `processed_docs`.
+
+Para cada documento de `DocumentManager`:
+- reconstruye el índice HNSW de Chroma si acumula elementos borrados,
+- elimina segmentos HNSW huérfanos (directorios UUID que ya no están en
+  `chroma.sqlite3`) y archivos no referenciados en `metadata.json`,
+- compacta la base SQLite con VACUUM,
+
+y elimina los directorios de `processed_docs` que no pertenecen a ningún
+documento. Al final reporta el espacio recuperado y el tiempo de carga
+antes y después.
+
+Detener la aplicación antes de ejecutarlo: Chroma no admite que otro
+proceso modifique la base mientras está abierta.
+
+Uso:
+
+    python -m utils.maintenance --dry-run
+    python -m utils.maintenance
+    python -m utils.maintenance --prune-indexes --output reporte.json
+"""
+import pysqlite3
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+import os
+import re
+import json
+import time
+import pickle
+import shutil
+import sqlite3
+import argparse
+import multiprocessing as mp
+from typing import Dict, List, Optional
+
+from utils.document_manager import DocumentManager
+from utils.numpy_store import NUMPY_INDEX_DIR
+from utils.page_store import page_store_dir
+from utils.vector_backends import DEFAULT_BACKEND, VECTOR_BACKENDS, get_numpy_index_dir
+
+CHROMA_DB_FILE = "chroma.sqlite3"
+HNSW_METADATA_FILE = "index_metadata.pickle"
+
+# Proporción de elementos borrados en el HNSW a partir de la cual se reconstruye
+DEFAULT_REBUILD_THRESHOLD = 0.2
+
+# Fragmentos por lote al volver a insertar en la colección reconstruida
+REBUILD_BATCH_SIZE = 500
+
+UUID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+def path_size(path: str) -> int:
+    """Tamaño en bytes de un archivo o directorio."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def format_bytes(size: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def remove_path(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+def get_segment_ids(store_dir: str) -> Optional[List[str]]:
+    """IDs de los segmentos registrados en la base de Chroma (None si no se puede leer)."""
+    try:
+        conn = sqlite3.connect(os.path.join(store_dir, CHROMA_DB_FILE))
+        try:
+            return [row[0] for row in conn.execute("SELECT id FROM segments")]
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Error reading segments of {store_dir}: {str(e)}")
+        return None
+
+class _PersistentDataUnpickler(pickle.Unpickler):
+    """Leer `index_metadata.pickle` sin importar el módulo HNSW de Chroma."""
+
+    def find_class(self, module, name):
+        if name == "PersistentData":
+            return _PersistentData
+        return super().find_class(module, name)
+
+class _PersistentData:
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+def hnsw_fragmentation(segment_dir: str) -> Optional[Dict]:
+    """
+    Elementos vivos y borrados de un segmento HNSW persistido.
+    HNSW solo marca los borrados, así que siguen ocupando disco y memoria.
+    """
+    metadata_path = os.path.join(segment_dir, HNSW_METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    try:
+        with open(metadata_path, 'rb') as f:
+            data = _PersistentDataUnpickler(f).load()
+        live = len(data.id_to_label)
+        total = max(int(data.total_elements_added), live)
+        return {'live': live, 'deleted': total - live}
+    except Exception as e:
+        print(f"Error reading {metadata_path}: {str(e)}")
+        return None
+
+def measure_load_time(store_dir: str) -> Optional[float]:
+    """
+    Milisegundos para abrir el vectorstore y responder la primera consulta.
+    Se mide en un proceso nuevo para no reutilizar el cliente ya abierto.
+    """
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(_load_time_worker, (store_dir,))
+
+def _load_time_worker(store_dir: str) -> Optional[float]:
+    try:
+        from langchain_chroma import Chroma
+
+        start = time.perf_counter()
+        collection = Chroma(persist_directory=store_dir)._collection
+        sample = collection.get(limit=1, include=["embeddings"])
+        if len(sample['ids']):
+            collection.query(query_embeddings=[list(sample['embeddings'][0])], n_results=1)
+        return (time.perf_counter() - start) * 1000
+    except Exception as e:
+        print(f"Error loading {store_dir}: {str(e)}")
+        return None
+
+def rebuild_collection(store_dir: str) -> int:
+    """
+    Reconstruir la colección de Chroma insertando de nuevo los fragmentos vivos.
+    Se guarda una copia del vectorstore hasta terminar sin errores.
+    """
+    from langchain_chroma import Chroma
+
+    backup_dir = f"{store_dir.rstrip(os.sep)}.bak"
+    shutil.copytree(store_dir, backup_dir)
+    try:
+        store = Chroma(persist_directory=store_dir)
+        collection = store._collection
+        name, metadata = collection.name, collection.metadata
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+
+        store._client.delete_collection(name)
+        collection = store._client.create_collection(name, metadata=metadata)
+        for start in range(0, len(data['ids']), REBUILD_BATCH_SIZE):
+            end = start + REBUILD_BATCH_SIZE
+            collection.add(
+                ids=data['ids'][start:end],
+                embeddings=[list(e) for e in data['embeddings'][start:end]],
+                documents=data['documents'][start:end],
+                metadatas=data['metadatas'][start:end]
+            )
+    except Exception:
+        # Restaurar el vectorstore original
+        shutil.rmtree(store_dir, ignore_errors=True)
+        shutil.move(backup_dir, store_dir)
+        raise
+
+    shutil.rmtree(backup_dir)
+    return len(data['ids'])
+
+def vacuum_database(store_dir: str) -> None:
+    conn = sqlite3.connect(os.path.join(store_dir, CHROMA_DB_FILE))
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+def referenced_paths(doc: Dict) -> List[str]:
+    """Rutas dentro del vectorstore que el documento usa y no deben borrarse."""
+    store_dir = doc['vectorstore_path']
+    keep = [os.path.join(store_dir, f"{name}{suffix}")
+            for name in [CHROMA_DB_FILE] for suffix in ["", "-wal", "-shm", "-journal"]]
+    for key in ['original_path', 'preview_path']:
+        if doc.get(key):
+            keep.append(doc[key])
+    if doc.get('original_path'):
+        # Texto por página del visor
+        keep.append(page_store_dir(doc['original_path']))
+    # Documentos subidos antes de guardar `preview_path`
+    keep.append(os.path.join(store_dir, f"{os.path.basename(store_dir.rstrip(os.sep))}_preview.png"))
+    return [os.path.normpath(p) for p in keep]
+
+def find_orphans(doc: Dict, segment_ids: Optional[List[str]], prune_indexes: bool) -> List[str]:
+    """Directorios y archivos del vectorstore que ningún metadato referencia."""
+    store_dir = doc['vectorstore_path']
+    keep = set(referenced_paths(doc))
+    backend = doc.get('vector_backend', DEFAULT_BACKEND)
+    active_index = None
+    if backend in VECTOR_BACKENDS and backend != DEFAULT_BACKEND:
+        active_index = os.path.normpath(get_numpy_index_dir(store_dir, backend))
+
+    orphans = []
+    for name in sorted(os.listdir(store_dir)):
+        path = os.path.join(store_dir, name)
+        if os.path.isdir(path):
+            if UUID_PATTERN.match(name):
+                # Sin poder leer la base no se sabe qué segmentos son huérfanos
+                if segment_ids is not None and name not in segment_ids:
+                    orphans.append(path)
+            elif os.path.normpath(path) in keep:
+                continue
+            elif name.startswith(NUMPY_INDEX_DIR):
+                # Los índices de otros motores se regeneran al seleccionarlos
+                if prune_indexes and os.path.normpath(path) != active_index:
+                    orphans.append(path)
+            else:
+                orphans.append(path)
+        elif os.path.normpath(path) not in keep:
+            orphans.append(path)
+    return orphans
+
+def maintain_document(doc: Dict, dry_run: bool, prune_indexes: bool,
+                      rebuild_threshold: float, measure: bool) -> Dict:
+    store_dir = doc['vectorstore_path']
+    report = {
+        'title': doc.get('title', store_dir),
+        'path': store_dir,
+        'size_before': path_size(store_dir),
+        'load_ms_before': measure_load_time(store_dir) if measure else None,
+        'rebuilt': False,
+        'removed': [],
+        'errors': []
+    }
+
+    segment_ids = get_segment_ids(store_dir)
+    for segment_id in segment_ids or []:
+        fragmentation = hnsw_fragmentation(os.path.join(store_dir, segment_id))
+        if not fragmentation or not fragmentation['deleted']:
+            continue
+        total = fragmentation['live'] + fragmentation['deleted']
+        report['hnsw_deleted'] = fragmentation['deleted']
+        if fragmentation['deleted'] / total >= rebuild_threshold:
+            report['rebuilt'] = True
+            if not dry_run:
+                try:
+                    rebuild_collection(store_dir)
+                    segment_ids = get_segment_ids(store_dir)
+                except Exception as e:
+                    report['rebuilt'] = False
+                    report['errors'].append(f"Reconstrucción HNSW: {str(e)}")
+        break
+
+    for path in find_orphans(doc, segment_ids, prune_indexes):
+        report['removed'].append({'path': path, 'bytes': path_size(path)})
+        if not dry_run:
+            try:
+                remove_path(path)
+            except Exception as e:
+                report['errors'].append(f"{path}: {str(e)}")
+
+    if not dry_run:
+        try:
+            vacuum_database(store_dir)
+        except Exception as e:
+            report['errors'].append(f"VACUUM: {str(e)}")
+
+    report['size_after'] = path_size(store_dir)
+    report['load_ms_after'] = measure_load_time(store_dir) if measure and not dry_run else None
+    return report
+
+def find_orphan_stores(doc_manager: DocumentManager) -> List[str]:
+    """Directorios de `processed_docs` que no son el vectorstore de ningún documento."""
+    known = {
+        os.path.normpath(doc['vectorstore_path'])
+        for doc in doc_manager.metadata.values() if doc.get('vectorstore_path')
+    }
+    return [
+        os.path.join(doc_manager.PROCESSED_DIR, name)
+        for name in sorted(os.listdir(doc_manager.PROCESSED_DIR))
+        if os.path.normpath(os.path.join(doc_manager.PROCESSED_DIR, name)) not in known
+    ]
+
+def run_maintenance(dry_run: bool = False, prune_indexes: bool = False,
+                    rebuild_threshold: float = DEFAULT_REBUILD_THRESHOLD,
+                    measure: bool = True) -> Dict:
+    doc_manager = DocumentManager()
+    report = {'dry_run': dry_run, 'documents': [], 'orphan_stores': [], 'missing': []}
+
+    for doc in doc_manager.metadata.values():
+        store_dir = doc.get('vectorstore_path', '')
+        if not os.path.exists(os.path.join(store_dir, CHROMA_DB_FILE)):
+            report['missing'].append(doc.get('title', doc.get('hash')))
+            continue
+        report['documents'].append(
+            maintain_document(doc, dry_run, prune_indexes, rebuild_threshold, measure)
+        )
+
+    for path in find_orphan_stores(doc_manager):
+        report['orphan_stores'].append({'path': path, 'bytes': path_size(path)})
+        if not dry_run:
+            try:
+                remove_path(path)
+            except Exception as e:
+                print(f"Error removing {path}: {str(e)}")
+
+    report['reclaimed_bytes'] = (
+        sum(d['size_before'] - d['size_after'] for d in report['documents'])
+        + sum(o['bytes'] for o in report['orphan_stores'])
+    )
+    if dry_run:
+        # Sin cambios en disco, estimar con lo que se borraría
+        report['reclaimed_bytes'] = (
+            sum(r['bytes'] for d in report['documents'] for r in d['removed'])
+            + sum(o['bytes'] for o in report['orphan_stores'])
+        )
+    return report
+
+def print_report(report: Dict) -> None:
+    mode = " (simulación)" if report['dry_run'] else ""
+    print(f"\n=== Mantenimiento de vectorstores{mode} ===")
+    for doc in report['documents']:
+        print(f"\n{doc['title']}")
+        print(f"  Tamaño:        {format_bytes(doc['size_before'])} -> {format_bytes(doc['size_after'])}")
+        if doc['load_ms_before'] is not None and doc['load_ms_after'] is not None:
+            print(f"  Carga:         {doc['load_ms_before']:.0f} ms -> {doc['load_ms_after']:.0f} ms")
+        if 'hnsw_deleted' in doc:
+            action = "reconstruido" if doc['rebuilt'] else "sin reconstruir"
+            print(f"  HNSW:          {doc['hnsw_deleted']} elementos borrados, {action}")
+        for removed in doc['removed']:
+            print(f"  Huérfano:      {removed['path']} ({format_bytes(removed['bytes'])})")
+        for error in doc['errors']:
+            print(f"  Error:         {error}")
+
+    for orphan in report['orphan_stores']:
+        print(f"\nDirectorio sin documento: {orphan['path']} ({format_bytes(orphan['bytes'])})")
+    for title in report['missing']:
+        print(f"\nVectorstore no encontrado: {title}")
+
+    measured = [d for d in report['documents']
+                if d['load_ms_before'] is not None and d['load_ms_after'] is not None]
+    print(f"\nEspacio recuperado: {format_bytes(report['reclaimed_bytes'])}")
+    if measured:
+        before = sum(d['load_ms_before'] for d in measured)
+        after = sum(d['load_ms_after'] for d in measured)
+        print(f"Tiempo de carga total: {before:.0f} ms -> {after:.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento de los vectorstores")
+    parser.add_argument("--dry-run", action="store_true", help="Solo reportar, sin modificar nada")
+    parser.add_argument("--prune-indexes", action="store_true",
+                        help="Eliminar índices NumPy de motores que el documento no usa")
+    parser.add_argument("--rebuild-threshold", type=float, default=DEFAULT_REBUILD_THRESHOLD,
+                        help="Proporción de borrados en el HNSW para reconstruirlo")
+    parser.add_argument("--no-measure", action="store_true", help="No medir el tiempo de carga")
+    parser.add_argument("--output", help="Guardar el reporte en un archivo JSON")
+    args = parser.parse_args()
+
+    report = run_maintenance(
+        dry_run=args.dry_run,
+        prune_indexes=args.prune_indexes,
+        rebuild_threshold=args.rebuild_threshold,
+        measure=not args.no_measure
+    )
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# utils/numpy_store.py
+import os
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# Nombre del subdirectorio del índice dentro de cada documento procesado
+NUMPY_INDEX_DIR = "numpy_index"
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "offsets.npy"
+METADATA_FILE = "metadata.json"
+
+SUPPORTED_DTYPES = ["float32", "float16"]
+
+# Filas por bloque al convertir float16 a float32 para la multiplicación
+BLOCK_SIZE = 8192
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vectorstore de búsqueda exacta sobre una matriz de embeddings en disco.
+
+    Los embeddings normalizados se guardan como una matriz contigua `.npy`
+    que se abre con memory-map, y los textos de los fragmentos en un único
+    archivo binario con un arreglo de offsets. La búsqueda es un producto
+    matricial seguido de un top-k parcial.
+
+    El índice es de solo lectura: se genera completo desde Chroma (que
+    sigue siendo la fuente de los fragmentos) y se vuelve a generar cuando
+    el documento cambia. `source` guarda de qué versión se generó.
+    """
+
+    # Los puntajes devueltos ya son similitud coseno
+    scores_are_cosine = True
+
+    def __init__(self, index_dir: str, embedding_function: Embeddings):
+        self.INDEX_DIR = index_dir
+        self._embedding_function = embedding_function
+
+        with open(os.path.join(index_dir, METADATA_FILE), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+
+        self.dtype = info['dtype']
+        self.metadatas: List[Dict] = info['metadatas']
+        self.ids: List[str] = info['ids']
+        self.source: Optional[Dict] = info.get('source')
+        self.dim: int = info.get('dim', 0)
+
+        self.matrix = self._load_matrix()
+        self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE))
+        self._chunks = np.memmap(os.path.join(index_dir, CHUNKS_FILE), dtype=np.uint8, mode='r') \
+            if self.offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+
+        # Índice página -> posiciones, construido en la primera búsqueda por página
+        self._positions_by_page: Optional[Dict] = None
+
+    def _load_matrix(self) -> Optional[np.ndarray]:
+        return np.load(os.path.join(self.INDEX_DIR, EMBEDDINGS_FILE), mmap_mode='r')
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def write_index(index_dir: str, texts: List[str], embeddings: List[List[float]],
+                    metadatas: Optional[List[Dict]] = None, ids: Optional[List[str]] = None,
+                    dtype: str = "float32", source: Optional[Dict] = None) -> None:
+        """
+        Escribir un índice en disco a partir de textos y embeddings.
+        `source` identifica la versión del documento (ver `vector_backends.index_source`).
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Tipo no soportado: {dtype}")
+
+        os.makedirs(index_dir, exist_ok=True)
+
+        if len(texts) == 0:
+            # Documento sin fragmentos: índice vacío
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            matrix = np.asarray(embeddings, dtype=np.float32)
+            if matrix.ndim != 2:
+                matrix = matrix.reshape(len(texts), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = (matrix / norms).astype(dtype)
+        np.save(os.path.join(index_dir, EMBEDDINGS_FILE), np.ascontiguousarray(matrix))
+
+        # Textos concatenados y offsets de inicio/fin de cada fragmento
+        offsets = [0]
+        with open(os.path.join(index_dir, CHUNKS_FILE), 'wb') as f:
+            for text in texts:
+                data = text.encode('utf-8')
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        np.save(os.path.join(index_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+
+        with open(os.path.join(index_dir, METADATA_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'dtype': dtype,
+                'dim': int(matrix.shape[1]) if len(texts) else 0,
+                'count': len(texts),
+                'ids': ids or [str(i) for i in range(len(texts))],
+                'metadatas': metadatas or [{} for _ in texts],
+                'source': source
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def from_chroma(cls, chroma_store, index_dir: str, dtype: str = "float32",
+                    source: Optional[Dict] = None) -> "NumpyVectorStore":
+        """Exportar los embeddings ya calculados de un vectorstore Chroma."""
+        data = chroma_store.get(include=["embeddings", "documents", "metadatas"])
+        cls.write_index(
+            index_dir,
+            texts=data['documents'],
+            embeddings=data['embeddings'],
+            metadatas=data['metadatas'],
+            ids=data['ids'],
+            dtype=dtype,
+            source=source
+        )
+        return cls(index_dir, chroma_store.embeddings)
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[Dict]] = None, persist_directory: str = None,
+                   dtype: str = "float32", **kwargs: Any) -> "NumpyVectorStore":
+        """Crear un índice calculando los embeddings de los textos."""
+        if not persist_directory:
+            raise ValueError("Se requiere persist_directory para el índice NumPy")
+        texts = list(texts)
+        cls.write_index(
+            persist_directory,
+            texts=texts,
+            embeddings=embedding.embed_documents(texts),
+            metadatas=metadatas,
+            dtype=dtype
+        )
+        return cls(persist_directory, embedding)
+
+    def get_text(self, position: int) -> str:
+        """Leer el texto de un fragmento desde el archivo de fragmentos."""
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        return bytes(self._chunks[start:end]).decode('utf-8')
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        """Similitud coseno de la consulta contra todas las filas."""
+        if self.matrix.dtype == np.float32:
+            return self.matrix @ query
+
+        scores = np.empty(self.matrix.shape[0], dtype=np.float32)
+        for start in range(0, self.matrix.shape[0], BLOCK_SIZE):
+            block = np.asarray(self.matrix[start:start + BLOCK_SIZE], dtype=np.float32)
+            scores[start:start + BLOCK_SIZE] = block @ query
+        return scores
+
+    def filter_positions(self, filter: Optional[Dict]) -> Optional[np.ndarray]:
+        """
+        Posiciones de los fragmentos que cumplen un filtro de metadatos.
+        Soporta {"campo": valor}, {"campo": {"$in": [...]}} y {"$or": [...]}.
+        Devuelve None si no hay filtro.
+        """
+        if not filter:
+            return None
+
+        # Camino rápido para la búsqueda por páginas
+        if list(filter) == ["page"]:
+            expected = filter["page"]
+            pages = expected["$in"] if isinstance(expected, dict) and "$in" in expected else [expected]
+            if self._positions_by_page is None:
+                self._positions_by_page = {}
+                for i, metadata in enumerate(self.metadatas):
+                    page = (metadata or {}).get("page")
+                    self._positions_by_page.setdefault(page, []).append(i)
+            return np.asarray(
+                sorted(i for page in pages for i in self._positions_by_page.get(page, [])),
+                dtype=np.int64
+            )
+
+        def matches(metadata: Dict, condition: Dict) -> bool:
+            for field, expected in condition.items():
+                if field == "$or":
+                    if not any(matches(metadata, c) for c in expected):
+                        return False
+                elif isinstance(expected, dict) and "$in" in expected:
+                    if metadata.get(field) not in expected["$in"]:
+                        return False
+                elif metadata.get(field) != expected:
+                    return False
+            return True
+
+        return np.asarray(
+            [i for i, metadata in enumerate(self.metadatas) if matches(metadata or {}, filter)],
+            dtype=np.int64
+        )
+
+    def top_k(self, embedding: List[float], k: int,
+              filter: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """Posiciones y puntajes de los k fragmentos más similares."""
+        if len(self) == 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        positions = self.filter_positions(filter)
+        if positions is not None:
+            # Solo se puntúan las filas que cumplen el filtro
+            if positions.shape[0] == 0:
+                return []
+            scores = np.asarray(self.matrix[positions], dtype=np.float32) @ query
+        else:
+            scores = self._scores(query)
+
+        k = min(k, scores.shape[0])
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ordered = candidates[np.argsort(-scores[candidates])]
+        if positions is not None:
+            return [(int(positions[i]), float(scores[i])) for i in ordered]
+        return [(int(i), float(scores[i])) for i in ordered]
+
+    def _to_document(self, position: int) -> Document:
+        return Document(
+            page_content=self.get_text(position),
+            metadata=dict(self.metadatas[position] or {})
+        )
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: List[float], k: int = 4,
+                                                          filter: Optional[Dict] = None,
+                                                          **kwargs: Any) -> List[Tuple[Document, float]]:
+        return [(self._to_document(i), score) for i, score in self.top_k(embedding, k, filter=filter)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        # Los puntajes ya son similitud coseno
+        return lambda score: score
@@ -0,0 +1,191 @@
+# utils/openai_clients.py
+"""
+Clientes HTTP compartidos para OpenAI.
+
+Cada `ChatOpenAI(...)` u `OpenAIEmbeddings()` crea su propio cliente
+HTTP, así que una sesión abría muchas conexiones y repetía el saludo TLS
+en cada una. Aquí hay un `httpx.Client` por endpoint, con conexiones
+keep-alive reutilizadas por todas las sesiones del proceso, y los modelos
+y embeddings se reutilizan por configuración. Cada pool lleva contadores
+(solicitudes, conexiones TCP y saludos TLS) que se muestran en la página
+de administración.
+
+El SDK de OpenAI cierra las respuestas en streaming apenas lee `[DONE]`,
+sin leer el fragmento final del cuerpo, y httpx descarta una conexión
+cerrada a medio leer; `PooledTransport` termina de leer esas respuestas
+para que la conexión vuelva al pool.
+"""
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+# Límites de cada pool; las solicitudes simultáneas ya las acota el planificador
+MAX_CONNECTIONS = 50
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 60.0
+
+# Mismo tiempo de espera que usa el SDK de OpenAI por defecto
+DEFAULT_TIMEOUT = httpx.Timeout(600.0, connect=5.0)
+
+def get_base_url() -> str:
+    """Endpoint de OpenAI configurado (los clientes leen la misma variable)."""
+    return os.environ.get("OPENAI_BASE_URL") or DEFAULT_BASE_URL
+
+class PoolStats:
+    """Contadores de un pool, alimentados por las trazas de httpcore."""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self._lock = threading.Lock()
+
+    def on_request(self, request: httpx.Request) -> None:
+        with self._lock:
+            self.requests += 1
+        request.extensions['trace'] = self._trace
+
+    def _trace(self, event_name: str, info: Dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+# Fin de un stream de eventos de OpenAI
+SSE_DONE = b"[DONE]"
+
+class SSEDrainingStream(httpx.SyncByteStream):
+    """
+    Cuerpo de una respuesta de eventos que, al cerrarse después de `[DONE]`,
+    lee lo que falta (el fin del cuerpo) para conservar la conexión.
+    Si se cierra antes, por ejemplo al cancelar una respuesta, se descarta
+    la conexión como siempre.
+    """
+
+    def __init__(self, stream: httpx.SyncByteStream):
+        self._stream = stream
+        self._tail = b""
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._tail = (self._tail + chunk)[-32:]
+            yield chunk
+
+    def close(self) -> None:
+        if self._tail.rstrip().endswith(SSE_DONE):
+            try:
+                for _ in self._stream:
+                    pass
+            except httpx.HTTPError:
+                pass
+        self._stream.close()
+
+class PooledTransport(httpx.HTTPTransport):
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = super().handle_request(request)
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            response.stream = SSEDrainingStream(response.stream)
+        return response
+
+class ClientPool:
+    """Cliente HTTP compartido para un endpoint."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.stats = PoolStats()
+        self.client = httpx.Client(
+            timeout=DEFAULT_TIMEOUT,
+            transport=PooledTransport(limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            )),
+            event_hooks={'request': [self.stats.on_request]}
+        )
+
+    def connections(self) -> Tuple[int, int]:
+        """Conexiones abiertas y cuántas de ellas están libres."""
+        pool = getattr(self.client._transport, '_pool', None)
+        connections = list(getattr(pool, 'connections', []))
+        idle = sum(1 for c in connections if c.is_idle())
+        return len(connections), idle
+
+    def snapshot(self) -> Dict:
+        opened, idle = self.connections()
+        requests = self.stats.requests
+        return {
+            'endpoint': self.base_url,
+            'requests': requests,
+            'connections_opened': self.stats.connections_opened,
+            'tls_handshakes': self.stats.tls_handshakes,
+            # Solicitudes que usaron una conexión ya abierta
+            'reuse_pct': 100.0 * (requests - self.stats.connections_opened) / requests if requests else 0.0,
+            'open_connections': opened,
+            'idle_connections': idle
+        }
+
+_pools: Dict[str, ClientPool] = {}
+_chat_models: Dict[Tuple, ChatOpenAI] = {}
+_embeddings: Dict[Tuple, OpenAIEmbeddings] = {}
+_lock = threading.Lock()
+
+def get_pool(base_url: Optional[str] = None) -> ClientPool:
+    base_url = base_url or get_base_url()
+    with _lock:
+        if base_url not in _pools:
+            _pools[base_url] = ClientPool(base_url)
+        return _pools[base_url]
+
+def get_http_client(base_url: Optional[str] = None) -> httpx.Client:
+    """Cliente HTTP compartido del endpoint (por defecto el configurado)."""
+    return get_pool(base_url).client
+
+def get_chat_model(model: Optional[str] = None, temperature: float = 0.7,
+                   max_tokens: Optional[int] = None, streaming: bool = False) -> ChatOpenAI:
+    """
+    Modelo de chat compartido por configuración. Los modelos de LangChain
+    no guardan estado entre llamadas, así que las sesiones pueden usar el
+    mismo objeto a la vez.
+    """
+    base_url = get_base_url()
+    key = (base_url, model, temperature, max_tokens, streaming)
+    with _lock:
+        if key in _chat_models:
+            return _chat_models[key]
+
+    kwargs: Dict[str, Any] = {
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'streaming': streaming,
+        'http_client': get_http_client(base_url)
+    }
+    if model:
+        kwargs['model'] = model
+    llm = ChatOpenAI(**kwargs)
+    with _lock:
+        return _chat_models.setdefault(key, llm)
+
+def get_embeddings(**kwargs) -> OpenAIEmbeddings:
+    """Cliente de embeddings compartido por configuración."""
+    base_url = get_base_url()
+    key = (base_url, tuple(sorted(kwargs.items())))
+    with _lock:
+        if key in _embeddings:
+            return _embeddings[key]
+
+    embeddings = OpenAIEmbeddings(http_client=get_http_client(base_url), **kwargs)
+    with _lock:
+        return _embeddings.setdefault(key, embeddings)
+
+def pool_snapshots() -> List[Dict]:
+    """Métricas de todos los pools para la página de administración."""
+    with _lock:
+        pools = list(_pools.values())
+    return [pool.snapshot() for pool in pools]
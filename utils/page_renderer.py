@@ -0,0 +1,142 @@
+# utils/page_renderer.py
+"""
+Imágenes de páginas de PDF para el visor.
+
+Antes el PDF completo se enviaba codificado en base64 dentro de un
+iframe en cada rerun. Aquí cada página se renderiza con PyMuPDF al zoom
+pedido, solo cuando se necesita, y se guarda como PNG en
+`data/page_images/`; la página muestra la imagen con `st.image`, que el
+navegador descarga por HTTP. Las páginas vecinas se renderizan en
+segundo plano para que avanzar o retroceder sea inmediato.
+"""
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Set
+
+ZOOM_LEVELS = [1.0, 1.5, 2.0]
+DEFAULT_ZOOM = 1.5
+
+# Páginas vecinas (antes y después) que se renderizan por adelantado
+PREFETCH_RADIUS = 1
+
+# Tamaño máximo del caché de imágenes; al superarlo se borran las menos usadas
+MAX_CACHE_BYTES = 500 * 1024 * 1024
+
+# Cada cuántas páginas renderizadas se revisa el tamaño del caché
+PRUNE_EVERY = 200
+
+class PageRenderer:
+    """Renderiza páginas de PDF a PNG con caché en disco, compartido por el proceso."""
+
+    def __init__(self, cache_dir: str = os.path.join("data", "page_images"),
+                 max_workers: int = 2, max_cache_bytes: int = MAX_CACHE_BYTES):
+        self.CACHE_DIR = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        os.makedirs(self.CACHE_DIR, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="page-render")
+        self._pending: Set[str] = set()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._renders = 0
+
+        self.prune()
+
+    def _document_key(self, pdf_path: str) -> str:
+        """Identificador del PDF: cambia si el archivo se reemplaza."""
+        stat = os.stat(pdf_path)
+        source = f"{os.path.abspath(pdf_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+
+    def image_path(self, pdf_path: str, page: int, zoom: float = DEFAULT_ZOOM) -> str:
+        return os.path.join(
+            self.CACHE_DIR, self._document_key(pdf_path), f"{page}_{int(zoom * 100)}.png"
+        )
+
+    def _path_lock(self, path: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def render(self, pdf_path: str, page: int, zoom: float = DEFAULT_ZOOM) -> str:
+        """Ruta del PNG de la página `page` (desde 0), renderizándola si falta."""
+        path = self.image_path(pdf_path, page, zoom)
+        if os.path.exists(path):
+            return path
+
+        # Si la página ya se está renderizando (p. ej. por adelantado), esperarla
+        with self._path_lock(path):
+            if os.path.exists(path):
+                return path
+
+            import fitz  # PyMuPDF
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            doc = fitz.open(pdf_path)
+            try:
+                pix = doc[page].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+                tmp_path = path + ".tmp"
+                pix.save(tmp_path, output="png")
+                os.replace(tmp_path, path)
+            finally:
+                doc.close()
+
+        with self._lock:
+            self._locks.pop(path, None)
+            self._renders += 1
+            prune = self._renders % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return path
+
+    def _render_quietly(self, pdf_path: str, page: int, zoom: float, path: str) -> None:
+        try:
+            self.render(pdf_path, page, zoom)
+        except Exception as e:
+            print(f"Error rendering page {page} of {pdf_path}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def prefetch(self, pdf_path: str, page: int, page_count: int,
+                 zoom: float = DEFAULT_ZOOM, radius: int = PREFETCH_RADIUS) -> None:
+        """Renderizar en segundo plano las páginas vecinas de `page`."""
+        for neighbour in range(max(0, page - radius), min(page_count, page + radius + 1)):
+            if neighbour == page:
+                continue
+            path = self.image_path(pdf_path, neighbour, zoom)
+            if os.path.exists(path):
+                continue
+            with self._lock:
+                if path in self._pending:
+                    continue
+                self._pending.add(path)
+            self._executor.submit(self._render_quietly, pdf_path, neighbour, zoom, path)
+
+    def prune(self) -> int:
+        """
+        Borrar las imágenes usadas hace más tiempo hasta que el caché quede
+        bajo `max_cache_bytes`. Devuelve los bytes liberados.
+        """
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.CACHE_DIR):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+                total += stat.st_size
+
+        freed = 0
+        for _, size, path in sorted(files):
+            if total - freed <= self.max_cache_bytes:
+                break
+            try:
+                os.remove(path)
+                freed += size
+            except OSError:
+                pass
+        return freed
@@ -0,0 +1,192 @@
+# utils/page_search.py
+"""
+Búsqueda de texto completo dentro de un documento, para el visor.
+
+Índice invertido con posiciones sobre el texto por página de
+`PageStore`: para cada término, las páginas y posiciones (en palabras)
+donde aparece. Responde consultas de términos (todas las palabras en la
+misma página) y frases entre comillas (palabras consecutivas) con la
+lista de páginas y un fragmento de cada una.
+
+Los términos se comparan sin mayúsculas ni tildes. El índice se guarda
+en el directorio del `PageStore`: el vocabulario en `terms.json` y las
+apariciones en `postings.npy`, codificadas como `página << 32 | posición`.
+"""
+import os
+import re
+import json
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.page_store import PageStore, open_page_store
+
+TERMS_FILE = "terms.json"
+POSTINGS_FILE = "postings.npy"
+
+MAX_HITS = 50
+SNIPPET_CHARS = 80
+
+WORD_PATTERN = re.compile(r"\w+")
+QUERY_PATTERN = re.compile(r'"([^"]+)"|(\S+)')
+
+def _fold_char(char: str) -> str:
+    base = unicodedata.normalize('NFKD', char)[:1]
+    return base.lower() if base else char.lower()
+
+def fold(text: str) -> str:
+    """
+    Minúsculas y sin tildes, carácter por carácter: el texto resultante
+    tiene el mismo largo, así que las posiciones sirven en el original.
+    """
+    return "".join(_fold_char(c) if ord(c) > 127 else c.lower() for c in text)
+
+def tokenize(text: str) -> List[str]:
+    return WORD_PATTERN.findall(fold(text))
+
+def parse_query(query: str) -> List[List[str]]:
+    """Frases entre comillas y términos sueltos, cada uno como lista de palabras."""
+    parts = []
+    for phrase, term in QUERY_PATTERN.findall(query):
+        words = tokenize(phrase or term)
+        if words:
+            parts.append(words)
+    return parts
+
+class PageIndex:
+    """Índice posicional de las páginas de un documento."""
+
+    def __init__(self, store: PageStore):
+        self.store = store
+        store_dir = store.STORE_DIR
+
+        with open(os.path.join(store_dir, TERMS_FILE), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        self.source = info['source']
+        # término -> [inicio, fin] en `postings`
+        self.terms: Dict[str, List[int]] = info['terms']
+        self.postings = np.load(os.path.join(store_dir, POSTINGS_FILE), mmap_mode='r')
+
+    def is_current(self) -> bool:
+        return self.source == {k: self.store.info.get(k) for k in self.source}
+
+    @staticmethod
+    def build(store: PageStore) -> "PageIndex":
+        """Indexar las páginas del `PageStore` y guardar el índice junto a él."""
+        occurrences: Dict[str, List[int]] = {}
+        for page in range(len(store)):
+            for position, word in enumerate(tokenize(store.page_text(page))):
+                occurrences.setdefault(word, []).append((page << 32) | position)
+
+        terms = {}
+        chunks = []
+        offset = 0
+        for word in sorted(occurrences):
+            keys = occurrences[word]
+            terms[word] = [offset, offset + len(keys)]
+            chunks.append(np.asarray(keys, dtype=np.int64))
+            offset += len(keys)
+        postings = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+
+        store_dir = store.STORE_DIR
+        postings_path = os.path.join(store_dir, POSTINGS_FILE)
+        terms_path = os.path.join(store_dir, TERMS_FILE)
+        with open(postings_path + ".tmp", 'wb') as f:
+            np.save(f, postings)
+        with open(terms_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({
+                'source': {k: store.info.get(k) for k in ['source_size', 'source_mtime', 'page_count']},
+                'terms': terms
+            }, f, ensure_ascii=False)
+        os.replace(postings_path + ".tmp", postings_path)
+        os.replace(terms_path + ".tmp", terms_path)
+        return PageIndex(store)
+
+    def _keys(self, word: str) -> np.ndarray:
+        span = self.terms.get(word)
+        if span is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.asarray(self.postings[span[0]:span[1]])
+
+    def _match_pages(self, words: List[str]) -> np.ndarray:
+        """Páginas donde aparecen las palabras consecutivas (o la palabra sola)."""
+        keys = self._keys(words[0])
+        for shift, word in enumerate(words[1:], start=1):
+            if not len(keys):
+                break
+            # Posición de la palabra siguiente desplazada al inicio de la frase
+            keys = np.intersect1d(keys, self._keys(word) - shift, assume_unique=True)
+        return np.unique(keys >> 32)
+
+    def _snippet(self, page: int, parts: List[List[str]]) -> Tuple[str, int]:
+        """Fragmento alrededor de la primera coincidencia y el número de coincidencias."""
+        text = self.store.page_text(page)
+        folded = fold(text)
+        patterns = [r"\W+".join(re.escape(w) for w in words) for words in parts]
+        matches = list(re.finditer(r"\b(?:" + "|".join(patterns) + r")\b", folded))
+        if not matches:
+            return text[:SNIPPET_CHARS * 2], 0
+
+        first = matches[0]
+        start = max(0, first.start() - SNIPPET_CHARS)
+        end = min(len(text), first.end() + SNIPPET_CHARS)
+        snippet = (
+            ("..." if start > 0 else "")
+            + text[start:first.start()]
+            + f"**{text[first.start():first.end()]}**"
+            + text[first.end():end]
+            + ("..." if end < len(text) else "")
+        )
+        return " ".join(snippet.split()), len(matches)
+
+    def search(self, query: str, max_hits: int = MAX_HITS) -> List[Dict]:
+        """
+        Páginas que contienen todos los términos y frases de la consulta, en
+        orden del documento, con un fragmento de cada una.
+        """
+        parts = parse_query(query)
+        if not parts:
+            return []
+
+        pages: Optional[np.ndarray] = None
+        for words in sorted(parts, key=lambda w: min(self._count(x) for x in w)):
+            matched = self._match_pages(words)
+            pages = matched if pages is None else np.intersect1d(pages, matched, assume_unique=True)
+            if not len(pages):
+                return []
+
+        hits = []
+        for page in pages[:max_hits]:
+            snippet, count = self._snippet(int(page), parts)
+            hits.append({'page': int(page), 'snippet': snippet, 'matches': count})
+        return hits
+
+    def _count(self, word: str) -> int:
+        span = self.terms.get(word)
+        return span[1] - span[0] if span else 0
+
+_build_lock = threading.Lock()
+
+def open_page_index(pdf_path: str, store: Optional[PageStore] = None) -> PageIndex:
+    """
+    Abrir el índice del PDF, construyéndolo si falta o si el PDF cambió.
+    `store` evita volver a abrir el texto por página si ya está abierto.
+    """
+    store = store or open_page_store(pdf_path)
+    try:
+        index = PageIndex(store)
+        if index.is_current():
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with _build_lock:
+        try:
+            index = PageIndex(store)
+            if index.is_current():
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+        return PageIndex.build(store)
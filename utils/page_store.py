@@ -0,0 +1,139 @@
+# utils/page_store.py
+"""
+Texto de las páginas de un PDF en disco, para el visor de documentos.
+
+El texto de cada página se extrae una sola vez (al subir el documento, o
+la primera vez que se abre en el visor) y se guarda junto al PDF en un
+directorio `<nombre>_pages` con el mismo formato que el índice NumPy:
+los textos concatenados en `pages.bin` y un arreglo de offsets. El
+archivo se abre con memory-map, así que todas las sesiones comparten las
+mismas páginas del caché del sistema operativo y cada una lee solo la
+página que está mostrando.
+"""
+import os
+import json
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+PAGE_STORE_SUFFIX = "_pages"
+
+PAGES_FILE = "pages.bin"
+OFFSETS_FILE = "offsets.npy"
+INFO_FILE = "info.json"
+
+PREVIEW_CHARS = 100
+
+def page_store_dir(pdf_path: str) -> str:
+    """Directorio del texto por página de un PDF."""
+    return os.path.splitext(pdf_path)[0] + PAGE_STORE_SUFFIX
+
+def source_signature(pdf_path: str) -> Dict:
+    """Tamaño y fecha del PDF, para saber si el texto guardado sigue vigente."""
+    stat = os.stat(pdf_path)
+    return {'source_size': stat.st_size, 'source_mtime': int(stat.st_mtime)}
+
+class PageStore:
+    """Texto de las páginas de un PDF, leído página a página desde disco."""
+
+    def __init__(self, store_dir: str):
+        self.STORE_DIR = store_dir
+
+        with open(os.path.join(store_dir, INFO_FILE), 'r', encoding='utf-8') as f:
+            self.info: Dict = json.load(f)
+
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE))
+        self._pages = np.memmap(os.path.join(store_dir, PAGES_FILE), dtype=np.uint8, mode='r') \
+            if self.offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def close(self) -> None:
+        """
+        Soltar el archivo de páginas. El memory-map se cierra cuando nadie
+        más lo referencia; después el store ya no devuelve texto.
+        """
+        self._pages = np.zeros(0, dtype=np.uint8)
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+    def page_text(self, index: int) -> str:
+        """Texto de la página `index` (desde 0)."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return bytes(self._pages[start:end]).decode('utf-8')
+
+    def preview(self, index: int) -> str:
+        content = self.page_text(index)
+        return content[:PREVIEW_CHARS] + "..." if len(content) > PREVIEW_CHARS else content
+
+    def is_current(self, pdf_path: str) -> bool:
+        try:
+            signature = source_signature(pdf_path)
+        except OSError:
+            return False
+        return all(self.info.get(key) == value for key, value in signature.items())
+
+    @staticmethod
+    def build(pdf_path: str, store_dir: Optional[str] = None) -> "PageStore":
+        """
+        Extraer el texto del PDF página por página y escribirlo en disco sin
+        tener el documento completo en memoria. Los archivos se reemplazan
+        de forma atómica (`info.json` al final), así que un visor que tenga
+        abierta la versión anterior la sigue leyendo sin errores.
+        """
+        import fitz  # PyMuPDF
+
+        store_dir = store_dir or page_store_dir(pdf_path)
+        os.makedirs(store_dir, exist_ok=True)
+        signature = source_signature(pdf_path)
+
+        pages_path = os.path.join(store_dir, PAGES_FILE)
+        offsets_path = os.path.join(store_dir, OFFSETS_FILE)
+        info_path = os.path.join(store_dir, INFO_FILE)
+
+        offsets = [0]
+        doc = fitz.open(pdf_path)
+        try:
+            with open(pages_path + ".tmp", 'wb') as f:
+                for page in doc:
+                    data = page.get_text("text").strip().encode('utf-8')
+                    f.write(data)
+                    offsets.append(offsets[-1] + len(data))
+        finally:
+            doc.close()
+
+        with open(offsets_path + ".tmp", 'wb') as f:
+            np.save(f, np.asarray(offsets, dtype=np.int64))
+        with open(info_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({'page_count': len(offsets) - 1, **signature}, f)
+
+        os.replace(pages_path + ".tmp", pages_path)
+        os.replace(offsets_path + ".tmp", offsets_path)
+        os.replace(info_path + ".tmp", info_path)
+        return PageStore(store_dir)
+
+_build_lock = threading.Lock()
+
+def open_page_store(pdf_path: str) -> PageStore:
+    """
+    Abrir el texto por página de un PDF, extrayéndolo si todavía no existe
+    o si el PDF cambió (documentos subidos antes de guardar las páginas).
+    """
+    store_dir = page_store_dir(pdf_path)
+    try:
+        store = PageStore(store_dir)
+        if store.is_current(pdf_path):
+            return store
+    except (OSError, ValueError):
+        pass
+
+    # Una sola extracción aunque varias sesiones abran el documento a la vez
+    with _build_lock:
+        try:
+            store = PageStore(store_dir)
+            if store.is_current(pdf_path):
+                return store
+        except (OSError, ValueError):
+            pass
+        return PageStore.build(pdf_path, store_dir)
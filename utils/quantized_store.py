@@ -0,0 +1,244 @@
+# utils/quantized_store.py
+import os
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.numpy_store import NumpyVectorStore, EMBEDDINGS_FILE
+
+CODES_FILE = "codes.npy"
+QUANTIZER_FILE = "quantizer.npz"
+QUANTIZATION_FILE = "quantization.json"
+# Matriz float16 de la que se leen solo las filas candidatas al re-puntuar
+RESCORE_FILE = "rescore.npy"
+
+QUANTIZATION_METHODS = ["int8", "pq"]
+
+# Filas de códigos int8 convertidas a float32 por vez: bloques chicos
+# mantienen la memoria temporal muy por debajo de la de los códigos
+SCAN_BLOCK_SIZE = 1024
+
+# Candidatos por resultado que se vuelven a puntuar con precisión completa
+DEFAULT_RESCORE_FACTOR = 4
+
+def train_int8(matrix: np.ndarray) -> Dict[str, np.ndarray]:
+    """Cuantización escalar por dimensión al rango [-127, 127]."""
+    low = matrix.min(axis=0)
+    high = matrix.max(axis=0)
+    offset = (high + low) / 2
+    scale = (high - low) / 254
+    scale[scale == 0] = 1.0
+    return {"offset": offset.astype(np.float32), "scale": scale.astype(np.float32)}
+
+def encode_int8(matrix: np.ndarray, quantizer: Dict[str, np.ndarray]) -> np.ndarray:
+    codes = np.rint((matrix - quantizer["offset"]) / quantizer["scale"])
+    return np.clip(codes, -127, 127).astype(np.int8)
+
+def train_pq(matrix: np.ndarray, num_subspaces: int, iterations: int = 20,
+             seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    Entrenar los codebooks de product quantization con k-means por subespacio.
+    Cada subespacio usa hasta 256 centroides para que el código quepa en un byte.
+    """
+    count, dim = matrix.shape
+    if dim % num_subspaces != 0:
+        raise ValueError(f"La dimensión {dim} no es divisible entre {num_subspaces} subespacios")
+
+    sub_dim = dim // num_subspaces
+    num_centroids = min(256, count)
+    rng = np.random.default_rng(seed)
+    codebooks = np.zeros((num_subspaces, num_centroids, sub_dim), dtype=np.float32)
+
+    for m in range(num_subspaces):
+        data = matrix[:, m * sub_dim:(m + 1) * sub_dim]
+        centroids = data[rng.choice(count, size=num_centroids, replace=False)].copy()
+        for _ in range(iterations):
+            distances = (
+                (data ** 2).sum(axis=1, keepdims=True)
+                - 2 * data @ centroids.T
+                + (centroids ** 2).sum(axis=1)
+            )
+            assignment = distances.argmin(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, data)
+            counts = np.bincount(assignment, minlength=num_centroids)
+            # Los centroides sin miembros conservan su posición anterior
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        codebooks[m] = centroids
+
+    return {"codebooks": codebooks}
+
+def encode_pq(matrix: np.ndarray, quantizer: Dict[str, np.ndarray]) -> np.ndarray:
+    codebooks = quantizer["codebooks"]
+    num_subspaces, _, sub_dim = codebooks.shape
+    codes = np.zeros((matrix.shape[0], num_subspaces), dtype=np.uint8)
+    for m in range(num_subspaces):
+        data = matrix[:, m * sub_dim:(m + 1) * sub_dim]
+        centroids = codebooks[m]
+        distances = (centroids ** 2).sum(axis=1) - 2 * data @ centroids.T
+        codes[:, m] = distances.argmin(axis=1)
+    return codes
+
+class QuantizedVectorStore(NumpyVectorStore):
+    """
+    Índice NumPy con embeddings cuantizados.
+
+    Solo los códigos (int8 o PQ) se cargan en RAM. La búsqueda usa distancia
+    asimétrica (la consulta queda en float32) y los mejores candidatos se
+    vuelven a puntuar con una copia float16 de los embeddings en disco, de
+    la que se leen solo las filas candidatas (con `pread`, sin mapear el
+    archivo). El índice no guarda la matriz float32 ni abre el vectorstore
+    Chroma al buscar.
+    """
+
+    def __init__(self, index_dir: str, embedding_function: Embeddings,
+                 rescore_factor: int = DEFAULT_RESCORE_FACTOR):
+        super().__init__(index_dir, embedding_function)
+        self.rescore_factor = rescore_factor
+
+        with open(os.path.join(index_dir, QUANTIZATION_FILE), 'r', encoding='utf-8') as f:
+            self.method = json.load(f)['method']
+
+        self.codes = np.load(os.path.join(index_dir, CODES_FILE))
+        with np.load(os.path.join(index_dir, QUANTIZER_FILE)) as data:
+            self.quantizer = {name: data[name] for name in data.files}
+
+    def _load_matrix(self) -> Optional[np.ndarray]:
+        # Se abre el archivo en lugar de mapearlo: un memory-map deja en la
+        # memoria del proceso también las páginas vecinas de cada fila leída
+        self._rescore_file = open(os.path.join(self.INDEX_DIR, RESCORE_FILE), 'rb')
+        version = np.lib.format.read_magic(self._rescore_file)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) \
+            else np.lib.format.read_array_header_2_0
+        shape, _, dtype = read_header(self._rescore_file)
+        self._rescore_offset = self._rescore_file.tell()
+        self._rescore_dtype = np.dtype(dtype)
+        self._row_bytes = (shape[1] if len(shape) > 1 else 0) * self._rescore_dtype.itemsize
+        return None
+
+    @staticmethod
+    def quantize_index(index_dir: str, method: str = "int8", num_subspaces: int = 96) -> None:
+        """
+        Reemplazar la matriz float32 de un índice NumPy por sus códigos
+        cuantizados y una copia float16 para re-puntuar.
+        """
+        if method not in QUANTIZATION_METHODS:
+            raise ValueError(f"Método de cuantización no soportado: {method}")
+
+        embeddings_path = os.path.join(index_dir, EMBEDDINGS_FILE)
+        matrix = np.load(embeddings_path).astype(np.float32)
+        if matrix.shape[0] == 0:
+            # Índice vacío: no hay nada que entrenar
+            quantizer = {"offset": np.zeros(0, dtype=np.float32), "scale": np.ones(0, dtype=np.float32)}
+            codes = np.zeros((0, 0), dtype=np.int8)
+            method = "int8"
+        elif method == "int8":
+            quantizer = train_int8(matrix)
+            codes = encode_int8(matrix, quantizer)
+        else:
+            # Reducir subespacios hasta que dividan la dimensión
+            while matrix.shape[1] % num_subspaces != 0:
+                num_subspaces -= 1
+            quantizer = train_pq(matrix, num_subspaces)
+            codes = encode_pq(matrix, quantizer)
+
+        np.save(os.path.join(index_dir, CODES_FILE), codes)
+        np.save(os.path.join(index_dir, RESCORE_FILE), matrix.astype(np.float16))
+        np.savez(os.path.join(index_dir, QUANTIZER_FILE), **quantizer)
+        with open(os.path.join(index_dir, QUANTIZATION_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'method': method}, f)
+        os.remove(embeddings_path)
+
+    @classmethod
+    def from_chroma(cls, chroma_store, index_dir: str, method: str = "int8",
+                    num_subspaces: int = 96, source: Optional[Dict] = None) -> "QuantizedVectorStore":
+        """Exportar un vectorstore Chroma y cuantizar sus embeddings."""
+        data = chroma_store.get(include=["embeddings", "documents", "metadatas"])
+        NumpyVectorStore.write_index(
+            index_dir,
+            texts=data['documents'],
+            embeddings=data['embeddings'],
+            metadatas=data['metadatas'],
+            ids=data['ids'],
+            dtype="float32",
+            source=source
+        )
+        cls.quantize_index(index_dir, method, num_subspaces)
+        return cls(index_dir, chroma_store.embeddings)
+
+    def memory_bytes(self) -> int:
+        """Bytes residentes en RAM para buscar (códigos y cuantizador)."""
+        return int(self.codes.nbytes + sum(a.nbytes for a in self.quantizer.values()))
+
+    def full_precision_bytes(self) -> int:
+        """Bytes que ocuparía la matriz float32 completa en RAM."""
+        return int(len(self) * self.dim * 4)
+
+    def approximate_scores(self, query: np.ndarray, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Producto interno aproximado entre la consulta y los códigos (de
+        todas las filas o solo de `positions`).
+        """
+        codes = self.codes if positions is None else self.codes[positions]
+        if self.method == "int8":
+            scaled = query * self.quantizer["scale"]
+            base = float(query @ self.quantizer["offset"])
+            scores = np.empty(codes.shape[0], dtype=np.float32)
+            for start in range(0, codes.shape[0], SCAN_BLOCK_SIZE):
+                block = codes[start:start + SCAN_BLOCK_SIZE].astype(np.float32)
+                scores[start:start + SCAN_BLOCK_SIZE] = block @ scaled + base
+            return scores
+
+        codebooks = self.quantizer["codebooks"]
+        num_subspaces, _, sub_dim = codebooks.shape
+        # Tabla de productos parciales de la consulta con cada centroide
+        table = np.einsum(
+            'mkd,md->mk', codebooks, query.reshape(num_subspaces, sub_dim)
+        )
+        return table[np.arange(num_subspaces), codes].sum(axis=1)
+
+    def read_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Filas `rows` (ordenadas) de la copia float16, como float32."""
+        fd = self._rescore_file.fileno()
+        data = b"".join(
+            os.pread(fd, self._row_bytes, self._rescore_offset + int(row) * self._row_bytes)
+            for row in rows
+        )
+        return np.frombuffer(data, dtype=self._rescore_dtype).reshape(len(rows), -1).astype(np.float32)
+
+    def exact_scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Similitud coseno de las filas `rows`, leídas de la copia float16."""
+        return self.read_rows(rows) @ query
+
+    def top_k(self, embedding: List[float], k: int, filter: Optional[Dict] = None,
+              rescore: bool = True) -> List[Tuple[int, float]]:
+        if len(self) == 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        positions = self.filter_positions(filter)
+        if positions is not None and positions.shape[0] == 0:
+            return []
+        scores = self.approximate_scores(query, positions)
+        rows_by_score = positions if positions is not None else np.arange(scores.shape[0])
+
+        k = min(k, scores.shape[0])
+        num_candidates = min(scores.shape[0], k * self.rescore_factor if rescore else k)
+        candidates = np.argpartition(-scores, num_candidates - 1)[:num_candidates]
+
+        if rescore:
+            # Solo las filas candidatas se leen de la copia float16 en disco
+            rows = np.sort(rows_by_score[candidates])
+            exact = self.exact_scores(query, rows)
+            order = np.argsort(-exact)[:k]
+            return [(int(rows[i]), float(exact[i])) for i in order]
+
+        ordered = candidates[np.argsort(-scores[candidates])]
+        return [(int(rows_by_score[i]), float(scores[i])) for i in ordered]
@@ -0,0 +1,145 @@
+# utils/retrieval.py
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from utils.vector_backends import load_vectorstore, page_filter, similarity_search_by_vector_with_cosine
+from utils.retrieval_service import RemoteVectorStore, get_retrieval_client
+from utils.tracing import span
+
+NO_RESULTS_MESSAGE = "No encontré información específica. ¿Podrías reformular la pregunta?"
+
+# Páginas vecinas incluidas en la búsqueda acotada del visor
+PAGE_SCOPE_RADIUS = 1
+
+# Similitud coseno mínima para no ampliar la búsqueda a todos los documentos
+PAGE_SCOPE_MIN_SCORE = 0.85
+
+def open_agent_vectorstore(doc: Dict, context_window: int, embedding_function) -> Dict:
+    """
+    Abrir el vectorstore de un documento con el retriever que usan los chats.
+    Si hay un servicio de búsqueda configurado, las consultas se hacen ahí.
+    """
+    client = get_retrieval_client()
+    if client is not None:
+        vectorstore = RemoteVectorStore(doc['hash'], embedding_function, client)
+    else:
+        vectorstore = load_vectorstore(doc, embedding_function)
+    return {
+        'hash': doc['hash'],
+        'title': doc['title'],
+        'vectorstore': vectorstore,
+        'retriever': vectorstore.as_retriever(
+            search_kwargs={"k": context_window}
+        )
+    }
+
+def _merge_scored(scored: List[Tuple[float, str, str, object]], limit: int) -> List[Dict]:
+    """Ordenar por puntaje, quitar fragmentos repetidos y dar formato de resultado."""
+    scored.sort(key=lambda x: x[0], reverse=True)
+    results = []
+    seen_contents = set()
+    for score, source, doc_hash, doc in scored:
+        content = doc.page_content.strip()
+        if content in seen_contents:
+            continue
+        seen_contents.add(content)
+        results.append({
+            'source': source,
+            'hash': doc_hash,
+            'content': content,
+            'metadata': dict(doc.metadata or {}),
+            'score': score
+        })
+    return results[:limit]
+
+def search_remote(vectorstores: List[Dict], query: str, limit: int,
+                  embedding: Optional[List[float]] = None) -> List[Dict]:
+    """
+    Una sola llamada al servicio de búsqueda para todos los documentos;
+    el servicio reparte la consulta entre shards y combina por puntaje.
+    """
+    titles = {vs['hash']: vs['title'] for vs in vectorstores}
+    first = vectorstores[0]['vectorstore']
+    if embedding is None:
+        with span("retrieval.embed"):
+            embedding = first.embeddings.embed_query(query)
+    k = vectorstores[0]['retriever'].search_kwargs.get("k", limit)
+
+    with span("retrieval.search", backend="remote", documents=len(titles), k=k):
+        matches = first.client.search(list(titles), embedding, k)
+    scored = [
+        (r['score'], titles.get(r['hash'], r['hash']), r['hash'],
+         Document(page_content=r['content'], metadata=r['metadata']))
+        for r in matches
+    ]
+    return _merge_scored(scored, limit)
+
+def search_vectorstores(vectorstores: List[Dict], query: str, limit: int,
+                        embedding: Optional[List[float]] = None) -> List[Dict]:
+    """
+    Busca la consulta en todos los vectorstores del agente.
+    Devuelve hasta `limit` fragmentos únicos con su documento de origen,
+    ordenados por similitud coseno entre todos los documentos.
+    """
+    if not vectorstores:
+        return []
+    if all(isinstance(vs['vectorstore'], RemoteVectorStore) for vs in vectorstores):
+        return search_remote(vectorstores, query, limit, embedding)
+
+    # Todos los documentos usan el mismo modelo de embeddings: una sola llamada
+    if embedding is None:
+        with span("retrieval.embed"):
+            embedding = vectorstores[0]['vectorstore'].embeddings.embed_query(query)
+
+    scored = []
+    for vs in vectorstores:
+        k = vs['retriever'].search_kwargs.get("k", limit)
+        with span("retrieval.search", backend=type(vs['vectorstore']).__name__, document=vs['title'], k=k):
+            matches = similarity_search_by_vector_with_cosine(vs['vectorstore'], embedding, k)
+        for doc, score in matches:
+            scored.append((score, vs['title'], vs.get('hash'), doc))
+    return _merge_scored(scored, limit)
+
+def get_sources(results: List[Dict]) -> List[str]:
+    """Obtiene los títulos de documentos citados, sin repetir y en orden."""
+    sources = []
+    for r in results:
+        if r['source'] not in sources:
+            sources.append(r['source'])
+    return sources
+
+def search_vectorstores_scoped(vectorstores: List[Dict], query: str, limit: int,
+                               doc_hash: Optional[str], page: Optional[int],
+                               radius: int = PAGE_SCOPE_RADIUS,
+                               min_score: float = PAGE_SCOPE_MIN_SCORE,
+                               embedding: Optional[List[float]] = None) -> Tuple[List[Dict], Optional[List[int]]]:
+    """
+    Busca primero en la página actual del documento y sus vecinas, y amplía
+    a todos los documentos del agente solo si el mejor puntaje es bajo.
+    Devuelve los fragmentos y las páginas usadas (None si se amplió).
+    """
+    target = next((vs for vs in vectorstores if vs.get('hash') == doc_hash), None)
+
+    if target is not None and page is not None:
+        pages = list(range(max(0, page - radius), page + radius + 1))
+        try:
+            vectorstore = target['vectorstore']
+            if embedding is None:
+                with span("retrieval.embed"):
+                    embedding = vectorstore.embeddings.embed_query(query)
+            with span("retrieval.search", backend=type(vectorstore).__name__,
+                      document=target['title'], k=limit, pages=len(pages)):
+                scored = similarity_search_by_vector_with_cosine(
+                    vectorstore, embedding, limit, page_filter(pages)
+                )
+        except Exception as e:
+            print(f"Error in page-scoped search, widening: {str(e)}")
+            scored = []
+
+        if scored and max(score for _, score in scored) >= min_score:
+            return _merge_scored(
+                [(score, target['title'], target['hash'], doc) for doc, score in scored], limit
+            ), pages
+
+    return search_vectorstores(vectorstores, query, limit, embedding), None
@@ -0,0 +1,351 @@
+# utils/retrieval_service.py
+"""
+Servicio de búsqueda vectorial en procesos separados de Streamlit.
+
+Los vectorstores se reparten entre procesos trabajadores según el hash del
+documento. El proceso principal recibe consultas (embedding ya calculado)
+por IPC de `multiprocessing.connection`, las reparte entre los shards
+involucrados en paralelo y devuelve los resultados combinados por puntaje.
+
+Iniciar el servicio:
+
+    python -m utils.retrieval_service --workers 4 --port 8765
+
+y configurar la app con `YACHANI_RETRIEVAL_SERVICE=127.0.0.1:8765`.
+
+`multiprocessing.connection` deserializa con pickle lo que recibe, así
+que la clave de autenticación es lo único que protege el puerto. En una
+dirección local, si no se define `YACHANI_RETRIEVAL_AUTHKEY`, servicio y
+app comparten una clave aleatoria guardada en `data/.retrieval_authkey`
+(0600). Para escuchar o conectarse a otra máquina la variable es
+obligatoria.
+"""
+import sys
+if __name__ == "__main__":
+    # Igual que en las páginas: Chroma necesita un sqlite3 reciente
+    import pysqlite3
+    sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+import os
+import uuid
+import hashlib
+import argparse
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from utils.document_manager import DocumentManager
+from utils.local_secrets import is_loopback, load_or_create_secret
+from utils.vector_backends import DEFAULT_BACKEND, load_vectorstore, similarity_search_by_vector_with_cosine
+
+SERVICE_ENV = "YACHANI_RETRIEVAL_SERVICE"
+AUTHKEY_ENV = "YACHANI_RETRIEVAL_AUTHKEY"
+AUTHKEY_FILE = os.path.join("data", ".retrieval_authkey")
+
+# Segundos máximos de espera por la respuesta de los shards
+REQUEST_TIMEOUT = 30
+
+def shard_for(doc_hash: str, num_shards: int) -> int:
+    """Shard asignado a un documento (estable entre reinicios)."""
+    return int(hashlib.sha1(doc_hash.encode()).hexdigest(), 16) % num_shards
+
+def parse_address(value: str) -> Tuple[str, int]:
+    host, port = value.rsplit(":", 1)
+    return host, int(port)
+
+def get_authkey(host: str) -> str:
+    """
+    Clave de `YACHANI_RETRIEVAL_AUTHKEY`, o la clave local aleatoria si el
+    servicio está en esta máquina. Sin variable, una dirección remota es un error.
+    """
+    configured = os.environ.get(AUTHKEY_ENV)
+    if configured:
+        return configured
+    if not is_loopback(host):
+        raise ValueError(
+            f"{AUTHKEY_ENV} es obligatoria para usar el servicio de búsqueda en {host}"
+        )
+    return load_or_create_secret(AUTHKEY_FILE)
+
+def store_version(doc: Dict) -> Tuple:
+    """Versión del vectorstore de un documento: cambia al volver a subirlo o cambiar de motor."""
+    return (doc.get('processed_date'), doc.get('vector_backend', DEFAULT_BACKEND))
+
+def _worker_main(shard_id: int, requests: mp.Queue, responses: mp.Queue) -> None:
+    """Proceso trabajador: abre sus vectorstores bajo demanda y responde búsquedas."""
+    doc_manager = DocumentManager()
+    # hash -> (versión, vectorstore)
+    stores: Dict[str, Tuple[Tuple, Any]] = {}
+
+    def get_store(doc_hash: str):
+        doc = doc_manager.get_document(doc_hash)
+        if doc is None or not os.path.exists(doc.get('vectorstore_path', '')):
+            stores.pop(doc_hash, None)
+            return None
+        # Un documento vuelto a subir o con otro motor se abre de nuevo
+        version = store_version(doc)
+        cached = stores.get(doc_hash)
+        if cached is None or cached[0] != version:
+            stores[doc_hash] = (version, load_vectorstore(doc, None))
+        return stores[doc_hash][1]
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+
+        if request['op'] == 'stats':
+            responses.put((request['id'], shard_id, {'loaded': list(stores)}, None))
+            continue
+
+        results, error = [], None
+        try:
+            # Documentos nuevos, vueltos a subir o con otro motor desde la última consulta
+            doc_manager.refresh_metadata()
+            for doc_hash in request['doc_hashes']:
+                store = get_store(doc_hash)
+                if store is None:
+                    continue
+                scored = similarity_search_by_vector_with_cosine(
+                    store, request['embedding'], request['k'], request.get('filter')
+                )
+                for doc, score in scored:
+                    results.append({
+                        'hash': doc_hash,
+                        'content': doc.page_content,
+                        'metadata': dict(doc.metadata or {}),
+                        'score': float(score)
+                    })
+        except Exception as e:
+            error = str(e)
+        responses.put((request['id'], shard_id, results, error))
+
+class RetrievalService:
+    """Proceso principal: reparte las consultas entre shards y combina resultados."""
+
+    def __init__(self, num_workers: int, address: Tuple[str, int], authkey: str):
+        self.num_workers = num_workers
+        self.address = address
+        self.authkey = authkey.encode()
+
+        self._responses: mp.Queue = mp.Queue()
+        self._requests: List[mp.Queue] = [mp.Queue() for _ in range(num_workers)]
+        self._workers: List[mp.Process] = []
+        self._pending: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def start_workers(self) -> None:
+        for shard_id in range(self.num_workers):
+            process = mp.Process(
+                target=_worker_main,
+                args=(shard_id, self._requests[shard_id], self._responses),
+                daemon=True
+            )
+            process.start()
+            self._workers.append(process)
+        threading.Thread(target=self._dispatch_responses, daemon=True).start()
+
+    def _dispatch_responses(self) -> None:
+        """Entregar cada respuesta de shard a la consulta que la espera."""
+        while True:
+            request_id, shard_id, results, error = self._responses.get()
+            with self._lock:
+                pending = self._pending.get(request_id)
+                if pending is None:
+                    continue
+                if error:
+                    pending['errors'].append(f"shard {shard_id}: {error}")
+                if isinstance(results, list):
+                    pending['results'].extend(results)
+                else:
+                    pending['stats'][shard_id] = results
+                pending['remaining'] -= 1
+                if pending['remaining'] == 0:
+                    pending['done'].set()
+
+    def _scatter(self, shard_requests: Dict[int, Dict]) -> Dict:
+        request_id = uuid.uuid4().hex
+        pending = {
+            'results': [], 'errors': [], 'stats': {},
+            'remaining': len(shard_requests), 'done': threading.Event()
+        }
+        with self._lock:
+            self._pending[request_id] = pending
+        try:
+            if not shard_requests:
+                pending['done'].set()
+            for shard_id, request in shard_requests.items():
+                self._requests[shard_id].put({**request, 'id': request_id})
+            if not pending['done'].wait(REQUEST_TIMEOUT):
+                pending['errors'].append("tiempo de espera agotado")
+            return pending
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def search(self, doc_hashes: List[str], embedding: List[float], k: int,
+               filter: Optional[Dict] = None) -> Dict:
+        by_shard: Dict[int, List[str]] = {}
+        for doc_hash in doc_hashes:
+            by_shard.setdefault(shard_for(doc_hash, self.num_workers), []).append(doc_hash)
+
+        pending = self._scatter({
+            shard_id: {'op': 'search', 'doc_hashes': hashes, 'embedding': embedding,
+                       'k': k, 'filter': filter}
+            for shard_id, hashes in by_shard.items()
+        })
+        results = sorted(pending['results'], key=lambda r: r['score'], reverse=True)
+        return {'results': results, 'errors': pending['errors']}
+
+    def stats(self) -> Dict:
+        pending = self._scatter({
+            shard_id: {'op': 'stats'} for shard_id in range(self.num_workers)
+        })
+        return {'workers': self.num_workers, 'shards': pending['stats']}
+
+    def _handle_connection(self, conn) -> None:
+        try:
+            while True:
+                request = conn.recv()
+                if request['op'] == 'search':
+                    response = self.search(
+                        request['doc_hashes'], request['embedding'],
+                        request['k'], request.get('filter')
+                    )
+                elif request['op'] == 'stats':
+                    response = self.stats()
+                else:
+                    response = {'errors': [f"Operación desconocida: {request['op']}"]}
+                conn.send(response)
+        except (EOFError, ConnectionResetError):
+            pass
+        finally:
+            conn.close()
+
+    def serve_forever(self) -> None:
+        self.start_workers()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"Retrieval service listening on {self.address[0]}:{self.address[1]} "
+                  f"with {self.num_workers} workers")
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+class RetrievalClient:
+    """Cliente del servicio; mantiene una conexión por hilo (sesión de Streamlit)."""
+
+    def __init__(self, address: Tuple[str, int], authkey: str):
+        self.address = address
+        self.authkey = authkey.encode()
+        self._local = threading.local()
+
+    def _request(self, request: Dict) -> Dict:
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            try:
+                if conn is None:
+                    conn = Client(self.address, authkey=self.authkey)
+                    self._local.conn = conn
+                conn.send(request)
+                return conn.recv()
+            except (EOFError, ConnectionError, OSError):
+                # Reconectar una vez si el servicio se reinició
+                self._local.conn = None
+                if attempt == 1:
+                    raise
+
+    def search(self, doc_hashes: List[str], embedding: List[float], k: int,
+               filter: Optional[Dict] = None) -> List[Dict]:
+        response = self._request({
+            'op': 'search', 'doc_hashes': doc_hashes,
+            'embedding': list(embedding), 'k': k, 'filter': filter
+        })
+        for error in response.get('errors', []):
+            print(f"Retrieval service error: {error}")
+        return response.get('results', [])
+
+    def stats(self) -> Dict:
+        return self._request({'op': 'stats'})
+
+_client: Optional[RetrievalClient] = None
+
+def get_retrieval_client() -> Optional[RetrievalClient]:
+    """Cliente configurado por variables de entorno, o None si no hay servicio."""
+    global _client
+    address = os.environ.get(SERVICE_ENV)
+    if not address:
+        return None
+    if _client is None:
+        host, port = parse_address(address)
+        _client = RetrievalClient((host, port), get_authkey(host))
+    return _client
+
+class RemoteVectorStore(VectorStore):
+    """
+    Vectorstore de un documento servido por el servicio de búsqueda.
+
+    Es de solo lectura: los fragmentos se indexan al subir el documento
+    y el servicio solo los consulta.
+    """
+
+    # El servicio devuelve similitud coseno
+    scores_are_cosine = True
+
+    def __init__(self, doc_hash: str, embedding_function: Embeddings, client: RetrievalClient):
+        self.doc_hash = doc_hash
+        self.client = client
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[Dict]] = None, **kwargs: Any) -> "RemoteVectorStore":
+        raise TypeError(
+            "RemoteVectorStore es de solo lectura: los documentos se indexan al subirlos "
+            "(pages/4_📤_upload.py), no a través del servicio de búsqueda"
+        )
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: List[float], k: int = 4,
+                                                          filter: Optional[Dict] = None,
+                                                          **kwargs: Any) -> List[Tuple[Document, float]]:
+        results = self.client.search([self.doc_hash], embedding, k, filter)
+        return [
+            (Document(page_content=r['content'], metadata=r['metadata']), r['score'])
+            for r in results[:k]
+        ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio de búsqueda vectorial por shards")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Procesos trabajadores")
+    parser.add_argument("--host", default="127.0.0.1", help="Dirección de escucha")
+    parser.add_argument("--port", type=int, default=8765, help="Puerto de escucha")
+    args = parser.parse_args()
+
+    try:
+        authkey = get_authkey(args.host)
+    except ValueError as e:
+        parser.error(str(e))
+    service = RetrievalService(args.workers, (args.host, args.port), authkey)
+    service.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# utils/thumbnails.py
+"""
+Miniaturas de las vistas previas para las tarjetas del catálogo.
+
+La vista previa de cada documento es la primera página a 2x en PNG;
+mostrarla tal cual en la grilla enviaba cientos de megabytes por visita.
+Aquí se genera una miniatura JPEG del ancho de la tarjeta, guardada en
+`data/thumbnails/` con el hash del contenido de la vista previa como
+nombre: si la imagen cambia, cambia la URL, así que el navegador puede
+guardarla sin volver a pedirla. El servidor de descargas las entrega con
+encabezados de caché de larga duración.
+"""
+import os
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+from utils.file_server import image_url
+
+THUMBNAIL_WIDTH = 360
+THUMBNAIL_QUALITY = 80
+
+class ThumbnailCache:
+    """Miniaturas direccionadas por contenido, compartidas por el proceso."""
+
+    def __init__(self, cache_dir: str = os.path.join("data", "thumbnails"),
+                 width: int = THUMBNAIL_WIDTH):
+        self.CACHE_DIR = cache_dir
+        self.width = width
+        os.makedirs(self.CACHE_DIR, exist_ok=True)
+
+        # (ruta, tamaño, fecha) de la vista previa -> miniatura y sus dimensiones
+        self._thumbnails: Dict[Tuple, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _content_hash(self, source_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(source_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _create(self, source_path: str, path: str) -> Tuple[int, int]:
+        from PIL import Image
+
+        with Image.open(source_path) as image:
+            image = image.convert("RGB")
+            if image.width > self.width:
+                height = round(image.height * self.width / image.width)
+                image = image.resize((self.width, height), Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            image.save(tmp_path, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+            os.replace(tmp_path, path)
+            return image.size
+
+    def thumbnail(self, source_path: str) -> Optional[Dict]:
+        """
+        Miniatura de una imagen: `{'path', 'width', 'height'}`. La vista
+        previa se lee una sola vez por versión del archivo.
+        """
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return None
+        key = (os.path.abspath(source_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._thumbnails.get(key)
+        if cached is not None:
+            return cached
+
+        content_hash = self._content_hash(source_path)
+        path = os.path.join(self.CACHE_DIR, content_hash[:2], f"{content_hash}_{self.width}.jpg")
+        if os.path.exists(path):
+            from PIL import Image
+            with Image.open(path) as image:
+                size = image.size
+        else:
+            size = self._create(source_path, path)
+
+        thumbnail = {'path': path, 'width': size[0], 'height': size[1]}
+        with self._lock:
+            return self._thumbnails.setdefault(key, thumbnail)
+
+    def img_tag(self, source_path: str, base_url: str, css_class: str = "preview-image") -> str:
+        """
+        `<img>` de la miniatura con carga diferida: el navegador la pide
+        solo cuando la tarjeta está por entrar en pantalla. `base_url` es
+        la del servidor de descargas (`file_server.get_base_url`).
+        """
+        try:
+            thumbnail = self.thumbnail(source_path)
+            url = image_url(thumbnail['path'], base_url) if thumbnail else None
+        except Exception as e:
+            print(f"Error creating thumbnail for {source_path}: {str(e)}")
+            return ""
+        if not url:
+            return ""
+        return (
+            f'<img src="{url}" loading="lazy" decoding="async" class="{css_class}" '
+            f'width="{thumbnail["width"]}" height="{thumbnail["height"]}" '
+            f'style="width: 100%; height: auto;" alt="" />'
+        )
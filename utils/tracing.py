@@ -0,0 +1,393 @@
+# utils/tracing.py
+"""
+Trazas de latencia por solicitud.
+
+Cada ejecución de una página de chat abre un span raíz y las etapas
+(búsqueda, embeddings, llamadas al modelo, guardado del historial) abren
+spans hijos. Los spans terminados se escriben en segundo plano en
+`data/traces/spans.jsonl`, una línea por lote en el formato JSON de OTLP
+(`ExportTraceServiceRequest`), el mismo que produce el exportador de
+archivos del OpenTelemetry Collector.
+
+`YACHANI_TRACE_FILE` cambia la ruta del archivo; `YACHANI_TRACING=0`
+desactiva las trazas.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACE_FILE_ENV = "YACHANI_TRACE_FILE"
+TRACING_ENV = "YACHANI_TRACING"
+
+DEFAULT_TRACE_FILE = os.path.join("data", "traces", "spans.jsonl")
+
+# Al superar este tamaño el archivo se rota a `<archivo>.1`
+MAX_TRACE_FILE_BYTES = 50 * 1024 * 1024
+
+# Bloques de lectura del archivo de trazas (desde el final)
+READ_BLOCK_BYTES = 1024 * 1024
+
+# Margen al cortar la lectura por tiempo: procesos distintos escriben sus
+# lotes con un pequeño desfase
+SPAN_ORDER_SLACK_NS = 60 * 10 ** 9
+
+SERVICE_NAME = "yachani"
+SCOPE_NAME = "utils.tracing"
+
+# Tipos de span de OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+def _attribute_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+class Span:
+    """Un tramo medido de una solicitud."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None,
+                 kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else ""
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = STATUS_OK
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {str(error)}"
+
+    def to_otlp(self) -> Dict:
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or self.start_ns),
+            'attributes': [
+                {'key': key, 'value': _attribute_value(value)}
+                for key, value in self.attributes.items() if value is not None
+            ],
+            'status': {'code': self.status, 'message': self.status_message}
+        }
+
+class TraceWriter:
+    """Escribe los spans terminados en el archivo de trazas desde un hilo."""
+
+    def __init__(self, trace_file: str):
+        self.TRACE_FILE = trace_file
+        self._queue: "queue.Queue[Span]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def flush(self) -> None:
+        self._queue.join()
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Error writing traces: {str(e)}")
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, spans: List[Span]) -> None:
+        os.makedirs(os.path.dirname(self.TRACE_FILE) or ".", exist_ok=True)
+        if os.path.exists(self.TRACE_FILE) and os.path.getsize(self.TRACE_FILE) > MAX_TRACE_FILE_BYTES:
+            os.replace(self.TRACE_FILE, self.TRACE_FILE + ".1")
+
+        request = {
+            'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': "service.name", 'value': {'stringValue': SERVICE_NAME}},
+                    {'key': "process.pid", 'value': {'intValue': str(os.getpid())}}
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': SCOPE_NAME},
+                    'spans': [span.to_otlp() for span in spans]
+                }]
+            }]
+        }
+        with open(self.TRACE_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+_writer: Optional[TraceWriter] = None
+_writer_lock = threading.Lock()
+
+def tracing_enabled() -> bool:
+    return os.environ.get(TRACING_ENV, "1") != "0"
+
+def get_trace_file() -> str:
+    return os.environ.get(TRACE_FILE_ENV) or DEFAULT_TRACE_FILE
+
+def get_writer() -> Optional[TraceWriter]:
+    """Escritor compartido por el proceso (None si las trazas están desactivadas)."""
+    global _writer
+    if not tracing_enabled():
+        return None
+    with _writer_lock:
+        if _writer is None:
+            _writer = TraceWriter(get_trace_file())
+        return _writer
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def set_attribute(key: str, value: Any) -> None:
+    """Agregar un atributo al span actual, si hay uno."""
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, parent: Optional[Span] = None,
+         **attributes) -> Iterator[Optional[Span]]:
+    """
+    Medir un bloque como span hijo del span actual (o raíz si no hay).
+    Las excepciones se registran en el span y se propagan.
+    """
+    writer = get_writer()
+    if writer is None:
+        yield None
+        return
+
+    current = Span(name, parent or _current_span.get(), kind, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        # st.rerun() y st.stop() se implementan con excepciones: no son errores
+        if not any(c.__name__ == "ScriptControlException" for c in type(e).__mro__):
+            current.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        writer.export(current)
+
+def traced(name: str, **attributes) -> Callable:
+    """Decorador equivalente a envolver la función en `span(name)`."""
+    def decorator(func: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+def propagate(func: Callable) -> Callable:
+    """
+    Ejecutar `func` en otro hilo con el span actual como padre. Los hilos
+    nuevos no heredan las variables de contexto.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Abre un span por cada llamada al modelo dentro del agente o la cadena."""
+
+    def __init__(self):
+        self._spans: Dict[UUID, Span] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, serialized: Optional[Dict], kind: str, **kwargs: Any) -> None:
+        writer = get_writer()
+        if writer is None:
+            return
+        params = kwargs.get('invocation_params') or {}
+        model = params.get('model') or params.get('model_name') or ((serialized or {}).get('kwargs') or {}).get('model')
+        llm_span = Span("llm", _current_span.get(), SPAN_KIND_CLIENT, {
+            'llm.kind': kind,
+            'llm.model': model
+        })
+        with self._lock:
+            self._spans[run_id] = llm_span
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, tokens: Optional[int] = None) -> None:
+        with self._lock:
+            llm_span = self._spans.pop(run_id, None)
+        if llm_span is None:
+            return
+        if error is not None:
+            llm_span.record_error(error)
+        if tokens:
+            llm_span.set_attribute('llm.completion_tokens', tokens)
+        llm_span.end_ns = time.time_ns()
+        writer = get_writer()
+        if writer is not None:
+            writer.export(llm_span)
+
+    def on_llm_start(self, serialized: Dict, prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, serialized, "completion", **kwargs)
+
+    def on_chat_model_start(self, serialized: Dict, messages: List, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, serialized, "chat", **kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            llm_span = self._spans.get(run_id)
+        if llm_span is not None and 'llm.first_token_ms' not in llm_span.attributes:
+            llm_span.set_attribute('llm.first_token_ms', (time.time_ns() - llm_span.start_ns) / 1e6)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        usage = (getattr(response, 'llm_output', None) or {}).get('token_usage') or {}
+        self._end(run_id, tokens=usage.get('completion_tokens'))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=error)
+
+def _lines_from_end(path: str, max_bytes: Optional[int]) -> Iterator[bytes]:
+    """Líneas completas de un archivo, de la última a la primera, leídas por bloques."""
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        limit = 0 if max_bytes is None else max(0, position - max_bytes)
+        remainder = b""
+        while position > limit:
+            size = min(READ_BLOCK_BYTES, position - limit)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b"\n")
+            # La primera puede estar cortada: se completa con el bloque anterior
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder and limit == 0:
+            yield remainder
+
+def _parse_spans(line: bytes) -> List[Dict]:
+    try:
+        request = json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return []
+    spans = []
+    for resource_spans in request.get('resourceSpans', []):
+        for scope_spans in resource_spans.get('scopeSpans', []):
+            for item in scope_spans.get('spans', []):
+                start, end = int(item['startTimeUnixNano']), int(item['endTimeUnixNano'])
+                spans.append({
+                    'name': item['name'],
+                    'trace_id': item['traceId'],
+                    'span_id': item['spanId'],
+                    'parent_span_id': item.get('parentSpanId', ""),
+                    'start_ns': start,
+                    'end_ns': end,
+                    'duration_ms': (end - start) / 1e6,
+                    'error': item.get('status', {}).get('code') == STATUS_ERROR,
+                    'attributes': {
+                        a['key']: next(iter(a['value'].values()), None)
+                        for a in item.get('attributes', [])
+                    }
+                })
+    return spans
+
+def read_spans(trace_file: Optional[str] = None, limit: Optional[int] = None,
+               since_ns: Optional[int] = None, max_bytes: Optional[int] = None) -> List[Dict]:
+    """
+    Leer los spans del archivo de trazas (y del rotado) como diccionarios
+    planos: name, trace_id, parent_span_id, duration_ms, start_ns, status,
+    attributes.
+
+    Los archivos se leen desde el final: `since_ns` detiene la lectura al
+    llegar a lotes anteriores a ese instante y `max_bytes` limita los
+    bytes leídos entre ambos archivos, así que el costo depende del
+    periodo pedido y no del tamaño del archivo.
+    """
+    trace_file = trace_file or get_trace_file()
+    batches = []
+    remaining = max_bytes
+    for path in [trace_file, trace_file + ".1"]:
+        if remaining is not None and remaining <= 0:
+            break
+        if not os.path.exists(path):
+            continue
+        finished = False
+        for line in _lines_from_end(path, remaining):
+            if remaining is not None:
+                remaining -= len(line) + 1
+            spans = _parse_spans(line)
+            # Los lotes se escriben al terminar sus spans: en orden de fin
+            if since_ns is not None and spans and max(s['end_ns'] for s in spans) < since_ns - SPAN_ORDER_SLACK_NS:
+                finished = True
+                break
+            batches.append(spans)
+        if finished:
+            break
+
+    spans = [item for batch in reversed(batches) for item in batch]
+    if since_ns is not None:
+        spans = [s for s in spans if s['start_ns'] >= since_ns]
+    if limit is not None:
+        spans = spans[-limit:]
+    return spans
+
+def turn_trace_ids(spans: List[Dict]) -> set:
+    """Trazas cuyo span raíz respondió una consulta del chat."""
+    return {
+        s['trace_id'] for s in spans
+        if not s['parent_span_id'] and s['attributes'].get('chat.turn')
+    }
+
+def summarize_spans(spans: List[Dict]) -> List[Dict]:
+    """Percentiles de latencia por etapa (nombre del span), de la más lenta a la más rápida."""
+    by_name: Dict[str, List[Dict]] = {}
+    for item in spans:
+        by_name.setdefault(item['name'], []).append(item)
+
+    rows = []
+    for name, items in by_name.items():
+        durations = np.array([item['duration_ms'] for item in items])
+        rows.append({
+            'etapa': name,
+            'spans': len(items),
+            'p50_ms': float(np.percentile(durations, 50)),
+            'p95_ms': float(np.percentile(durations, 95)),
+            'p99_ms': float(np.percentile(durations, 99)),
+            'max_ms': float(durations.max()),
+            'errores_pct': 100 * sum(item['error'] for item in items) / len(items)
+        })
+    return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
@@ -0,0 +1,64 @@
+# utils/transcript.py
+"""
+Transcripción de los chats.
+
+Cada rerun de Streamlit vuelve a dibujar la conversación completa; en
+sesiones de tutoría de cientos de turnos eso hace lenta cada pregunta.
+Aquí se muestra solo la ventana de los últimos mensajes, con un botón
+para cargar los anteriores.
+
+La transcripción es un fragmento: cargar mensajes anteriores vuelve a
+ejecutar solo el fragmento, no la página con el agente y los documentos.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import streamlit as st
+
+from utils.context_builder import format_token_report
+
+# Mensajes visibles al abrir el chat, y cuántos más agrega cada "cargar anteriores"
+TRANSCRIPT_WINDOW = 20
+
+WINDOW_KEY = "transcript_window"
+
+def format_timestamp(timestamp: str) -> str:
+    """Formatea un timestamp para mostrar."""
+    dt = datetime.fromisoformat(timestamp)
+    return dt.strftime("%d/%m/%Y %H:%M")
+
+def show_chat_message(message: Dict, show_timestamp: bool = True):
+    """Muestra un mensaje del chat con formato mejorado."""
+    with st.chat_message(message["role"]):
+        if show_timestamp and message.get("timestamp"):
+            st.caption(format_timestamp(message["timestamp"]))
+        st.markdown(message["content"])
+        if message.get("sources"):
+            st.caption(f"📚 Fuentes: {', '.join(message['sources'])}")
+        if message.get("tokens"):
+            st.caption(format_token_report(message["tokens"]))
+
+def load_earlier(visible: int):
+    st.session_state[WINDOW_KEY] = visible
+
+@st.fragment
+def show_transcript(messages: List[Dict], window: Optional[int] = None):
+    """Últimos mensajes de la conversación, con botón para ver los anteriores."""
+    visible = st.session_state.get(WINDOW_KEY, window or TRANSCRIPT_WINDOW)
+    hidden = max(0, len(messages) - visible)
+
+    if hidden:
+        # El callback amplía la ventana antes de que el fragmento se vuelva a ejecutar
+        st.button(
+            f"⬆️ Cargar mensajes anteriores ({hidden} ocultos)",
+            key="transcript_load_earlier",
+            on_click=load_earlier,
+            args=(visible + (window or TRANSCRIPT_WINDOW),)
+        )
+
+    for message in messages[hidden:]:
+        show_chat_message(message)
+
+def reset_transcript():
+    """Volver a la ventana inicial al cambiar de conversación."""
+    st.session_state.pop(WINDOW_KEY, None)
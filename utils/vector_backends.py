@@ -0,0 +1,126 @@
+# utils/vector_backends.py
+import os
+from typing import Dict, List, Optional, Tuple
+
+from langchain_chroma import Chroma
+from utils.numpy_store import NumpyVectorStore, NUMPY_INDEX_DIR
+from utils.quantized_store import QuantizedVectorStore
+
+DEFAULT_BACKEND = "chroma"
+
+# Motores de búsqueda disponibles por documento
+VECTOR_BACKENDS = {
+    "chroma": "Chroma (HNSW)",
+    "numpy": "NumPy exacto (float32)",
+    "numpy_f16": "NumPy exacto (float16)",
+    "int8": "Cuantizado int8 + re-puntuación",
+    "pq": "Product quantization + re-puntuación"
+}
+
+NUMPY_DTYPES = {
+    "numpy": "float32",
+    "numpy_f16": "float16"
+}
+
+QUANTIZED_BACKENDS = ["int8", "pq"]
+
+def get_numpy_index_dir(vectorstore_path: str, backend: str) -> str:
+    """Ruta del índice NumPy de un documento para el motor indicado."""
+    if backend in QUANTIZED_BACKENDS:
+        return os.path.join(vectorstore_path, f"{NUMPY_INDEX_DIR}_{backend}")
+    suffix = "" if NUMPY_DTYPES[backend] == "float32" else f"_{NUMPY_DTYPES[backend]}"
+    return os.path.join(vectorstore_path, f"{NUMPY_INDEX_DIR}{suffix}")
+
+def index_source(chroma_store, processed_date: Optional[str]) -> Dict:
+    """
+    Versión del documento de la que se genera un índice: fragmentos en
+    Chroma y fecha de procesamiento. Si cambia (el documento se volvió a
+    subir), el índice guardado ya no sirve.
+    """
+    return {'count': chroma_store._collection.count(), 'processed_date': processed_date}
+
+def build_backend_index(vectorstore_path: str, backend: str, embedding_function,
+                        chroma_store=None, processed_date: Optional[str] = None) -> None:
+    """Generar el índice de un motor a partir del vectorstore Chroma del documento."""
+    if backend not in NUMPY_DTYPES and backend not in QUANTIZED_BACKENDS:
+        return
+    if chroma_store is None:
+        chroma_store = Chroma(persist_directory=vectorstore_path, embedding_function=embedding_function)
+
+    index_dir = get_numpy_index_dir(vectorstore_path, backend)
+    source = index_source(chroma_store, processed_date)
+    if backend in QUANTIZED_BACKENDS:
+        QuantizedVectorStore.from_chroma(chroma_store, index_dir, method=backend, source=source)
+    else:
+        NumpyVectorStore.from_chroma(chroma_store, index_dir, dtype=NUMPY_DTYPES[backend], source=source)
+
+def _open_backend_index(index_dir: str, backend: str, embedding_function) -> NumpyVectorStore:
+    if backend in QUANTIZED_BACKENDS:
+        return QuantizedVectorStore(index_dir, embedding_function)
+    return NumpyVectorStore(index_dir, embedding_function)
+
+def load_vectorstore(doc: Dict, embedding_function):
+    """
+    Abrir el vectorstore de un documento con el motor configurado.
+    Si el índice del motor no existe o se generó de otra versión del
+    documento, se genera desde Chroma; si falla, se usa Chroma.
+    """
+    vectorstore_path = doc['vectorstore_path']
+    backend = doc.get('vector_backend', DEFAULT_BACKEND)
+    chroma_store = Chroma(persist_directory=vectorstore_path, embedding_function=embedding_function)
+
+    if backend in NUMPY_DTYPES or backend in QUANTIZED_BACKENDS:
+        index_dir = get_numpy_index_dir(vectorstore_path, backend)
+        try:
+            source = index_source(chroma_store, doc.get('processed_date'))
+            store = None
+            if os.path.exists(index_dir):
+                try:
+                    store = _open_backend_index(index_dir, backend, embedding_function)
+                except Exception as e:
+                    # Índice de un formato anterior o incompleto: se vuelve a generar
+                    print(f"Error opening {backend} index for {vectorstore_path}, rebuilding: {str(e)}")
+            if store is None or store.source != source:
+                build_backend_index(
+                    vectorstore_path, backend, embedding_function,
+                    chroma_store=chroma_store, processed_date=doc.get('processed_date')
+                )
+                store = _open_backend_index(index_dir, backend, embedding_function)
+            return store
+        except Exception as e:
+            print(f"Error loading {backend} index for {vectorstore_path}, using Chroma: {str(e)}")
+
+    return chroma_store
+
+def page_filter(pages: List[int]) -> Dict:
+    """Filtro de metadatos por número de página (desde 0)."""
+    return {"page": {"$in": pages}}
+
+def adapt_filter(vectorstore, filter: Optional[Dict]) -> Optional[Dict]:
+    """Traducir el filtro de páginas a condiciones que soporta Chroma 0.4."""
+    if not filter or getattr(vectorstore, 'scores_are_cosine', False):
+        return filter
+    expected = filter.get("page")
+    if list(filter) == ["page"] and isinstance(expected, dict) and "$in" in expected:
+        pages = expected["$in"]
+        if len(pages) == 1:
+            return {"page": pages[0]}
+        return {"$or": [{"page": page} for page in pages]}
+    return filter
+
+def similarity_search_by_vector_with_cosine(vectorstore, embedding: List[float], k: int,
+                                            filter: Optional[Dict] = None) -> List[Tuple]:
+    """
+    Búsqueda con puntajes de similitud coseno sin importar el motor.
+    Chroma devuelve distancias, que se convierten según el espacio de la colección.
+    """
+    filter = adapt_filter(vectorstore, filter)
+    if getattr(vectorstore, 'scores_are_cosine', False):
+        return vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k, filter=filter)
+
+    scored = vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter)
+    space = (vectorstore._collection.metadata or {}).get("hnsw:space", "l2")
+    if space == "l2":
+        # Distancia L2 al cuadrado entre vectores normalizados
+        return [(doc, 1 - distance / 2) for doc, distance in scored]
+    return [(doc, 1 - distance) for doc, distance in scored]